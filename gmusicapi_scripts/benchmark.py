@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Benchmarks of gmusicapi-scripts against a local mock Google Music library.
+Run with python -m gmusicapi_scripts.benchmark.
+More information at https://github.com/thebigmunch/gmusicapi-scripts.
+
+Usage:
+  gmusicapi_scripts.benchmark (-h | --help)
+  gmusicapi_scripts.benchmark [options] [<case>]...
+
+Arguments:
+  case                                  Cases to run. Defaults to all phases, scripts, memory cases and startups.
+                                        Phases: listing, scan, diff, download, upload.
+                                        Scripts: gmsearch, gmdelete, gmdownload, gmupload, gmsync-up, gmsync-down.
+                                        Memory: memory-full, memory-compact.
+                                        Startups: startup-gm, startup-delete, startup-download, startup-search,
+                                        startup-sync, startup-upload.
+                                        Walks (not run by default): walk, walk-wrapper.
+
+Options:
+  -h, --help                            Display help message.
+  -s SIZE, --size SIZE                  Number of songs in the mock Google Music library. [Default: 10000]
+  --local COUNT                         Number of local songs that are also in the Google Music library. [Default: 1000]
+  --transfer COUNT                      Number of songs to upload, download or delete. [Default: 100]
+  --latency SECONDS                     Seconds added to every mock Google Music call. [Default: 0]
+  --error-rate RATE                     Probability of a mock Google Music call failing. [Default: 0]
+  --quota RATE                          Calls of each kind per second the mock Google Music library allows
+                                        before throttling them. Default: No limit.
+  --concurrency-quota COUNT             Calls the mock Google Music library allows in flight at once
+                                        before throttling them. Default: No limit.
+  --tree COUNT                          Number of files in the synthetic directory tree of walk cases. [Default: 1000000]
+  --song-size SIZE                      Size of downloaded songs. Accepts K, M and G suffixes. [Default: 64K]
+  -j JOBS, --jobs JOBS                  Number of songs to transfer and processes to scan with at once. [Default: 1]
+  -r COUNT, --repeat COUNT              Number of times to run each case. [Default: 1]
+  --seed SEED                           Seed of the mock library's song ids and error injection. [Default: 0]
+  -o FILE, --output FILE                Write JSON results to FILE instead of standard output.
+
+Each case runs in a fresh process with empty caches.
+Results include wall time, peak resident set size of the case process and operations (songs) per second,
+and the number of mock calls made and throttled.
+Memory cases load a Mobileclient library listing as full song dicts or as compact records
+and report how much the peak resident set size grew while loading it.
+Startup cases time gm <command> --help in a new interpreter and list the heavy modules it imported.
+Walk cases list the song files of a synthetic tree of empty files with excluded Podcasts and .stversions directories,
+with the pruning walker of local scans (walk) or gmusicapi-wrapper's walk and a regex check per file (walk-wrapper).
+"""
+
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from docopt import docopt
+
+from gmusicapi_scripts import __version__
+from gmusicapi_scripts.snapshot import COMPACT_FIELDS
+from gmusicapi_scripts.stats import peak_rss
+from gmusicapi_scripts.utils import parse_size
+
+logger = logging.getLogger('gmusicapi_wrapper')
+sh = logging.StreamHandler()
+logger.addHandler(sh)
+
+PHASES = ['listing', 'scan', 'diff', 'download', 'upload']
+SCRIPTS = ['gmsearch', 'gmdelete', 'gmdownload', 'gmupload', 'gmsync-up', 'gmsync-down']
+MEMORY = ['memory-full', 'memory-compact']
+STARTUPS = ['startup-gm', 'startup-delete', 'startup-download', 'startup-search', 'startup-sync', 'startup-upload']
+WALKS = ['walk', 'walk-wrapper']
+
+# Modules gm should only import when a command needs them.
+HEAVY_MODULES = ['gmusicapi', 'gmusicapi_wrapper', 'mutagen', 'watchdog']
+
+STARTUP_CODE = """
+import sys
+sys.argv = {argv!r}
+from gmusicapi_scripts import gm
+try:
+	gm.main()
+except SystemExit:
+	pass
+sys.stderr.write(" ".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+TEMPLATE = '%artist%/%album%/%track% - %title%'
+
+# Exclude patterns of walk cases, matching directories of the synthetic tree.
+WALK_EXCLUDE = ['/Podcasts/', r'/\.stversions/']
+
+
+class Case:
+	"""State of a benchmark case running in its own process."""
+
+	def __init__(self, name, params, workdir, run):
+		from gmusicapi_scripts.mock import MockBackend
+		from gmusicapi_scripts.scheduler import Scheduler
+
+		self.name = name
+		self.params = params
+		self.library = os.path.join(workdir, 'library')
+		self.tree = os.path.join(workdir, 'tree')
+		self.new_songs = os.path.join(self.library, 'new')
+		self.downloads = os.path.join(workdir, 'downloads', '{0}-{1}'.format(name, run))
+
+		self.backend = MockBackend(
+			size=params['size'], latency=params['latency'], error_rate=params['error-rate'],
+			song_size=params['song-size'], seed=params['seed'], quota=params['quota'],
+			concurrency_quota=params['concurrency-quota']
+		)
+
+		self.wall = None
+		self.extra = {}
+
+		# Phase cases share adaptive rate limits like a script run, without persisting them.
+		self.scheduler = Scheduler()
+
+	@property
+	def selected(self):
+		"""Number of Google Music songs matched by :attr:`artist_filter`."""
+
+		return min(self.params['size'], math.ceil(self.params['transfer'] / 100) * 100)
+
+	@property
+	def artist_filter(self):
+		"""A filter selecting about ``transfer`` songs of the mock library by artist."""
+
+		artists = range(math.ceil(self.params['transfer'] / 100))
+
+		return "artist:^Artist ({})$".format("|".join('{:05d}'.format(artist) for artist in artists))
+
+	@contextmanager
+	def timed(self):
+		start = time.perf_counter()
+
+		try:
+			yield
+		finally:
+			self.wall = time.perf_counter() - start
+
+	def google_songs(self):
+		from gmusicapi_scripts.mock import MockMusicManagerWrapper
+		from gmusicapi_scripts.snapshot import LibrarySnapshot, get_default_snapshot_path, get_google_songs
+
+		with LibrarySnapshot(get_default_snapshot_path('benchmark')) as snapshot:
+			songs, _ = get_google_songs(MockMusicManagerWrapper(self.backend), snapshot, scheduler=self.scheduler)
+
+		return songs
+
+	def script(self, module, *args):
+		"""Run a script's main function with command line arguments."""
+
+		argv = sys.argv
+
+		sys.argv = [module.__name__.rpartition('.')[2], '--no-daemon'] + list(args)
+
+		try:
+			with self.backend.installed(), self.timed():
+				module.main()
+		except SystemExit as e:
+			if e.code:
+				raise
+		finally:
+			sys.argv = argv
+
+
+def _listing(case):
+	with case.timed():
+		songs = case.google_songs()
+
+	return len(songs)
+
+
+def _scan(case):
+	from gmusicapi_scripts.scan import get_local_songs
+
+	with case.timed():
+		songs, _, _ = get_local_songs([case.library], scan_jobs=case.params['jobs'])
+
+	return len(songs)
+
+
+def _diff(case):
+	from gmusicapi_scripts.diff import diff_collections
+	from gmusicapi_scripts.index import ScanIndex, get_default_index_path
+	from gmusicapi_scripts.scan import get_local_songs
+
+	google_songs = case.google_songs()
+
+	with ScanIndex(get_default_index_path()) as index:
+		local_songs, _, _ = get_local_songs([case.library], index=index)
+
+		with case.timed():
+			diff_collections(local_songs, google_songs, get_metadata=index.metadata)
+
+	return len(local_songs) + len(google_songs)
+
+
+def _download(case):
+	from gmusicapi_scripts.mock import MockMusicmanager
+	from gmusicapi_scripts.transfer import download_songs
+
+	songs = case.google_songs()[:case.params['transfer']]
+
+	with case.timed():
+		download_songs(
+			MockMusicmanager(case.backend), songs, template=os.path.join(case.downloads, TEMPLATE),
+			jobs=case.params['jobs'], backoff=0, scheduler=case.scheduler
+		)
+
+	return len(songs)
+
+
+def _upload(case):
+	from gmusicapi_scripts.mock import MockMusicmanager
+	from gmusicapi_scripts.scan import get_local_songs
+	from gmusicapi_scripts.transfer import upload_songs
+
+	filepaths, _, _ = get_local_songs([case.new_songs])
+
+	with case.timed():
+		upload_songs(
+			MockMusicmanager(case.backend), filepaths, jobs=case.params['jobs'], retries=3, backoff=0, scheduler=case.scheduler
+		)
+
+	return len(filepaths)
+
+
+def _gmsearch(case):
+	from gmusicapi_scripts import gmsearch
+
+	case.script(gmsearch, '-q', '-y')
+
+	return case.params['size']
+
+
+def _gmdelete(case):
+	from gmusicapi_scripts import gmdelete
+
+	case.script(gmdelete, '-q', '-y', '-f', case.artist_filter, '-j', str(case.params['jobs']))
+
+	return case.selected
+
+
+def _gmdownload(case):
+	from gmusicapi_scripts import gmdownload
+
+	case.script(
+		gmdownload, '-q', '-f', case.artist_filter, '-j', str(case.params['jobs']), os.path.join(case.downloads, TEMPLATE)
+	)
+
+	return case.selected
+
+
+def _gmupload(case):
+	from gmusicapi_scripts import gmupload
+
+	case.script(gmupload, '-q', '-j', str(case.params['jobs']), '--scan-jobs', str(case.params['jobs']), case.new_songs)
+
+	return case.params['transfer']
+
+
+def _gmsync_up(case):
+	from gmusicapi_scripts import gmsync
+
+	case.script(gmsync, 'up', '-q', '-j', str(case.params['jobs']), '--scan-jobs', str(case.params['jobs']), case.library)
+
+	return case.params['transfer']
+
+
+def _gmsync_down(case):
+	from gmusicapi_scripts import gmsync
+
+	case.script(
+		gmsync, 'down', '-q', '-f', case.artist_filter, '-j', str(case.params['jobs']), os.path.join(case.downloads, TEMPLATE)
+	)
+
+	return case.selected
+
+
+def _walk(case):
+	from gmusicapi_wrapper import SUPPORTED_SONG_FORMATS
+	from gmusicapi_scripts.scan import ExcludeMatcher, ScanStats, walk_filepaths
+
+	exclude = ExcludeMatcher(WALK_EXCLUDE)
+	scan_stats = ScanStats()
+
+	with case.timed():
+		for _ in walk_filepaths([case.tree], SUPPORTED_SONG_FORMATS, exclude=exclude, stats=scan_stats):
+			pass
+
+	case.extra['scan_stats'] = scan_stats.as_dict()
+
+	return case.params['tree']
+
+
+def _walk_wrapper(case):
+	from gmusicapi_wrapper import SUPPORTED_SONG_FORMATS
+	from gmusicapi_wrapper.utils import exclude_filepaths, get_supported_filepaths
+
+	with case.timed():
+		exclude_filepaths(get_supported_filepaths([case.tree], SUPPORTED_SONG_FORMATS), exclude_patterns=WALK_EXCLUDE)
+
+	return case.params['tree']
+
+
+def _memory(fields):
+	def memory(case):
+		from gmusicapi_scripts.mock import MockMobileClientWrapper
+		from gmusicapi_scripts.snapshot import LibrarySnapshot, get_default_snapshot_path, get_google_songs
+
+		baseline = peak_rss()
+
+		with LibrarySnapshot(get_default_snapshot_path('benchmark')) as snapshot, case.timed():
+			songs, _ = get_google_songs(MockMobileClientWrapper(case.backend), snapshot, fields=fields)
+
+		rss = peak_rss()
+		case.extra['rss_growth'] = rss - baseline if rss is not None else None
+
+		return len(songs)
+
+	return memory
+
+
+def _startup(command):
+	def startup(case):
+		argv = ['gm'] + ([command] if command else []) + ['--help']
+		code = STARTUP_CODE.format(argv=argv, heavy=HEAVY_MODULES)
+
+		with case.timed():
+			process = subprocess.Popen(
+				[sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True
+			)
+			_, stderr = process.communicate()
+
+		if process.returncode:
+			raise RuntimeError("gm {0} --help exited with {1}".format(command or '', process.returncode))
+
+		case.extra['imported'] = stderr.split()
+
+		return 1
+
+	return startup
+
+
+CASES = {
+	'listing': _listing, 'scan': _scan, 'diff': _diff, 'download': _download, 'upload': _upload,
+	'gmsearch': _gmsearch, 'gmdelete': _gmdelete, 'gmdownload': _gmdownload, 'gmupload': _gmupload,
+	'gmsync-up': _gmsync_up, 'gmsync-down': _gmsync_down
+}
+
+CASES.update({'memory-full': _memory(None), 'memory-compact': _memory(COMPACT_FIELDS)})
+
+CASES.update({'walk': _walk, 'walk-wrapper': _walk_wrapper})
+
+CASES.update(
+	(name, _startup(name.partition('-')[2] if name != 'startup-gm' else None)) for name in STARTUPS
+)
+
+
+def run_case(name, params, workdir, run=0):
+	"""Run a benchmark case. Meant to be run in a fresh process.
+
+	Returns:
+		A result dict.
+	"""
+
+	cache = os.path.join(workdir, 'cache', '{0}-{1}'.format(name, run))
+	os.environ['XDG_CACHE_HOME'] = os.environ['LOCALAPPDATA'] = cache
+
+	# Keep script output out of the results while still paying for formatting it.
+	logger.removeHandler(sh)
+	sys.stderr = open(os.devnull, 'w')
+
+	case = Case(name, params, workdir, run)
+	kind = (
+		'phase' if name in PHASES else 'memory' if name in MEMORY else 'startup' if name in STARTUPS
+		else 'walk' if name in WALKS else 'script'
+	)
+	result = {'case': name, 'kind': kind, 'run': run}
+
+	try:
+		operations = CASES[name](case)
+	except Exception as e:
+		result['error'] = "{0}: {1}".format(type(e).__name__, e)
+		operations = 0
+
+	result.update({
+		'wall': case.wall,
+		'operations': operations,
+		'ops_per_sec': operations / case.wall if case.wall else None,
+		'peak_rss': peak_rss(),
+		'calls': dict(case.backend.calls),
+		'throttled': dict(case.backend.throttled)
+	})
+	result.update(case.extra)
+
+	return result
+
+
+def _run_case_process(queue, *args):
+	queue.put(run_case(*args))
+
+
+def main():
+	from gmusicapi_scripts.mock import write_synthetic_songs, write_synthetic_tree
+
+	cli = dict((key.lstrip("-<").rstrip(">"), value) for key, value in docopt(__doc__).items())
+
+	logger.setLevel(logging.INFO)
+
+	params = {
+		'size': int(cli['size']), 'local': int(cli['local']), 'transfer': int(cli['transfer']),
+		'latency': float(cli['latency']), 'error-rate': float(cli['error-rate']),
+		'song-size': parse_size(cli['song-size']), 'jobs': int(cli['jobs']), 'seed': int(cli['seed']),
+		'tree': int(cli['tree']),
+		'quota': float(cli['quota']) if cli['quota'] else None,
+		'concurrency-quota': int(cli['concurrency-quota']) if cli['concurrency-quota'] else None
+	}
+
+	cases = cli['case'] or PHASES + SCRIPTS + MEMORY + STARTUPS
+	unknown = [name for name in cases if name not in CASES]
+
+	if unknown:
+		sys.exit("Unknown benchmark case(s): {}".format(", ".join(unknown)))
+
+	started = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+	workdir = tempfile.mkdtemp(prefix='gmusicapi-scripts-benchmark-')
+	results = []
+
+	try:
+		library = os.path.join(workdir, 'library')
+		local = min(params['local'], params['size'])
+
+		if any(name in WALKS for name in cases):
+			logger.info("Writing a tree of {0} files to {1}".format(params['tree'], os.path.join(workdir, 'tree')))
+
+			params['tree'] = write_synthetic_tree(os.path.join(workdir, 'tree'), params['tree'])
+
+		if any(name not in STARTUPS + MEMORY + WALKS for name in cases):
+			logger.info("Writing {0} local songs to {1}".format(local + params['transfer'], library))
+
+			write_synthetic_songs(os.path.join(library, 'common'), range(local))
+			write_synthetic_songs(os.path.join(library, 'new'), range(params['size'], params['size'] + params['transfer']))
+
+		context = multiprocessing.get_context('spawn')
+
+		for name in cases:
+			for run in range(int(cli['repeat'])):
+				# Not a pool worker: cases may start their own worker processes.
+				queue = context.SimpleQueue()
+				process = context.Process(target=_run_case_process, args=(queue, name, params, workdir, run))
+				process.start()
+				result = queue.get()
+				process.join()
+
+				results.append(result)
+
+				if 'error' in result:
+					logger.info("{0:<12} error: {1}".format(name, result['error']))
+				elif result['kind'] == 'memory':
+					logger.info(
+						"{case:<16} {wall:>9.3f}s {operations:>8} songs {growth:>8.1f} MB growth".format(
+							growth=(result['rss_growth'] or 0) / 1000000, **result
+						)
+					)
+				elif result['kind'] == 'walk':
+					logger.info(
+						"{case:<16} {wall:>9.3f}s {ops_per_sec:>12.1f} files/s {rss:>8.1f} MB".format(
+							rss=(result['peak_rss'] or 0) / 1000000, **result
+						)
+					)
+				elif result['kind'] == 'startup':
+					logger.info(
+						"{0:<16} {1:>9.1f}ms imported: {2}".format(name, result['wall'] * 1000, ", ".join(result['imported']) or "-")
+					)
+				else:
+					logger.info(
+						"{case:<12} {wall:>9.3f}s {ops_per_sec:>12.1f} songs/s {rss:>8.1f} MB".format(
+							rss=(result['peak_rss'] or 0) / 1000000, **result
+						)
+					)
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	report = {
+		'version': __version__,
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'cpus': os.cpu_count(),
+		'started': started,
+		'params': params,
+		'results': results
+	}
+
+	if cli['output']:
+		with open(cli['output'], 'w') as f:
+			json.dump(report, f, indent=2, sort_keys=True)
+	else:
+		json.dump(report, sys.stdout, indent=2, sort_keys=True)
+		sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+	main()
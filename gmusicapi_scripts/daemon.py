@@ -0,0 +1,583 @@
+# coding=utf-8
+
+"""Session daemon holding authenticated Google Music clients between script runs.
+
+	>>> from gmusicapi_scripts.daemon import SessionWrapper
+"""
+
+import getpass
+import logging
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from . import __version__
+from .utils import get_cache_dir
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# gmusicapi client methods callable through the daemon by client kind.
+API_METHODS = {
+	'mobileclient': ('get_all_songs', 'delete_songs', 'is_authenticated'),
+	'musicmanager': ('get_uploaded_songs', 'get_purchased_songs', 'download_song', 'upload', 'is_authenticated')
+}
+
+HEADER = struct.Struct('!Q')
+
+
+def get_default_socket_path():
+	"""Get the session daemon socket path.
+
+	Returns:
+		``$GMD_SOCKET`` if set, otherwise ``gmd.sock`` in the gmusicapi-scripts cache directory.
+	"""
+
+	return os.environ.get('GMD_SOCKET') or os.path.join(get_cache_dir(), 'gmd.sock')
+
+
+def load_wrapper(kind):
+	"""Get gmusicapi-wrapper's wrapper class for a client kind.
+
+	gmusicapi is slow to import, so it is only imported when a script logs in without the daemon.
+	"""
+
+	from gmusicapi_wrapper import MobileClientWrapper, MusicManagerWrapper
+
+	return {'mobileclient': MobileClientWrapper, 'musicmanager': MusicManagerWrapper}[kind]
+
+
+class DaemonError(Exception):
+	"""The session daemon is not reachable or could not handle a request."""
+
+
+def _write_message(f, message):
+	data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+
+	f.write(HEADER.pack(len(data)))
+	f.write(data)
+	f.flush()
+
+
+def _read_message(f):
+	header = f.read(HEADER.size)
+
+	if len(header) < HEADER.size:
+		raise EOFError("Connection closed")
+
+	size, = HEADER.unpack(header)
+	data = f.read(size)
+
+	if len(data) < size:
+		raise EOFError("Connection closed")
+
+	return pickle.loads(data)
+
+
+def _session_key(kind, login_kwargs):
+	if kind == 'mobileclient':
+		return (kind, login_kwargs.get('username'), login_kwargs.get('android_id'))
+
+	return (kind, login_kwargs.get('oauth_filename', 'oauth'), login_kwargs.get('uploader_id'))
+
+
+def _absolute_paths(filepaths):
+	if isinstance(filepaths, str):
+		return os.path.abspath(filepaths)
+
+	return [os.path.abspath(filepath) for filepath in filepaths]
+
+
+class DaemonClient:
+	"""Connection to a session daemon. Each thread uses its own socket.
+
+	Parameters:
+		path (str): Path of the daemon's Unix socket. Default: :func:`get_default_socket_path`
+	"""
+
+	def __init__(self, path=None):
+		self.path = path or get_default_socket_path()
+
+		self._local = threading.local()
+		self._connections = []
+		self._lock = threading.Lock()
+
+	def _connection(self):
+		connection = getattr(self._local, 'connection', None)
+
+		if connection is None:
+			if not hasattr(socket, 'AF_UNIX'):
+				raise DaemonError("The session daemon needs Unix domain sockets.")
+
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+			try:
+				sock.connect(self.path)
+			except OSError as e:
+				sock.close()
+
+				raise DaemonError("Can't connect to session daemon at {0}: {1}".format(self.path, e))
+
+			connection = self._local.connection = (sock, sock.makefile('rwb'))
+
+			with self._lock:
+				self._connections.append(connection)
+
+		return connection
+
+	def _drop(self, connection):
+		self._local.connection = None
+
+		with self._lock:
+			if connection in self._connections:
+				self._connections.remove(connection)
+
+		sock, f = connection
+
+		try:
+			f.close()
+			sock.close()
+		except OSError:
+			pass
+
+	def request(self, *request):
+		"""Send a request to the daemon.
+
+		Returns:
+			The daemon's answer. Exceptions raised by the daemon are raised again.
+
+		Raises:
+			DaemonError: The daemon is not reachable or closed the connection.
+		"""
+
+		connection = self._connection()
+
+		try:
+			_write_message(connection[1], request)
+			succeeded, value = _read_message(connection[1])
+		except (OSError, EOFError, pickle.UnpicklingError) as e:
+			self._drop(connection)
+
+			raise DaemonError("Lost connection to session daemon: {}".format(e))
+
+		if not succeeded:
+			raise value
+
+		return value
+
+	def close(self):
+		"""Close the connections of all threads."""
+
+		with self._lock:
+			connections, self._connections = self._connections, []
+
+		for sock, f in connections:
+			try:
+				f.close()
+				sock.close()
+			except OSError:
+				pass
+
+		self._local = threading.local()
+
+
+def ping(path=None):
+	"""Check whether a session daemon is listening.
+
+	Returns:
+		The daemon's gmusicapi-scripts version or ``None`` if no daemon answered.
+	"""
+
+	client = DaemonClient(path)
+
+	try:
+		return client.request('ping')
+	except DaemonError:
+		return None
+	finally:
+		client.close()
+
+
+class RemoteAPI:
+	"""Stand-in for a gmusicapi client held by the session daemon.
+
+	Only the client methods used by the scripts (``API_METHODS``) are available.
+	"""
+
+	def __init__(self, client, session_id, kind):
+		self._client = client
+		self._session_id = session_id
+		self._kind = kind
+
+	def __getattr__(self, name):
+		if name.startswith('_') or name not in API_METHODS[self._kind]:
+			raise AttributeError(name)
+
+		def method(*args, **kwargs):
+			# The daemon may run in another working directory.
+			if name == 'upload':
+				args = (_absolute_paths(args[0]),) + args[1:] if args else args
+
+				if 'filepaths' in kwargs:
+					kwargs['filepaths'] = _absolute_paths(kwargs['filepaths'])
+
+			# Generators can't be sent by the daemon, so incremental listings arrive as a single page.
+			incremental = kwargs.pop('incremental', False)
+			result = self._client.request('call', self._session_id, name, args, kwargs)
+
+			return iter([result]) if incremental else result
+
+		method.__name__ = name
+
+		return method
+
+
+class SessionWrapper:
+	"""Client wrapper that uses a session held by the session daemon if one is running, or logs in directly.
+
+	Has the ``api``, ``is_authenticated``, ``login`` and ``logout`` interface of gmusicapi-wrapper's wrappers.
+	Logging out leaves the daemon's session logged in for the next script run.
+
+	Parameters:
+		kind (str): ``'mobileclient'`` or ``'musicmanager'``.
+
+		wrapper_class: Wrapper used to log in directly. Default: :func:`load_wrapper`
+
+		enable_logging (bool): Enable gmusicapi's debug_logging option when logging in directly.
+
+		use_daemon (bool): If ``False``, always log in directly. Default: ``True``
+
+		socket_path (str): Path of the daemon's Unix socket. Default: :func:`get_default_socket_path`
+	"""
+
+	def __init__(self, kind, wrapper_class=None, enable_logging=False, use_daemon=True, socket_path=None):
+		self.kind = kind
+		self.wrapper_class = wrapper_class
+		self.enable_logging = enable_logging
+		self.use_daemon = use_daemon
+		self.socket_path = socket_path or get_default_socket_path()
+
+		self.api = None
+		self.wrapper = None
+		self.daemon = None
+
+	@property
+	def is_authenticated(self):
+		if self.wrapper is not None:
+			return self.wrapper.is_authenticated
+
+		return self.api is not None
+
+	def _daemon_login(self, client, login_kwargs):
+		session_id = client.request('attach', self.kind, login_kwargs)
+
+		if session_id is None:
+			# Prompt here rather than in the daemon, like MobileClientWrapper.login.
+			if self.kind == 'mobileclient':
+				if login_kwargs.get('username') is None:
+					login_kwargs['username'] = input("Enter your Google username or email address: ")
+
+				if login_kwargs.get('password') is None:
+					login_kwargs['password'] = getpass.getpass("Enter your Google Music password: ")
+
+			session_id = client.request('login', self.kind, login_kwargs)
+
+		return session_id
+
+	def login(self, **login_kwargs):
+		"""Log in through the session daemon or, if it isn't running or can't log in, directly.
+
+		Parameters:
+			login_kwargs: Arguments of the wrapper's ``login`` method.
+
+		Returns:
+			``True`` on successful login, ``False`` on unsuccessful login.
+		"""
+
+		if self.use_daemon and os.path.exists(self.socket_path):
+			client = DaemonClient(self.socket_path)
+
+			try:
+				session_id = self._daemon_login(client, login_kwargs)
+			except DaemonError as e:
+				logger.info("Session daemon unavailable ({}). Logging in directly.".format(e))
+				session_id = None
+
+			if session_id is not None:
+				self.daemon = client
+				self.api = RemoteAPI(client, session_id, self.kind)
+
+				logger.info("Using session daemon at {}\n".format(self.socket_path))
+
+				return True
+
+			client.close()
+
+		wrapper_class = self.wrapper_class or load_wrapper(self.kind)
+
+		self.wrapper = wrapper_class(enable_logging=self.enable_logging)
+		self.api = self.wrapper.api
+
+		return self.wrapper.login(**login_kwargs)
+
+	def logout(self):
+		"""Log out a direct login or disconnect from the session daemon, which stays logged in."""
+
+		if self.wrapper is not None:
+			return self.wrapper.logout()
+
+		if self.daemon is not None:
+			self.daemon.close()
+
+		self.api = None
+
+		return True
+
+
+class _Session:
+	def __init__(self, kind, key, wrapper):
+		self.kind = kind
+		self.key = key
+		self.wrapper = wrapper
+		self.created = time.time()
+		self.calls = 0
+		self.lock = threading.Lock()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+
+class SessionDaemon:
+	"""Hold authenticated gmusicapi clients and answer the scripts' client calls over a Unix socket.
+
+	The socket is only accessible to the user running the daemon.
+	Logins are non-interactive: oauth credentials must already exist and Mobileclient passwords come from the scripts.
+	Calls are always passed on to Google Music. Library listings are cached by the scripts' snapshots,
+	which know when a listing must be refreshed and see changes made outside the daemon.
+
+	Parameters:
+		path (str): Path of the Unix socket to listen on. Default: :func:`get_default_socket_path`
+
+		idle_timeout (float): Stop after this many seconds without connected scripts. ``0`` never stops. Default: ``0``
+
+		enable_logging (bool): Enable gmusicapi's debug_logging option.
+
+		wrappers (dict): Wrapper classes by client kind. Default: gmusicapi-wrapper's wrappers.
+	"""
+
+	def __init__(self, path=None, idle_timeout=0, enable_logging=False, wrappers=None):
+		if wrappers is None:
+			wrappers = {kind: load_wrapper(kind) for kind in API_METHODS}
+
+		self.path = path or get_default_socket_path()
+		self.idle_timeout = idle_timeout
+		self.enable_logging = enable_logging
+		self.wrappers = wrappers
+
+		self.sessions = {}
+
+		self._next_session = 1
+		self._lock = threading.Lock()
+		self._login_lock = threading.Lock()
+		self._stopped = threading.Event()
+		self._active = 0
+		self._last_request = time.monotonic()
+
+	def handle(self, request):
+		"""Answer a request.
+
+		Returns:
+			``(True, value)`` or ``(False, exception)``.
+		"""
+
+		with self._lock:
+			self._last_request = time.monotonic()
+
+		commands = {
+			'ping': self._ping, 'status': self._status, 'stop': self._stop,
+			'attach': self._attach, 'login': self._login, 'call': self._call
+		}
+
+		try:
+			command = commands[request[0]]
+
+			return True, command(*request[1:])
+		except Exception as e:
+			# Scripts re-raise the exception, so it must survive the round trip.
+			try:
+				pickle.loads(pickle.dumps(e, pickle.HIGHEST_PROTOCOL))
+			except Exception:
+				e = DaemonError("{0}: {1}".format(type(e).__name__, e))
+
+			return False, e
+
+	def _ping(self):
+		return __version__
+
+	def _status(self):
+		with self._lock:
+			sessions = list(self.sessions.values())
+
+		return [
+			{
+				'kind': session.kind, 'account': session.key[1], 'created': session.created,
+				'calls': session.calls
+			}
+			for session in sessions
+		]
+
+	def _stop(self):
+		self._stopped.set()
+
+		return True
+
+	def _attach(self, kind, login_kwargs):
+		key = _session_key(kind, login_kwargs)
+
+		with self._lock:
+			# Unspecified credentials match a single session of the kind.
+			matches = [
+				session_id for session_id, session in self.sessions.items()
+				if all(wanted is None or wanted == value for wanted, value in zip(key, session.key))
+			]
+
+		if len(matches) == 1 and self.sessions[matches[0]].wrapper.is_authenticated:
+			return matches[0]
+
+		return None
+
+	def _login(self, kind, login_kwargs):
+		if kind not in self.wrappers:
+			raise DaemonError("Unknown client kind '{}'".format(kind))
+
+		with self._login_lock:
+			session_id = self._attach(kind, login_kwargs)
+
+			if session_id is not None:
+				return session_id
+
+			wrapper = self.wrappers[kind](enable_logging=self.enable_logging)
+
+			try:
+				authenticated = wrapper.login(**login_kwargs)
+			except Exception as e:
+				raise DaemonError("{0} login failed: {1}: {2}".format(kind, type(e).__name__, e))
+
+			if not authenticated:
+				return None
+
+			key = _session_key(kind, login_kwargs)
+
+			with self._lock:
+				for stale_id, session in list(self.sessions.items()):
+					if session.key == key:
+						del self.sessions[stale_id]
+
+				session_id = self._next_session
+				self._next_session += 1
+				self.sessions[session_id] = _Session(kind, key, wrapper)
+
+			logger.info("Logged in {0} session for {1}".format(kind, key[1]))
+
+			return session_id
+
+	def _call(self, session_id, method, args, kwargs):
+		session = self.sessions.get(session_id)
+
+		if session is None:
+			raise DaemonError("Unknown session {}. The daemon may have been restarted.".format(session_id))
+
+		if method not in API_METHODS[session.kind]:
+			raise DaemonError("{0} is not available through the session daemon".format(method))
+
+		api = session.wrapper.api
+
+		with session.lock:
+			session.calls += 1
+
+		return getattr(api, method)(*args, **kwargs)
+
+	def _idle(self):
+		with self._lock:
+			return self._active == 0 and time.monotonic() - self._last_request > self.idle_timeout
+
+	def serve(self):
+		"""Listen on the socket until stopped with a ``stop`` request or, if set, the idle timeout.
+
+		Raises:
+			DaemonError: Another daemon is listening on the socket.
+		"""
+
+		if os.path.exists(self.path):
+			if ping(self.path) is not None:
+				raise DaemonError("A session daemon is already running at {}".format(self.path))
+
+			os.remove(self.path)
+
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+		daemon = self
+
+		class Handler(socketserver.StreamRequestHandler):
+			def handle(self):
+				with daemon._lock:
+					daemon._active += 1
+
+				try:
+					while True:
+						try:
+							request = _read_message(self.rfile)
+						except (OSError, EOFError, pickle.UnpicklingError):
+							return
+
+						response = daemon.handle(request)
+
+						try:
+							_write_message(self.wfile, response)
+						except (pickle.PicklingError, AttributeError, TypeError) as e:
+							_write_message(self.wfile, (False, DaemonError("Can't send answer: {}".format(e))))
+				except OSError:
+					return
+				finally:
+					with daemon._lock:
+						daemon._active -= 1
+						daemon._last_request = time.monotonic()
+
+		# Only the owner may connect and use the held sessions.
+		umask = os.umask(0o177)
+
+		try:
+			server = _Server(self.path, Handler)
+		finally:
+			os.umask(umask)
+
+		server.timeout = 0.5
+
+		logger.info("Session daemon listening at {}".format(self.path))
+
+		try:
+			while not self._stopped.is_set():
+				server.handle_request()
+
+				if self.idle_timeout and self._idle():
+					logger.info("Stopping idle session daemon")
+					break
+		finally:
+			server.server_close()
+
+			try:
+				os.remove(self.path)
+			except OSError:
+				pass
+
+			for session in list(self.sessions.values()):
+				try:
+					session.wrapper.logout()
+				except Exception:
+					logger.exception("Failed to log out {} session".format(session.kind))
+
+			self.sessions.clear()
@@ -0,0 +1,123 @@
+# coding=utf-8
+
+"""Batched, concurrent deletion of Google Music songs."""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .scheduler import scheduled
+from .utils import chunk
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+
+def _delete_batch(api, batch, retries=3, backoff=1, scheduler=None):
+	"""Delete a batch of songs, retrying the whole batch on failure."""
+
+	song_ids = [song['id'] for song in batch]
+	result = {'songs': batch, 'deleted': [], 'attempts': 1, 'error': None}
+
+	def on_retry(attempt, e, delay):
+		result['attempts'] = attempt + 1
+		logger.debug("Retrying batch of {0} song(s) in {1}s after error: {2}".format(len(song_ids), delay, e))
+
+	try:
+		deleted = scheduled(
+			scheduler, 'delete', api.delete_songs, song_ids, retries=retries, backoff=backoff, on_retry=on_retry
+		)
+	except Exception as e:
+		result['error'] = e
+	else:
+		result['deleted'] = list(deleted or [])
+
+	return result
+
+
+def delete_songs(api, songs, batch_size=100, jobs=1, retries=3, backoff=1, stats=None, scheduler=None):
+	"""Delete songs from Google Music in concurrent batches.
+
+	Parameters:
+		api: An object with a gmusicapi-compatible ``delete_songs(song_ids)`` method (e.g. ``MobileClientWrapper.api``).
+
+		songs (list): Google Music song dicts to delete.
+
+		batch_size (int): Number of song ids sent per ``delete_songs`` call. Default: ``100``
+
+		jobs (int): Maximum number of batches in flight at once. Default: ``1``
+
+		retries (int): Number of times a failed batch is retried. Default: ``3``
+
+		backoff (float): Seconds to wait before the first retry of a batch. Doubled for each retry. Default: ``1``
+
+		stats (Phase): Stats phase to count deleted songs and retries in. Default: Don't count.
+
+		scheduler (Scheduler): Adaptive rate limits to make ``delete_songs`` calls within. Default: Plain retries.
+
+	Returns:
+		A list of per-batch result dicts in batch order.
+		::
+
+			[
+				{'batch': 1, 'songs': [<song dict>, ...], 'deleted': [<song_id>, ...], 'attempts': 1, 'error': None},
+				{'batch': 2, 'songs': [<song dict>, ...], 'deleted': [], 'attempts': 4, 'error': <exception>}
+			]
+	"""
+
+	batches = chunk(songs, batch_size)
+
+	songnum = 0
+	total = len(songs)
+	pad = len(str(total))
+	batch_pad = len(str(len(batches)))
+	results = []
+
+	if scheduler is not None:
+		scheduler.endpoint('delete', max_concurrency=jobs)
+
+	with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+		futures = {
+			executor.submit(_delete_batch, api, batch, retries=retries, backoff=backoff, scheduler=scheduler): batchnum
+			for batchnum, batch in enumerate(batches, 1)
+		}
+
+		for future in as_completed(futures):
+			result = future.result()
+			result['batch'] = futures[future]
+			results.append(result)
+
+			deleted = set(result['deleted'])
+
+			if stats is not None:
+				stats.add(items=len(deleted), retries=result['attempts'] - 1)
+
+			for song in result['songs']:
+				title = song.get('title', "<empty>")
+				artist = song.get('artist', "<empty>")
+				album = song.get('album', "<empty>")
+				song_id = song['id']
+
+				if song_id in deleted:
+					songnum += 1
+
+					logger.debug("Deleting {0} -- {1} -- {2} ({3})".format(title, artist, album, song_id))
+					logger.info("Deleted {num:>{pad}}/{total} song(s) from Google Music".format(num=songnum, pad=pad, total=total))
+				else:
+					logger.warning("Failed to delete {0} -- {1} -- {2} ({3})".format(title, artist, album, song_id))
+
+			if result['error'] is not None:
+				logger.warning(
+					"Batch {num:>{pad}}/{total} failed after {attempts} attempt(s) | {error}".format(
+						num=result['batch'], pad=batch_pad, total=len(batches), attempts=result['attempts'], error=result['error']
+					)
+				)
+			else:
+				logger.debug(
+					"Batch {num:>{pad}}/{total} deleted {deleted}/{size} song(s) in {attempts} attempt(s)".format(
+						num=result['batch'], pad=batch_pad, total=len(batches), deleted=len(deleted),
+						size=len(result['songs']), attempts=result['attempts']
+					)
+				)
+
+	results.sort(key=lambda result: result['batch'])
+
+	return results
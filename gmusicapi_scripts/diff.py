@@ -0,0 +1,169 @@
+# coding=utf-8
+
+"""Hash-indexed comparison of local and Google Music song collections.
+
+	>>> from gmusicapi_scripts.diff import diff_collections
+"""
+
+import re
+from collections import defaultdict, namedtuple
+
+from .index import read_metadata
+
+FEAT_RE = re.compile(r'[\(\[]?\s*\b(?:feat|featuring|ft)\b\.?\s.*?(?:[\)\]]|$)', re.I)
+NON_WORD_RE = re.compile(r'[^\w\s]')
+WHITESPACE_RE = re.compile(r'\s+')
+LEADING_THE_RE = re.compile(r'^the\s+')
+TRACK_NUMBER_RE = re.compile(r'^\s*0*(\d+)')
+
+TRACK_NUMBER_FIELDS = ('tracknumber', 'track_number', 'trackNumber')
+
+DiffEntry = namedtuple('DiffEntry', ['item', 'key', 'reason'])
+"""A song in a collection diff: the filepath or song dict, its normalized key and why it was reported."""
+
+
+class CollectionDiff:
+	"""The result of comparing local songs to Google Music songs.
+
+	Attributes:
+		missing_local (list): :class:`DiffEntry` for Google Music song dicts with no local counterpart.
+
+		missing_remote (list): :class:`DiffEntry` for local song filepaths with no Google Music counterpart.
+
+		ambiguous (list): :class:`DiffEntry` for songs sharing a key with a different number of songs on the other side.
+			These are neither transferred nor counted as matched.
+
+		matched (int): Number of keys present on both sides.
+	"""
+
+	def __init__(self):
+		self.missing_local = []
+		self.missing_remote = []
+		self.ambiguous = []
+		self.matched = 0
+
+	@property
+	def songs_to_download(self):
+		"""Google Music song dicts missing locally."""
+
+		return [entry.item for entry in self.missing_local]
+
+	@property
+	def songs_to_upload(self):
+		"""Local song filepaths missing from Google Music."""
+
+		return [entry.item for entry in self.missing_remote]
+
+
+def _first_value(value):
+	"""Get the first value of a mutagen tag list."""
+
+	if isinstance(value, (list, tuple)):
+		return value[0] if value else ''
+
+	return value
+
+
+def normalize_text(value):
+	"""Normalize an artist, album or title value to improve match accuracy.
+
+	Lowercases, removes featured artist credits ("feat.", "ft.", "featuring"), punctuation,
+	a leading "the" and collapses whitespace.
+	"""
+
+	value = str(_first_value(value) or '').lower()
+
+	value = FEAT_RE.sub(' ', value)
+	value = NON_WORD_RE.sub('', value)
+	value = WHITESPACE_RE.sub(' ', value).strip()
+	value = LEADING_THE_RE.sub('', value)
+
+	return value
+
+
+def normalize_track_number(value):
+	"""Normalize a track number (e.g. ``'03'``, ``'3/12'``, ``3``) to its number without padding or total."""
+
+	match = TRACK_NUMBER_RE.match(str(_first_value(value) or ''))
+
+	if not match or match.group(1) == '0':
+		return ''
+
+	return match.group(1)
+
+
+def song_key(metadata):
+	"""Create a normalized ``(artist, album, title, track number)`` key from local or Google Music metadata."""
+
+	track_number = next((metadata[field] for field in TRACK_NUMBER_FIELDS if metadata.get(field)), '')
+
+	return (
+		normalize_text(metadata.get('artist')),
+		normalize_text(metadata.get('album')),
+		normalize_text(metadata.get('title')),
+		normalize_track_number(track_number)
+	)
+
+
+def _index(items, get_metadata):
+	index = defaultdict(list)
+
+	for item in items:
+		metadata = get_metadata(item)
+
+		if metadata is not None:
+			index[song_key(metadata)].append(item)
+
+	return index
+
+
+def _missing_reason(key, other_loose_keys, other_name):
+	if (key[0], key[2]) in other_loose_keys:
+		return "{} has this artist and title with a different album or track number".format(other_name)
+
+	return "no {} song with this artist and title".format(other_name)
+
+
+def diff_collections(local_songs, google_songs, get_metadata=read_metadata):
+	"""Compare local songs to Google Music songs in linear time.
+
+	Both collections are indexed once by a normalized key; songs are then looked up by key.
+
+	Parameters:
+		local_songs (list): Local song filepaths.
+
+		google_songs (list or iterable): Google Music song dicts (e.g. compact records). Consumed once.
+
+		get_metadata (callable): Returns the metadata dict for a local filepath or ``None`` if it can't be read.
+			Default: Read the file's tags.
+
+	Returns:
+		A :class:`CollectionDiff`.
+	"""
+
+	local_index = _index(local_songs, get_metadata)
+	google_index = _index(google_songs, lambda song: song)
+
+	local_loose_keys = {(key[0], key[2]) for key in local_index}
+	google_loose_keys = {(key[0], key[2]) for key in google_index}
+
+	diff = CollectionDiff()
+
+	for key, local_items in local_index.items():
+		google_items = google_index.get(key)
+
+		if google_items is None:
+			reason = _missing_reason(key, google_loose_keys, "Google Music")
+			diff.missing_remote.extend(DiffEntry(item, key, reason) for item in local_items)
+		elif len(local_items) != len(google_items):
+			reason = "{0} local and {1} Google Music songs share this key".format(len(local_items), len(google_items))
+			diff.ambiguous.extend(DiffEntry(item, key, reason) for item in local_items + google_items)
+		else:
+			diff.matched += 1
+
+	for key, google_items in google_index.items():
+		if key not in local_index:
+			reason = _missing_reason(key, local_loose_keys, "local")
+			diff.missing_local.extend(DiffEntry(item, key, reason) for item in google_items)
+
+	return diff
@@ -0,0 +1,187 @@
+# coding=utf-8
+
+"""Compiled song metadata filters.
+
+	>>> from gmusicapi_scripts.filters import FilterSet
+"""
+
+import re
+from collections import OrderedDict
+
+# Fields checked first because their values are short or often missing.
+# Unlisted fields are checked after these in the order given.
+FIELD_ORDER = (
+	'tracknumber', 'track_number', 'trackNumber', 'discnumber', 'disc_number', 'discNumber',
+	'date', 'year', 'genre', 'artist', 'albumartist', 'album_artist', 'albumArtist', 'album', 'title'
+)
+
+
+class FilterError(ValueError):
+	"""A filter is malformed or has an invalid pattern."""
+
+
+def parse_filter(text):
+	"""Parse a ``field:pattern`` filter option.
+
+	Raises:
+		FilterError: The filter has no field.
+	"""
+
+	field, sep, pattern = text.partition(':')
+
+	if not sep or not field:
+		raise FilterError("Invalid filter '{}': expected field:pattern (e.g. \"artist:Muse\")".format(text))
+
+	return field, pattern
+
+
+def _field_cost(field):
+	try:
+		return FIELD_ORDER.index(field)
+	except ValueError:
+		return len(FIELD_ORDER)
+
+
+def _compile_filters(filters, merge):
+	"""Compile ``(field, pattern)`` filters into ``(field, [regex, ...])`` checks ordered cheapest first.
+
+	If merge is ``True``, patterns on the same field are combined into a single alternation.
+	"""
+
+	checks = []
+
+	for field, pattern in filters:
+		try:
+			checks.append((field, pattern, re.compile(pattern, re.I)))
+		except re.error as e:
+			raise FilterError("Invalid pattern in filter '{0}:{1}': {2}".format(field, pattern, e))
+
+	if merge:
+		by_field = OrderedDict()
+
+		for field, pattern, regex in checks:
+			by_field.setdefault(field, []).append((pattern, regex))
+
+		compiled = []
+
+		for field, patterns in by_field.items():
+			if len(patterns) == 1:
+				compiled.append((field, [patterns[0][1]]))
+				continue
+
+			try:
+				compiled.append((field, [re.compile("|".join("(?:{})".format(pattern) for pattern, _ in patterns), re.I)]))
+			except re.error:
+				# Patterns with inline flags or group references can't be combined.
+				compiled.append((field, [regex for _, regex in patterns]))
+	else:
+		compiled = [(field, [regex]) for field, _, regex in checks]
+
+	return sorted(compiled, key=lambda check: _field_cost(check[0]))
+
+
+def _field_matches(song, field, regexes):
+	if field not in song:
+		return False
+
+	value = song[field]
+
+	if isinstance(value, list):
+		return any(regex.search(str(item)) for item in value for regex in regexes)
+
+	value = str(value)
+
+	return any(regex.search(value) for regex in regexes)
+
+
+class FilterSet:
+	"""Include and exclude metadata filters, validated and compiled once.
+
+	Matches songs the same way as gmusicapi-wrapper's filters: patterns are case-insensitive Python regexes
+	searched in a metadata field's value (any item of list values), songs are included if they match any include filter
+	and excluded if they match any exclude filter.
+
+	Parameters:
+		include_filters (list): A list of ``(field, pattern)`` tuples.
+			Songs are filtered out if the given metadata field values don't match any of the given patterns.
+
+		exclude_filters (list): A list of ``(field, pattern)`` tuples.
+			Songs are filtered out if the given metadata field values match any of the given patterns.
+
+		all_includes (bool): If ``True``, all include_filters criteria must match to include a song.
+
+		all_excludes (bool): If ``True``, all exclude_filters criteria must match to exclude a song.
+
+	Raises:
+		FilterError: A pattern is not a valid regex.
+	"""
+
+	def __init__(self, include_filters=None, exclude_filters=None, all_includes=False, all_excludes=False):
+		self.include_filters = list(include_filters or [])
+		self.exclude_filters = list(exclude_filters or [])
+		self.all_includes = all_includes
+		self.all_excludes = all_excludes
+
+		self._includes = _compile_filters(self.include_filters, merge=not all_includes)
+		self._excludes = _compile_filters(self.exclude_filters, merge=not all_excludes)
+
+	@classmethod
+	def parse(cls, include_filters=None, exclude_filters=None, all_includes=False, all_excludes=False):
+		"""Create a filter set from ``field:pattern`` filter options.
+
+		Raises:
+			FilterError: A filter is malformed or has an invalid pattern.
+		"""
+
+		return cls(
+			[parse_filter(text) for text in include_filters or []], [parse_filter(text) for text in exclude_filters or []],
+			all_includes=all_includes, all_excludes=all_excludes
+		)
+
+	def __bool__(self):
+		return bool(self._includes or self._excludes)
+
+	@property
+	def fields(self):
+		"""The set of metadata fields checked by the filters."""
+
+		return {field for field, _ in self._includes + self._excludes}
+
+	def match(self, song):
+		"""Check a Google Music song dict or local song metadata dict against the filters."""
+
+		if self._includes:
+			check = all if self.all_includes else any
+
+			if not check(_field_matches(song, field, regexes) for field, regexes in self._includes):
+				return False
+
+		if self._excludes:
+			check = all if self.all_excludes else any
+
+			if check(_field_matches(song, field, regexes) for field, regexes in self._excludes):
+				return False
+
+		return True
+
+	def filter(self, songs):
+		"""Split songs into those matching the filters and those filtered out.
+
+		Returns:
+			A list of songs matching criteria and a list of songs filtered out.
+		"""
+
+		if not self:
+			return list(songs), []
+
+		matched = []
+		filtered = []
+		match = self.match
+
+		for song in songs:
+			if match(song):
+				matched.append(song)
+			else:
+				filtered.append(song)
+
+		return matched, filtered
@@ -0,0 +1,403 @@
+# coding=utf-8
+
+"""Audio content fingerprints of local songs for duplicate detection.
+
+	>>> from gmusicapi_scripts.fingerprint import FingerprintCache
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import get_cache_dir
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# Bytes hashed per update. hashlib releases the GIL for large updates, so hashing threads run in parallel.
+CHUNK_SIZE = 1024 * 1024
+
+# Upload results meaning the song is in the Google Music library.
+REMOTE_RESULTS = ('uploaded', 'matched', 'not_uploaded')
+
+
+def get_default_fingerprint_path():
+	"""Get the default filepath of the audio fingerprint cache."""
+
+	return os.path.join(get_cache_dir(), 'fingerprints.sqlite')
+
+
+def _id3v2_end(data, start=0):
+	"""Get the offset after the ID3v2 tags at the start of a file."""
+
+	while len(data) >= start + 10 and data[start:start + 3] == b'ID3':
+		header = data[start:start + 10]
+		size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+		start += 10 + size + (10 if header[5] & 0x10 else 0)
+
+	return start
+
+
+def _mp3_ranges(data):
+	start = _id3v2_end(data)
+	end = len(data)
+
+	if end - start >= 128 and data[end - 128:end - 125] == b'TAG':
+		end -= 128
+
+	if end - start >= 32 and data[end - 32:end - 24] == b'APETAGEX':
+		size = int.from_bytes(data[end - 20:end - 16], 'little')
+		flags = int.from_bytes(data[end - 12:end - 8], 'little')
+		end -= size + (32 if flags & 0x80000000 else 0)
+
+	return [(start, end)] if end > start else None
+
+
+def _flac_ranges(data):
+	position = _id3v2_end(data)
+
+	if data[position:position + 4] != b'fLaC':
+		return None
+
+	position += 4
+
+	# Metadata blocks (including Vorbis comments and pictures) precede the audio frames.
+	while position + 4 <= len(data):
+		header = data[position]
+		position += 4 + int.from_bytes(data[position + 1:position + 4], 'big')
+
+		if header & 0x80:
+			break
+
+	return [(position, len(data))] if position < len(data) else None
+
+
+def _mp4_ranges(data):
+	ranges = []
+	position = 0
+	length = len(data)
+
+	# Audio is in the top-level mdat boxes. Tags are in moov and may be rewritten around them.
+	while position + 8 <= length:
+		size = int.from_bytes(data[position:position + 4], 'big')
+		kind = data[position + 4:position + 8]
+		header = 8
+
+		if size == 1:
+			size = int.from_bytes(data[position + 8:position + 16], 'big')
+			header = 16
+		elif size == 0:
+			size = length - position
+
+		if size < header:
+			return None
+
+		if kind == b'mdat':
+			ranges.append((position + header, min(position + size, length)))
+
+		position += size
+
+	return ranges or None
+
+
+def _ogg_ranges(data):
+	ranges = []
+	position = 0
+	length = len(data)
+
+	# Header packets (including comments) are on pages with a granule position of 0.
+	# Page headers are skipped because tag edits renumber the pages that follow.
+	while position + 27 <= length:
+		if data[position:position + 4] != b'OggS':
+			return None
+
+		granule = int.from_bytes(data[position + 6:position + 14], 'little', signed=True)
+		segments = data[position + 26]
+		header = 27 + segments
+		size = sum(data[position + 27:position + header])
+
+		if granule != 0:
+			ranges.append((position + header, min(position + header + size, length)))
+
+		position += header + size
+
+	return ranges or None
+
+
+AUDIO_RANGES = {
+	'.mp3': _mp3_ranges,
+	'.flac': _flac_ranges,
+	'.m4a': _mp4_ranges,
+	'.mp4': _mp4_ranges,
+	'.ogg': _ogg_ranges,
+	'.opus': _ogg_ranges
+}
+
+
+def audio_digest(filepath):
+	"""Hash the audio data of a music file, ignoring its tags.
+
+	Files are memory-mapped rather than read. MP3, FLAC, MP4 and Ogg containers are parsed to skip their tags;
+	other or malformed files are hashed whole.
+
+	Returns:
+		A hex SHA-1 digest or ``None`` for empty files.
+	"""
+
+	with open(filepath, 'rb') as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return None
+
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			find_ranges = AUDIO_RANGES.get(os.path.splitext(filepath)[1].lower())
+			ranges = (find_ranges(data) if find_ranges is not None else None) or [(0, len(data))]
+			digest = hashlib.sha1()
+			view = memoryview(data)
+
+			try:
+				for start, end in ranges:
+					for offset in range(start, end, CHUNK_SIZE):
+						with view[offset:min(offset + CHUNK_SIZE, end)] as chunk:
+							digest.update(chunk)
+			finally:
+				view.release()
+
+	return digest.hexdigest()
+
+
+def _try_audio_digest(filepath):
+	try:
+		return audio_digest(filepath)
+	except (OSError, ValueError) as e:
+		logger.warning("Can't hash {0}: {1}".format(filepath, e))
+
+		return None
+
+
+class FingerprintCache:
+	"""SQLite-backed cache of local audio digests keyed by path, size and mtime,
+	and of the audio digests of songs known to be in Google Music libraries.
+
+	Parameters:
+		path (str): Filepath of the SQLite database. Created if it doesn't exist.
+	"""
+
+	def __init__(self, path):
+		dirname = os.path.dirname(os.path.abspath(path))
+		os.makedirs(dirname, exist_ok=True)
+
+		self.path = path
+		self.hits = 0
+		self.misses = 0
+
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("PRAGMA synchronous=NORMAL")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS local ("
+			"path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, digest TEXT)"
+		)
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS remote ("
+			"account TEXT NOT NULL, digest TEXT NOT NULL, song_id TEXT NOT NULL, PRIMARY KEY (account, digest))"
+		)
+		self._conn.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		"""Commit pending entries and close the database."""
+
+		if self._conn is not None:
+			self._conn.commit()
+			self._conn.close()
+			self._conn = None
+
+	def get(self, filepath, size, mtime):
+		"""Get the cached audio digest of a file.
+
+		Returns:
+			A digest or ``None`` if the file couldn't be hashed.
+			Raises ``KeyError`` if the file isn't cached or has changed since it was hashed.
+		"""
+
+		row = self._conn.execute(
+			"SELECT digest FROM local WHERE path = ? AND size = ? AND mtime = ?", (filepath, size, mtime)
+		).fetchone()
+
+		if row is None:
+			raise KeyError(filepath)
+
+		return row[0]
+
+	def set(self, filepath, size, mtime, digest):
+		"""Store the audio digest of a file, replacing any previous entry."""
+
+		self._conn.execute(
+			"INSERT OR REPLACE INTO local (path, size, mtime, digest) VALUES (?, ?, ?, ?)", (filepath, size, mtime, digest)
+		)
+
+	def digests(self, filepaths, jobs=1):
+		"""Get the audio digests of files, hashing new or modified files.
+
+		Parameters:
+			filepaths (list): Paths of music files.
+
+			jobs (int): Number of files hashed at once. Default: ``1``
+
+		Returns:
+			A dict of digests by filepath. Files that can't be hashed are left out.
+		"""
+
+		digests = {}
+		pending = []
+
+		for filepath in filepaths:
+			try:
+				stat = os.stat(filepath)
+			except OSError:
+				continue
+
+			try:
+				digest = self.get(filepath, stat.st_size, stat.st_mtime_ns)
+			except KeyError:
+				pending.append((filepath, stat))
+			else:
+				self.hits += 1
+
+				if digest is not None:
+					digests[filepath] = digest
+
+		self.misses += len(pending)
+		pending_filepaths = [filepath for filepath, _ in pending]
+
+		if jobs > 1 and len(pending) > 1:
+			with ThreadPoolExecutor(max_workers=jobs) as executor:
+				hashed = list(executor.map(_try_audio_digest, pending_filepaths))
+		else:
+			hashed = [_try_audio_digest(filepath) for filepath in pending_filepaths]
+
+		for (filepath, stat), digest in zip(pending, hashed):
+			self.set(filepath, stat.st_size, stat.st_mtime_ns, digest)
+
+			if digest is not None:
+				digests[filepath] = digest
+
+		self._conn.commit()
+
+		return digests
+
+	def remote_song(self, account, digest):
+		"""Get the id of a Google Music song with the given audio or ``None`` if none is known."""
+
+		row = self._conn.execute(
+			"SELECT song_id FROM remote WHERE account = ? AND digest = ?", (account, digest)
+		).fetchone()
+
+		return row[0] if row is not None else None
+
+	def _duplicate_reason(self, account, filepath, digest, seen):
+		song_id = self.remote_song(account, digest)
+
+		if song_id is not None:
+			return "Same audio as uploaded song {}".format(song_id)
+
+		if digest in seen:
+			return "Same audio as {}".format(seen[digest])
+
+		seen[digest] = filepath
+
+		return None
+
+	def split_duplicates(self, filepaths, account, jobs=1):
+		"""Split files to upload into unique files and duplicates.
+
+		A file is a duplicate if its audio matches a song uploaded to the account before
+		or an earlier file in filepaths.
+
+		Parameters:
+			filepaths (list): Paths of music files to upload.
+
+			account (str): Name of the Google Music account (e.g. the oauth credential name).
+
+			jobs (int): Number of files hashed at once. Default: ``1``
+
+		Returns:
+			A list of filepaths to upload and a list of ``(filepath, reason)`` tuples of duplicates.
+		"""
+
+		digests = self.digests(filepaths, jobs=jobs)
+		seen = {}
+		unique = []
+		duplicates = []
+
+		for filepath in filepaths:
+			digest = digests.get(filepath)
+			reason = self._duplicate_reason(account, filepath, digest, seen) if digest is not None else None
+
+			if reason is None:
+				unique.append(filepath)
+			else:
+				duplicates.append((filepath, reason))
+
+		return unique, duplicates
+
+	def iter_unique(self, filepaths, account, duplicates=None):
+		"""Lazily yield files that aren't duplicates. Streaming version of :meth:`split_duplicates`.
+
+		Parameters:
+			duplicates (list): List to append ``(filepath, reason)`` tuples of skipped files to.
+		"""
+
+		seen = {}
+
+		for filepath in filepaths:
+			digest = self.digests([filepath]).get(filepath)
+			reason = self._duplicate_reason(account, filepath, digest, seen) if digest is not None else None
+
+			if reason is None:
+				yield filepath
+			else:
+				logger.info("Skipping duplicate {0} | {1}".format(filepath, reason))
+
+				if duplicates is not None:
+					duplicates.append((filepath, reason))
+
+	def remember_uploads(self, account, results):
+		"""Record the audio digests of uploaded, matched and already uploaded files from upload results."""
+
+		for result in results:
+			if result['result'] not in REMOTE_RESULTS or not result.get('id'):
+				continue
+
+			# Files may have been deleted after uploading, so look them up by path alone.
+			row = self._conn.execute("SELECT digest FROM local WHERE path = ?", (result['filepath'],)).fetchone()
+
+			if row is not None and row[0] is not None:
+				self._conn.execute(
+					"INSERT OR REPLACE INTO remote (account, digest, song_id) VALUES (?, ?, ?)",
+					(account, row[0], result['id'])
+				)
+
+		self._conn.commit()
+
+	def prune_remote(self, account, song_ids):
+		"""Forget the audio of songs no longer in the Google Music library.
+
+		Parameters:
+			song_ids (set): Ids of all songs in the library.
+		"""
+
+		rows = self._conn.execute("SELECT digest, song_id FROM remote WHERE account = ?", (account,)).fetchall()
+		stale = [(account, digest) for digest, song_id in rows if song_id not in song_ids]
+
+		self._conn.executemany("DELETE FROM remote WHERE account = ? AND digest = ?", stale)
+		self._conn.commit()
+
+		return len(stale)
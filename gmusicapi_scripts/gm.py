@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+A collection of scripts for Google Music using https://github.com/simon-weber/gmusicapi.
+More information at https://github.com/thebigmunch/gmusicapi-scripts.
+
+Usage:
+  gm (-h | --help)
+  gm --version
+  gm <command> [<args>...]
+
+Commands:
+  delete                                Delete songs from your Google Music library (gmdelete).
+  download                              Download songs from your Google Music library (gmdownload).
+  search                                Search your Google Music library (gmsearch).
+  sync                                  Sync songs between Google Music and your computer (gmsync).
+  upload                                Upload songs to Google Music (gmupload).
+  daemon                                Run the session daemon (gmd).
+
+Options:
+  -h, --help                            Display help message.
+  --version                             Display the gmusicapi-scripts version.
+
+Run gm <command> --help for the options of a command.
+"""
+
+import importlib
+import sys
+
+# Modules are imported only for the command being run.
+COMMANDS = {
+	'delete': 'gmusicapi_scripts.gmdelete',
+	'download': 'gmusicapi_scripts.gmdownload',
+	'search': 'gmusicapi_scripts.gmsearch',
+	'sync': 'gmusicapi_scripts.gmsync',
+	'upload': 'gmusicapi_scripts.gmupload',
+	'daemon': 'gmusicapi_scripts.gmd'
+}
+
+
+def run(command, args):
+	"""Run a command's script with command line arguments."""
+
+	module = importlib.import_module(COMMANDS[command])
+	sys.argv = ['gm {}'.format(command)] + list(args)
+
+	return module.main()
+
+
+def main():
+	from docopt import docopt
+
+	from gmusicapi_scripts import __version__
+
+	cli = docopt(__doc__, version=__version__, options_first=True)
+	command = cli['<command>']
+
+	if command not in COMMANDS:
+		sys.exit("Unknown command '{0}'. Commands: {1}.".format(command, ", ".join(sorted(COMMANDS))))
+
+	return run(command, cli['<args>'])
+
+
+def gmdelete():
+	return run('delete', sys.argv[1:])
+
+
+def gmdownload():
+	return run('download', sys.argv[1:])
+
+
+def gmsearch():
+	return run('search', sys.argv[1:])
+
+
+def gmsync():
+	return run('sync', sys.argv[1:])
+
+
+def gmupload():
+	return run('upload', sys.argv[1:])
+
+
+def gmd():
+	return run('daemon', sys.argv[1:])
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+A session daemon for gmusicapi-scripts that keeps Google Music logins between script runs.
+More information at https://github.com/thebigmunch/gmusicapi-scripts.
+
+Usage:
+  gmd (-h | --help)
+  gmd [options] [start]
+  gmd [options] stop
+  gmd [options] status
+
+Commands:
+  start                                 Run the daemon in the foreground until stopped. Default behavior.
+  stop                                  Stop the running daemon.
+  status                                List the sessions held by the running daemon.
+
+Options:
+  -h, --help                            Display help message.
+  -s PATH, --socket PATH                Unix socket to listen on or connect to.
+                                        Defaults to $GMD_SOCKET or gmd.sock in the gmusicapi-scripts cache directory.
+  -l, --log                             Enable gmusicapi logging.
+  -q, --quiet                           Don't output status messages.
+  --idle-timeout SECONDS                Stop after SECONDS without connected scripts. 0 never stops. [Default: 0]
+
+gmdelete, gmdownload, gmsearch, gmsync and gmupload use the daemon's sessions when it is running
+and log in directly when it isn't or with --no-daemon.
+The daemon logs in without prompting: run a script once without the daemon to create oauth credentials.
+"""
+
+import logging
+import os
+import sys
+import time
+
+from docopt import docopt
+
+from gmusicapi_scripts.daemon import DaemonClient, DaemonError, SessionDaemon, get_default_socket_path
+from gmusicapi_scripts.utils import QUIET
+
+logger = logging.getLogger('gmusicapi_wrapper')
+sh = logging.StreamHandler()
+logger.addHandler(sh)
+
+
+def main():
+	cli = dict((key.lstrip("-<").rstrip(">"), value) for key, value in docopt(__doc__).items())
+
+	if cli['quiet']:
+		logger.setLevel(QUIET)
+	else:
+		logger.setLevel(logging.INFO)
+
+	socket_path = cli['socket'] or get_default_socket_path()
+
+	if cli['stop'] or cli['status']:
+		client = DaemonClient(socket_path)
+
+		try:
+			if cli['stop']:
+				client.request('stop')
+				logger.info("Stopped session daemon at {}".format(socket_path))
+			else:
+				sessions = client.request('status')
+				logger.log(QUIET, "Session daemon at {0} holds {1} session(s)".format(socket_path, len(sessions)))
+
+				for session in sessions:
+					logger.log(
+						QUIET, "{kind} -- {account} -- {calls} calls -- logged in {age:.0f} minute(s) ago".format(
+							age=(time.time() - session['created']) / 60, **session
+						)
+					)
+		except DaemonError as e:
+			sys.exit(str(e))
+		finally:
+			client.close()
+
+		return
+
+	try:
+		idle_timeout = float(cli['idle-timeout'])
+	except ValueError:
+		sys.exit("--idle-timeout must be a number of seconds.")
+
+	# Logins must not wait for input nobody can give.
+	sys.stdin = open(os.devnull)
+
+	daemon = SessionDaemon(socket_path, idle_timeout=idle_timeout, enable_logging=cli['log'])
+
+	try:
+		daemon.serve()
+	except DaemonError as e:
+		sys.exit(str(e))
+	except KeyboardInterrupt:
+		pass
+
+	logger.info("\nAll done!")
+
+
+if __name__ == '__main__':
+	main()
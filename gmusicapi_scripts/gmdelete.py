@@ -28,6 +28,23 @@ Options:
   -a, --all-includes                    Songs must match all include filter criteria to be included.
   -A, --all-excludes                    Songs must match all exclude filter criteria to be excluded.
   -y, --yes                             Delete songs without asking for confirmation.
+  --offline                             Use the cached library snapshot without contacting Google Music.
+                                        Only available with -d, --dry-run.
+  --refresh                             Fetch the full library listing even if the cached snapshot is fresh.
+  --snapshot-ttl SECONDS                Seconds before the cached library snapshot is refreshed. [Default: 600]
+  --batch-size SIZE                     Number of songs to delete per request. [Default: 100]
+  -j JOBS, --jobs JOBS                  Number of delete requests to run at once. [Default: 1]
+  --retries RETRIES                     Number of times to retry a failed delete request. [Default: 3]
+  --output-format FORMAT                With -d, --dry-run, write song lists to standard output as ndjson, csv or tsv
+                                        records instead of status messages.
+  --fields FIELDS                       Comma-separated fields of --output-format records.
+                                        Default: action,id,title,artist,album,track
+  --sort FIELDS                         Sort --output-format records by comma-separated fields.
+                                        Prefix a field with - for descending order. Default: Unsorted.
+  --no-daemon                           Log in directly even if the gmd session daemon is running.
+  --stats FORMAT                        Output per-phase timings and metrics as json or prometheus.
+  --stats-file PATH                     Write --stats output to PATH instead of standard output.
+                                        The file is replaced atomically (e.g. for a Prometheus textfile collector).
 
 Patterns can be any valid Python regex patterns.
 """
@@ -37,10 +54,14 @@ import sys
 
 from docopt import docopt
 
-from gmusicapi_wrapper import MobileClientWrapper
-
-QUIET = 25
-logging.addLevelName(25, "QUIET")
+from gmusicapi_scripts.daemon import SessionWrapper
+from gmusicapi_scripts.deleter import delete_songs
+from gmusicapi_scripts.filters import FilterError, FilterSet
+from gmusicapi_scripts.output import GOOGLE_FIELDS, OUTPUT_FORMATS, RecordWriter, parse_fields, song_keys
+from gmusicapi_scripts.scheduler import Scheduler, get_default_limits_path
+from gmusicapi_scripts.snapshot import COMPACT_FIELDS, LibrarySnapshot, get_default_snapshot_path, get_google_songs
+from gmusicapi_scripts.stats import STATS_FORMATS, Stats
+from gmusicapi_scripts.utils import QUIET
 
 logger = logging.getLogger('gmusicapi_wrapper')
 sh = logging.StreamHandler()
@@ -55,21 +76,68 @@ def main():
 	else:
 		logger.setLevel(logging.INFO)
 
-	mcw = MobileClientWrapper(enable_logging=cli['log'])
-	mcw.login(username=cli['user'], password=cli['pass'], android_id=cli['android-id'])
+	if cli['stats'] and cli['stats'] not in STATS_FORMATS:
+		sys.exit("--stats must be one of: {}.".format(", ".join(STATS_FORMATS)))
+
+	if cli['output-format'] and cli['output-format'] not in OUTPUT_FORMATS:
+		sys.exit("--output-format must be one of: {}.".format(", ".join(OUTPUT_FORMATS)))
+
+	if cli['output-format'] and not cli['dry-run']:
+		sys.exit("--output-format can only be used with --dry-run.")
+
+	if cli['output-format'] and cli['stats'] and not cli['stats-file']:
+		sys.exit("--stats needs --stats-file with --output-format.")
+
+	stats = Stats('gmdelete', enabled=bool(cli['stats']))
 
-	if not mcw.is_authenticated:
-		sys.exit()
+	try:
+		filters = FilterSet.parse(
+			cli['include-filter'], cli['exclude-filter'], all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
+		)
+	except FilterError as e:
+		sys.exit(str(e))
 
-	include_filters = [tuple(filt.split(':', 1)) for filt in cli['include-filter']]
-	exclude_filters = [tuple(filt.split(':', 1)) for filt in cli['exclude-filter']]
+	for option in ['batch-size', 'jobs', 'retries']:
+		cli[option] = int(cli[option])
 
-	songs_to_delete, _ = mcw.get_google_songs(
-		include_filters=include_filters, exclude_filters=exclude_filters,
-		all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
+	if cli['batch-size'] < 1:
+		sys.exit("--batch-size must be a positive number.")
+
+	if cli['offline'] and not cli['dry-run']:
+		sys.exit("--offline can only be used with --dry-run.")
+
+	snapshot = LibrarySnapshot(
+		get_default_snapshot_path('mobileclient-{}'.format(cli['user'] or 'default')), ttl=int(cli['snapshot-ttl'])
 	)
+	scheduler = Scheduler(get_default_limits_path('mobileclient-{}'.format(cli['user'] or 'default')))
 
-	if cli['dry-run']:
+	if cli['offline']:
+		if snapshot.fetched is None:
+			sys.exit("No cached Google Music library snapshot to use offline.")
+
+		mcw = None
+	else:
+		mcw = SessionWrapper('mobileclient', enable_logging=cli['log'], use_daemon=not cli['no-daemon'])
+
+		with stats.phase('login'):
+			mcw.login(username=cli['user'], password=cli['pass'], android_id=cli['android-id'])
+
+		if not mcw.is_authenticated:
+			sys.exit()
+
+	with stats.phase('listing') as phase:
+		songs_to_delete, songs_to_filter = get_google_songs(
+			mcw, snapshot, filters=filters, offline=cli['offline'], refresh=cli['refresh'], scheduler=scheduler,
+			fields=set(COMPACT_FIELDS) | song_keys(parse_fields(cli['fields']) + parse_fields(cli['sort']))
+		)
+
+		phase.add(items=len(songs_to_delete) + len(songs_to_filter))
+
+	if cli['output-format']:
+		with RecordWriter(
+				cli['output-format'], parse_fields(cli['fields']) or GOOGLE_FIELDS, sort=parse_fields(cli['sort'])) as writer:
+			writer.write_many(songs_to_delete, 'delete')
+	elif cli['dry-run']:
 		logger.info("Found {0} songs to delete".format(len(songs_to_delete)))
 
 		if songs_to_delete:
@@ -92,27 +160,32 @@ def main():
 			if confirm or input("Are you sure you want to delete {0} song(s) from Google Music? (y/n) ".format(len(songs_to_delete))) in ("y", "Y"):
 				logger.info("\nDeleting {0} songs from Google Music\n".format(len(songs_to_delete)))
 
-				songnum = 0
-				total = len(songs_to_delete)
-				pad = len(str(total))
+				with stats.phase('delete') as phase:
+					results = delete_songs(
+						mcw.api, songs_to_delete, batch_size=cli['batch-size'], jobs=cli['jobs'], retries=cli['retries'],
+						stats=phase, scheduler=scheduler
+					)
 
-				for song in songs_to_delete:
-					mcw.api.delete_songs(song['id'])
-					songnum += 1
+				snapshot.remove(song_id for result in results for song_id in result['deleted'])
 
-					title = song.get('title', "<empty>")
-					artist = song.get('artist', "<empty>")
-					album = song.get('album', "<empty>")
-					song_id = song['id']
+				failed = [result for result in results if result['error'] is not None]
 
-					logger.debug("Deleting {0} -- {1} -- {2} ({3})".format(title, artist, album, song_id))
-					logger.info("Deleted {num:>{pad}}/{total} song(s) from Google Music".format(num=songnum, pad=pad, total=total))
+				if failed:
+					logger.info("\n{0} of {1} batch(es) failed to delete".format(len(failed), len(results)))
 			else:
 				logger.info("\nNo songs deleted.")
 		else:
 			logger.info("\nNo songs to delete")
 
-	mcw.logout()
+	snapshot.close()
+	scheduler.save()
+
+	if mcw is not None:
+		mcw.logout()
+
+	if cli['stats']:
+		stats.emit(cli['stats'], cli['stats-file'])
+
 	logger.info("\nAll done!")
 
 
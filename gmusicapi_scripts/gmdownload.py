@@ -31,6 +31,28 @@ Options:
                                         This option can be set multiple times.
   -a, --all-includes                    Songs must match all include filter criteria to be included.
   -A, --all-excludes                    Songs must match all exclude filter criteria to be excluded.
+  --offline                             Use the cached library snapshot without contacting Google Music.
+                                        Only available with -d, --dry-run.
+  --refresh                             Fetch the full library listing even if the cached snapshot is fresh.
+  --snapshot-ttl SECONDS                Seconds before the cached library snapshot is refreshed. [Default: 600]
+  -j JOBS, --jobs JOBS                  Number of songs to download at once. [Default: 1]
+  --retries RETRIES                     Number of times to retry a failed download. [Default: 3]
+  --max-rate RATE                       Limit the average combined download rate to RATE bytes per second.
+                                        Accepts K, M and G suffixes (e.g. 2M). Songs are fetched whole,
+                                        so this delays starting downloads rather than capping one in flight.
+  --resume                              Continue an interrupted download from its journal without listing the library again.
+                                        Songs are saved with the output template of the interrupted run,
+                                        or by suggested filename in the current directory if it had none.
+  --output-format FORMAT                With -d, --dry-run, write song lists to standard output as ndjson, csv or tsv
+                                        records instead of status messages.
+  --fields FIELDS                       Comma-separated fields of --output-format records.
+                                        Default: action,id,title,artist,album,track
+  --sort FIELDS                         Sort --output-format records by comma-separated fields.
+                                        Prefix a field with - for descending order. Default: Unsorted.
+  --no-daemon                           Log in directly even if the gmd session daemon is running.
+  --stats FORMAT                        Output per-phase timings and metrics as json or prometheus.
+  --stats-file PATH                     Write --stats output to PATH instead of standard output.
+                                        The file is replaced atomically (e.g. for a Prometheus textfile collector).
 
 Patterns can be any valid Python regex patterns.
 """
@@ -41,10 +63,16 @@ import sys
 
 from docopt import docopt
 
-from gmusicapi_wrapper import MusicManagerWrapper
-
-QUIET = 25
-logging.addLevelName(25, "QUIET")
+from gmusicapi_scripts.daemon import SessionWrapper
+from gmusicapi_scripts.filters import FilterError, FilterSet
+from gmusicapi_scripts.journal import TransferJournal, get_default_journal_path
+from gmusicapi_scripts.output import GOOGLE_FIELDS, OUTPUT_FORMATS, RecordWriter, parse_fields, song_keys
+from gmusicapi_scripts.scheduler import Scheduler, get_default_limits_path
+from gmusicapi_scripts.snapshot import COMPACT_FIELDS, LibrarySnapshot, get_default_snapshot_path, get_google_songs
+from gmusicapi_scripts.stats import STATS_FORMATS, Stats
+from gmusicapi_scripts.template import SUGGESTED, PathTemplate
+from gmusicapi_scripts.transfer import download_songs
+from gmusicapi_scripts.utils import QUIET, parse_size
 
 logger = logging.getLogger('gmusicapi_wrapper')
 sh = logging.StreamHandler()
@@ -59,26 +87,92 @@ def main():
 	else:
 		logger.setLevel(logging.INFO)
 
+	if cli['stats'] and cli['stats'] not in STATS_FORMATS:
+		sys.exit("--stats must be one of: {}.".format(", ".join(STATS_FORMATS)))
+
+	if cli['output-format'] and cli['output-format'] not in OUTPUT_FORMATS:
+		sys.exit("--output-format must be one of: {}.".format(", ".join(OUTPUT_FORMATS)))
+
+	if cli['output-format'] and not cli['dry-run']:
+		sys.exit("--output-format can only be used with --dry-run.")
+
+	if cli['output-format'] and cli['stats'] and not cli['stats-file']:
+		sys.exit("--stats needs --stats-file with --output-format.")
+
+	stats = Stats('gmdownload', enabled=bool(cli['stats']))
+
+	try:
+		filters = FilterSet.parse(
+			cli['include-filter'], cli['exclude-filter'], all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
+		)
+	except FilterError as e:
+		sys.exit(str(e))
+
 	if not cli['output']:
 		cli['output'] = os.getcwd()
 
-	mmw = MusicManagerWrapper(enable_logging=cli['log'])
-	mmw.login(oauth_filename=cli['cred'], uploader_id=cli['uploader-id'])
+	cli['jobs'] = int(cli['jobs'])
+	cli['retries'] = int(cli['retries'])
+	cli['max-rate'] = parse_size(cli['max-rate']) if cli['max-rate'] else None
+
+	if cli['offline'] and not cli['dry-run']:
+		sys.exit("--offline can only be used with --dry-run.")
+
+	snapshot = LibrarySnapshot(get_default_snapshot_path('musicmanager-{}'.format(cli['cred'])), ttl=int(cli['snapshot-ttl']))
+	scheduler = Scheduler(get_default_limits_path('musicmanager-{}'.format(cli['cred'])))
+
+	if cli['offline']:
+		if snapshot.fetched is None:
+			sys.exit("No cached Google Music library snapshot to use offline.")
+
+		mmw = None
+	else:
+		mmw = SessionWrapper('musicmanager', enable_logging=cli['log'], use_daemon=not cli['no-daemon'])
+
+		with stats.phase('login'):
+			mmw.login(oauth_filename=cli['cred'], uploader_id=cli['uploader-id'])
 
-	if not mmw.is_authenticated:
-		sys.exit()
+		if not mmw.is_authenticated:
+			sys.exit()
 
-	include_filters = [tuple(filt.split(':', 1)) for filt in cli['include-filter']]
-	exclude_filters = [tuple(filt.split(':', 1)) for filt in cli['exclude-filter']]
+	journal = TransferJournal(get_default_journal_path('gmdownload-{}'.format(cli['cred'])))
+	resumed = journal.load(kind='download') if cli['resume'] else None
 
-	songs_to_download, songs_to_filter = mmw.get_google_songs(
-		include_filters=include_filters, exclude_filters=exclude_filters,
-		all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
-	)
+	if cli['resume'] and resumed is None:
+		logger.info("No interrupted download to resume")
 
-	songs_to_download.sort(key=lambda song: (song.get('artist'), song.get('album'), song.get('track_number')))
+	if resumed is not None:
+		_, params, songs_to_download = resumed
+		songs_to_filter = []
+		cli['output'] = params.get('template', cli['output'])
+		template = PathTemplate(cli['output'])
 
-	if cli['dry-run']:
+		logger.info("Resuming download of {0} song(s) from {1}".format(len(songs_to_download), journal.path))
+
+		if not songs_to_download:
+			journal.finish()
+	else:
+		template = PathTemplate(cli['output'])
+
+		with stats.phase('listing') as phase:
+			songs_to_download, songs_to_filter = get_google_songs(
+				mmw, snapshot, filters=filters, offline=cli['offline'], refresh=cli['refresh'], scheduler=scheduler,
+				fields=set(COMPACT_FIELDS) | song_keys(parse_fields(cli['fields']) + parse_fields(cli['sort'])) | template.keys
+			)
+
+			phase.add(items=len(songs_to_download) + len(songs_to_filter))
+
+		if not cli['output-format']:
+			songs_to_download.sort(key=lambda song: (song.get('artist'), song.get('album'), song.get('track_number')))
+
+	snapshot.close()
+
+	if cli['output-format']:
+		with RecordWriter(
+				cli['output-format'], parse_fields(cli['fields']) or GOOGLE_FIELDS, sort=parse_fields(cli['sort'])) as writer:
+			writer.write_many(songs_to_download, 'download')
+			writer.write_many(songs_to_filter, 'filter')
+	elif cli['dry-run']:
 		logger.info("\nFound {0} song(s) to download".format(len(songs_to_download)))
 
 		if songs_to_download:
@@ -104,11 +198,32 @@ def main():
 	else:
 		if songs_to_download:
 			logger.info("\nDownloading {0} song(s) from Google Music\n".format(len(songs_to_download)))
-			mmw.download(songs_to_download, template=cli['output'])
+
+			if resumed is None:
+				# The default output is the current directory, which means something else when resuming elsewhere.
+				journal.start(
+					'download', songs_to_download, params={'template': SUGGESTED if template.suggested else cli['output']}
+				)
+
+			with stats.phase('download') as phase:
+				download_songs(
+					mmw.api, songs_to_download, template=template,
+					jobs=cli['jobs'], retries=cli['retries'], max_rate=cli['max-rate'], journal=journal, stats=phase,
+					scheduler=scheduler
+				)
+
+			journal.finish()
 		else:
 			logger.info("\nNo songs to download")
 
-	mmw.logout()
+	scheduler.save()
+
+	if mmw is not None:
+		mmw.logout()
+
+	if cli['stats']:
+		stats.emit(cli['stats'], cli['stats-file'])
+
 	logger.info("\nAll done!")
 
 
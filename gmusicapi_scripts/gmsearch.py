@@ -26,24 +26,148 @@ Options:
   -a, --all-includes                    Songs must match all include filter criteria to be included.
   -A, --all-excludes                    Songs must match all exclude filter criteria to be excluded.
   -y, --yes                             Display results without asking for confirmation.
+  -i, --interactive                     Load the library once and search it with queries until quitting.
+  --page-size SIZE                      Number of results per page in interactive mode. [Default: 20]
+  --offline                             Use the cached library snapshot without contacting Google Music.
+  --refresh                             Fetch the full library listing even if the cached snapshot is fresh.
+  --snapshot-ttl SECONDS                Seconds before the cached library snapshot is refreshed. [Default: 600]
+  --output-format FORMAT                Write results to standard output as ndjson, csv or tsv records
+                                        without asking for confirmation. Not available with -i, --interactive.
+  --fields FIELDS                       Comma-separated fields of --output-format records.
+                                        Default: action,id,title,artist,album,track
+  --sort FIELDS                         Sort --output-format records by comma-separated fields.
+                                        Prefix a field with - for descending order. Default: Unsorted.
+  --no-daemon                           Log in directly even if the gmd session daemon is running.
+  --stats FORMAT                        Output per-phase timings and metrics as json or prometheus.
+  --stats-file PATH                     Write --stats output to PATH instead of standard output.
+                                        The file is replaced atomically (e.g. for a Prometheus textfile collector).
 
 Patterns can be any valid Python regex patterns.
+
+Interactive queries are whitespace-separated terms that must all match (e.g. artist:muse title:hyster*).
+Terms are patterns searched in every field or, prefixed with field:, in one field
+(title, artist, album, albumartist, composer, genre, year, track, disc).
+A word ending in * matches words starting with it. Prefix a term with - to exclude matches.
+Enter :help in interactive mode for paging and sorting commands.
 """
 
 import logging
 import sys
+import time
 
 from docopt import docopt
 
-from gmusicapi_wrapper import MobileClientWrapper
-
-QUIET = 25
-logging.addLevelName(25, "QUIET")
+from gmusicapi_scripts.daemon import SessionWrapper
+from gmusicapi_scripts.filters import FilterError, FilterSet
+from gmusicapi_scripts.output import GOOGLE_FIELDS, OUTPUT_FORMATS, RecordWriter, parse_fields, song_keys
+from gmusicapi_scripts.scheduler import Scheduler, get_default_limits_path
+from gmusicapi_scripts.search import DEFAULT_SORT, FIELDS, QueryError, SongIndex
+from gmusicapi_scripts.snapshot import COMPACT_FIELDS, LibrarySnapshot, get_default_snapshot_path, get_google_songs
+from gmusicapi_scripts.stats import STATS_FORMATS, Stats
+from gmusicapi_scripts.utils import QUIET
 
 logger = logging.getLogger('gmusicapi_wrapper')
 sh = logging.StreamHandler()
 logger.addHandler(sh)
 
+INTERACTIVE_HELP = """
+<query>           Search the library (e.g. artist:muse -album:live title:hyster*).
+                  An empty query lists every song.
+:n, :next         Show the next page of results.
+:p, :prev         Show the previous page of results.
+:page NUMBER      Show a page of results.
+:size NUMBER      Set the number of results per page.
+:sort FIELD,...   Sort results by fields. Prefix a field with - for descending order.
+                  Fields: {}
+:help             Display this message.
+:q, :quit         Quit.
+""".format(", ".join(FIELDS))
+
+
+def _format_song(song):
+	title = song.get('title', "<empty>")
+	artist = song.get('artist', "<empty>")
+	album = song.get('album', "<empty>")
+
+	return "{0} -- {1} -- {2} ({3})".format(title, artist, album, song['id'])
+
+
+def _show_page(index, results, page, page_size):
+	pages = max(1, -(-len(results) // page_size))
+	page = min(max(page, 0), pages - 1)
+	start = page * page_size
+	width = len(str(len(results)))
+
+	logger.log(QUIET, "")
+
+	for number, position in enumerate(results[start:start + page_size], start + 1):
+		logger.log(QUIET, "{0:>{1}}. {2}".format(number, width, _format_song(index.songs[position])))
+
+	logger.log(QUIET, "\nPage {0}/{1} ({2} results)".format(page + 1, pages, len(results)))
+
+	return page
+
+
+def search_interactive(index, page_size=20):
+	"""Answer search queries from a song index until the user quits.
+
+	Parameters:
+		index (SongIndex): Index of the songs to search.
+
+		page_size (int): Number of results per page.
+	"""
+
+	sort_fields = DEFAULT_SORT
+	results = index.sort(range(len(index)), sort_fields)
+	page = 0
+
+	logger.log(QUIET, "Indexed {} songs. Enter :help for commands.".format(len(index)))
+
+	while True:
+		try:
+			line = input("\ngmsearch> ").strip()
+		except (EOFError, KeyboardInterrupt):
+			logger.log(QUIET, "")
+			break
+
+		command, _, argument = line.partition(' ')
+		argument = argument.strip()
+
+		try:
+			if command in (':q', ':quit'):
+				break
+			elif command == ':help':
+				logger.log(QUIET, INTERACTIVE_HELP)
+			elif command in (':n', ':next'):
+				page = _show_page(index, results, page + 1, page_size)
+			elif command in (':p', ':prev'):
+				page = _show_page(index, results, page - 1, page_size)
+			elif command == ':page':
+				page = _show_page(index, results, int(argument) - 1, page_size)
+			elif command == ':size':
+				page_size = max(1, int(argument))
+				page = _show_page(index, results, 0, page_size)
+			elif command == ':sort':
+				fields = [field.strip() for field in argument.split(',') if field.strip()] or DEFAULT_SORT
+
+				# Only keep the new sort order once it's known to be valid.
+				results = index.sort(results, fields)
+				sort_fields = fields
+				page = _show_page(index, results, 0, page_size)
+			elif command.startswith(':'):
+				logger.log(QUIET, "Unknown command '{}'. Enter :help for commands.".format(command))
+			else:
+				start = time.perf_counter()
+				results = index.sort(index.search(line), sort_fields)
+				elapsed = time.perf_counter() - start
+
+				page = _show_page(index, results, 0, page_size)
+				logger.info("Searched in {:.1f} ms".format(elapsed * 1000))
+		except QueryError as e:
+			logger.log(QUIET, str(e))
+		except ValueError:
+			logger.log(QUIET, "{} needs a number.".format(command))
+
 
 def main():
 	cli = dict((key.lstrip("-<").rstrip(">"), value) for key, value in docopt(__doc__).items())
@@ -53,24 +177,89 @@ def main():
 	else:
 		logger.setLevel(logging.INFO)
 
-	mcw = MobileClientWrapper(enable_logging=cli['log'])
-	mcw.login(username=cli['user'], password=cli['pass'], android_id=cli['android-id'])
+	if cli['stats'] and cli['stats'] not in STATS_FORMATS:
+		sys.exit("--stats must be one of: {}.".format(", ".join(STATS_FORMATS)))
 
-	if not mcw.is_authenticated:
-		sys.exit()
+	if not cli['page-size'].isdigit() or int(cli['page-size']) < 1:
+		sys.exit("--page-size must be a positive number.")
 
-	include_filters = [tuple(filt.split(':', 1)) for filt in cli['include-filter']]
-	exclude_filters = [tuple(filt.split(':', 1)) for filt in cli['exclude-filter']]
+	if cli['output-format'] and cli['output-format'] not in OUTPUT_FORMATS:
+		sys.exit("--output-format must be one of: {}.".format(", ".join(OUTPUT_FORMATS)))
 
-	logger.info("Scanning for songs...\n")
-	search_results, _ = mcw.get_google_songs(
-		include_filters=include_filters, exclude_filters=exclude_filters,
-		all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
+	if cli['output-format'] and cli['interactive']:
+		sys.exit("--output-format can't be used with --interactive.")
+
+	if cli['output-format'] and cli['stats'] and not cli['stats-file']:
+		sys.exit("--stats needs --stats-file with --output-format.")
+
+	stats = Stats('gmsearch', enabled=bool(cli['stats']))
+
+	try:
+		filters = FilterSet.parse(
+			cli['include-filter'], cli['exclude-filter'], all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
+		)
+	except FilterError as e:
+		sys.exit(str(e))
+
+	snapshot = LibrarySnapshot(
+		get_default_snapshot_path('mobileclient-{}'.format(cli['user'] or 'default')), ttl=int(cli['snapshot-ttl'])
 	)
+	scheduler = Scheduler(get_default_limits_path('mobileclient-{}'.format(cli['user'] or 'default')))
+
+	if cli['offline']:
+		if snapshot.fetched is None:
+			sys.exit("No cached Google Music library snapshot to search offline.")
+
+		mcw = None
+	else:
+		mcw = SessionWrapper('mobileclient', enable_logging=cli['log'], use_daemon=not cli['no-daemon'])
+
+		with stats.phase('login'):
+			mcw.login(username=cli['user'], password=cli['pass'], android_id=cli['android-id'])
+
+		if not mcw.is_authenticated:
+			sys.exit()
+
+	logger.info("Scanning for songs...\n")
 
-	search_results.sort(key=lambda song: (song.get('artist'), song.get('album'), song.get('trackNumber')))
+	with stats.phase('listing') as phase:
+		if cli['interactive']:
+			fields = {key for keys in FIELDS.values() for key in keys} | set(COMPACT_FIELDS)
+		else:
+			fields = set(COMPACT_FIELDS) | song_keys(parse_fields(cli['fields']) + parse_fields(cli['sort']))
+
+		search_results, filtered_results = get_google_songs(
+			mcw, snapshot, filters=filters, offline=cli['offline'], refresh=cli['refresh'], fields=fields,
+			scheduler=scheduler
+		)
+
+		phase.add(items=len(search_results) + len(filtered_results))
+
+	snapshot.close()
+	scheduler.save()
+
+	if cli['interactive']:
+		with stats.phase('index') as phase:
+			index = SongIndex(search_results)
+			phase.add(items=len(index))
+
+		if mcw is not None:
+			mcw.logout()
+
+		search_interactive(index, page_size=int(cli['page-size']))
+
+		if cli['stats']:
+			stats.emit(cli['stats'], cli['stats-file'])
+
+		return
+
+	if cli['output-format']:
+		with RecordWriter(
+				cli['output-format'], parse_fields(cli['fields']) or GOOGLE_FIELDS, sort=parse_fields(cli['sort'])) as writer:
+			writer.write_many(search_results, 'match')
+	elif search_results:
+		search_results.sort(key=lambda song: (song.get('artist'), song.get('album'), song.get('trackNumber')))
 
-	if search_results:
 		confirm = cli['yes'] or cli['quiet']
 		logger.info("")
 
@@ -87,7 +276,12 @@ def main():
 	else:
 		logger.info("\nNo songs found matching query")
 
-	mcw.logout()
+	if mcw is not None:
+		mcw.logout()
+
+	if cli['stats']:
+		stats.emit(cli['stats'], cli['stats-file'])
+
 	logger.info("\nAll done!")
 
 
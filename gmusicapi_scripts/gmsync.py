@@ -9,17 +9,23 @@ Usage:
   gmsync (-h | --help)
   gmsync up [-e PATTERN]... [-f FILTER]... [-F FILTER]... [options] [<input>]...
   gmsync down [-e PATTERN]... [-f FILTER]... [-F FILTER]... [options] [<output>]
+  gmsync both [-e PATTERN]... [-f FILTER]... [-F FILTER]... [options] [<output>]
+  gmsync watch [-e PATTERN]... [-f FILTER]... [-F FILTER]... [options] [<input>]...
   gmsync [-e PATTERN]... [-f FILTER]... [-F FILTER]... [options] [<input>]...
 
 Commands:
   up                                    Sync local songs to Google Music. Default behavior.
   down                                  Sync Google Music songs to local computer.
+  both                                  Sync songs both ways between Google Music and a local directory in one run.
+  watch                                 Watch local directories and upload songs as they are added or changed.
 
 Arguments:
   input                                 Files, directories, or glob patterns to upload.
+                                        Directories to watch with the watch command.
                                         Defaults to current directory.
   output                                Output file or directory name which can include a template pattern.
                                         Defaults to name suggested by Google Music in your current directory.
+                                        With both, local songs are also uploaded from the directory it saves in.
 
 Options:
   -h, --help                            Display help message.
@@ -41,15 +47,58 @@ Options:
   -e PATTERN, --exclude PATTERN         Exclude file paths matching pattern.
                                         This option can be set multiple times.
   -f FILTER, --include-filter FILTER    Include Google songs (download) or local songs (upload)
-                                        by field:pattern filter (e.g. "artist:Muse").
+                                        or both (both) by field:pattern filter (e.g. "artist:Muse").
                                         Songs can match any filter criteria.
                                         This option can be set multiple times.
   -F FILTER, --exclude-filter FILTER    Exclude Google songs (download) or local songs (upload)
-                                        by field:pattern filter (e.g. "artist:Muse").
+                                        or both (both) by field:pattern filter (e.g. "artist:Muse").
                                         Songs can match any filter criteria.
                                         This option can be set multiple times.
   -a, --all-includes                    Songs must match all include filter criteria to be included.
   -A, --all-excludes                    Songs must match all exclude filter criteria to be excluded.
+  --index PATH                          Cache local song metadata in the SQLite database at PATH.
+                                        Defaults to scan-index.sqlite in the gmusicapi-scripts cache directory.
+  --rebuild-index                       Discard the local song metadata cache and read every file again.
+  --scan-jobs JOBS                      Number of processes used to read local song tags. [Default: 1]
+                                        Also the number of files hashed at once with --skip-duplicates.
+  --skip-duplicates                     Skip uploading files whose audio, ignoring tags, matches another file
+                                        being uploaded or a song uploaded before. Audio hashes are cached
+                                        in fingerprints.sqlite in the gmusicapi-scripts cache directory.
+  --transcode-jobs JOBS                 Number of ffmpeg processes converting FLAC, M4A and Ogg files [Default: 0]
+                                        to MP3 ahead of the uploads. 0 leaves transcoding to each upload.
+                                        Google Music identifies an upload by the MD5 of the uploaded file without
+                                        tags, so songs are then identified by their transcoded MP3, which changes
+                                        with the ffmpeg version. Songs uploaded before without this option or with
+                                        another ffmpeg aren't found as already uploaded and are uploaded again.
+  --transcode-cache SIZE                Maximum size of transcoded files kept for later runs [Default: 2G]
+                                        in the gmusicapi-scripts cache directory. Accepts K, M and G suffixes.
+  --debounce SECONDS                    Seconds a watched file must be unchanged before it is uploaded. [Default: 2]
+  --explain                             With -d, --dry-run, show why each song is considered missing
+                                        and list songs that can't be matched one-to-one.
+  --offline                             Use the cached library snapshot without contacting Google Music.
+                                        Only available with -d, --dry-run.
+  --refresh                             Fetch the full library listing even if the cached snapshot is fresh.
+  --snapshot-ttl SECONDS                Seconds before the cached library snapshot is refreshed. [Default: 600]
+  -j JOBS, --jobs JOBS                  Number of songs to upload or download at once. [Default: 1]
+                                        With both, uploads and downloads share this budget.
+  --retries RETRIES                     Number of times to retry a failed upload or download. [Default: 3]
+  --max-rate RATE                       Limit the average combined download rate to RATE bytes per second.
+                                        Accepts K, M and G suffixes (e.g. 2M). Songs are fetched whole,
+                                        so this delays starting downloads rather than capping one in flight.
+  --resume                              Continue an interrupted up, down or both sync from its journal
+                                        without listing and comparing the libraries again.
+  --output-format FORMAT                With -d, --dry-run, write song lists to standard output as ndjson, csv or tsv
+                                        records instead of status messages. Not available with watch.
+  --fields FIELDS                       Comma-separated fields of --output-format records.
+                                        Default: action,id,title,artist,album,track,reason (down),
+                                        action,filepath,reason (up)
+                                        or action,id,filepath,title,artist,album,track,reason (both).
+  --sort FIELDS                         Sort --output-format records by comma-separated fields.
+                                        Prefix a field with - for descending order. Default: Unsorted.
+  --no-daemon                           Log in directly even if the gmd session daemon is running.
+  --stats FORMAT                        Output per-phase timings and metrics as json or prometheus.
+  --stats-file PATH                     Write --stats output to PATH instead of standard output.
+                                        The file is replaced atomically (e.g. for a Prometheus textfile collector).
 
 Patterns can be any valid Python regex patterns.
 """
@@ -60,28 +109,146 @@ import sys
 
 from docopt import docopt
 
-from gmusicapi_wrapper import MusicManagerWrapper
-from gmusicapi_wrapper.utils import compare_song_collections, template_to_filepath
-
-QUIET = 25
-logging.addLevelName(25, "QUIET")
+from gmusicapi_scripts.daemon import SessionWrapper
+from gmusicapi_scripts.diff import CollectionDiff, DiffEntry, diff_collections
+from gmusicapi_scripts.filters import FilterError, FilterSet
+from gmusicapi_scripts.fingerprint import FingerprintCache, get_default_fingerprint_path
+from gmusicapi_scripts.index import ScanIndex, get_default_index_path
+from gmusicapi_scripts.journal import TransferJournal, get_default_journal_path
+from gmusicapi_scripts.output import (
+	GOOGLE_FIELDS, LOCAL_FIELDS, OUTPUT_FORMATS, SYNC_FIELDS, RecordWriter, parse_fields, song_keys
+)
+from gmusicapi_scripts.scan import ScanStats, get_local_songs
+from gmusicapi_scripts.scheduler import Scheduler, get_default_limits_path
+from gmusicapi_scripts.snapshot import COMPACT_FIELDS, LibrarySnapshot, get_default_snapshot_path, get_google_songs
+from gmusicapi_scripts.stats import STATS_FORMATS, Stats
+from gmusicapi_scripts.template import SUGGESTED, PathTemplate
+from gmusicapi_scripts.transcode import TranscodeCache, Transcoder, get_default_transcode_dir
+from gmusicapi_scripts.transfer import download_songs, log_upload_summary, sync_songs, upload_songs
+from gmusicapi_scripts.utils import QUIET, parse_size
+from gmusicapi_scripts.watch import Watcher
 
 logger = logging.getLogger('gmusicapi_wrapper')
 sh = logging.StreamHandler()
 logger.addHandler(sh)
 
 
-def template_to_base_path(template, google_songs):
-	"""Get base output path for a list of songs for download."""
+def format_song(song):
+	"""Format a Google Music song dict or local filepath for output."""
+
+	if isinstance(song, dict):
+		title = song.get('title', "<title>")
+		artist = song.get('artist', "<artist>")
+		album = song.get('album', "<album>")
+		song_id = song['id']
+
+		return "{0} -- {1} -- {2} ({3})".format(title, artist, album, song_id)
+
+	return song
+
+
+def log_ambiguous(diff):
+	"""Output songs that can't be matched one-to-one between local and Google Music."""
+
+	if diff.ambiguous:
+		logger.info("\nAmbiguous songs (not transferred):\n")
+
+		for entry in diff.ambiguous:
+			logger.log(QUIET, "{0} | {1}".format(format_song(entry.item), entry.reason))
+	else:
+		logger.info("\nNo ambiguous songs")
+
+
+def log_download_plan(missing_local, explain=False):
+	"""Output the Google Music songs a dry run would download, with reasons if explain is ``True``."""
+
+	logger.info("\nFound {0} song(s) to download".format(len(missing_local)))
+
+	if missing_local:
+		logger.info("\nSongs to download:\n")
+
+		for entry in missing_local:
+			if explain:
+				logger.log(QUIET, "{0} | {1}".format(format_song(entry.item), entry.reason))
+			else:
+				logger.log(QUIET, format_song(entry.item))
+	else:
+		logger.info("\nNo songs to download")
+
+
+def log_upload_plan(missing_remote, explain=False):
+	"""Output the local songs a dry run would upload, with reasons if explain is ``True``."""
+
+	logger.info("\nFound {0} song(s) to upload".format(len(missing_remote)))
 
-	if template == os.getcwd() or template == '%suggested%':
-		base_path = os.getcwd()
+	if missing_remote:
+		logger.info("\nSongs to upload:\n")
+
+		for entry in missing_remote:
+			if explain:
+				logger.log(QUIET, "{0} | {1}".format(entry.item, entry.reason))
+			else:
+				logger.log(QUIET, entry.item)
 	else:
-		template = os.path.abspath(template)
-		song_paths = [template_to_filepath(template, song) for song in google_songs]
-		base_path = os.path.dirname(os.path.commonprefix(song_paths))
+		logger.info("\nNo songs to upload")
+
+
+def log_local_skips(songs_to_filter, songs_to_exclude, songs_to_skip, skip_duplicates=False):
+	"""Output the local songs a dry run would filter, exclude or skip as duplicates."""
+
+	if songs_to_filter:
+		logger.info("\nSongs to filter:\n")
+
+		for song in songs_to_filter:
+			logger.log(QUIET, song)
+	else:
+		logger.info("\nNo songs to filter")
+
+	if songs_to_exclude:
+		logger.info("\nSongs to exclude:\n")
+
+		for song in songs_to_exclude:
+			logger.log(QUIET, song)
+	else:
+		logger.info("\nNo songs to exclude")
+
+	if songs_to_skip:
+		logger.info("\nDuplicate songs to skip:\n")
 
-	return base_path
+		for song, reason in songs_to_skip:
+			logger.log(QUIET, "{0} | {1}".format(song, reason))
+	elif skip_duplicates:
+		logger.info("\nNo duplicate songs to skip")
+
+
+def load_resumed(journal, kind):
+	"""Load the remaining transfers of an interrupted sync from its journal.
+
+	Parameters:
+		journal (TransferJournal): Journal of the sync.
+
+		kind (str): The kind of job the sync journals: ``'upload'``, ``'download'`` or ``'sync'``.
+
+	Returns:
+		The job parameters and a list of :class:`DiffEntry` for the remaining songs,
+		or ``None`` if there is no interrupted sync.
+	"""
+
+	state = journal.load(kind=kind)
+
+	if state is None:
+		logger.info("No interrupted sync to resume")
+
+		return None
+
+	_, params, pending = state
+
+	logger.info("Resuming {0} song(s) from {1}".format(len(pending), journal.path))
+
+	if not pending:
+		journal.finish()
+
+	return params, [DiffEntry(item, None, "left over from interrupted sync") for item in pending]
 
 
 def main():
@@ -97,109 +264,407 @@ def main():
 	else:
 		logger.setLevel(logging.INFO)
 
+	if cli['stats'] and cli['stats'] not in STATS_FORMATS:
+		sys.exit("--stats must be one of: {}.".format(", ".join(STATS_FORMATS)))
+
+	if cli['output-format'] and cli['output-format'] not in OUTPUT_FORMATS:
+		sys.exit("--output-format must be one of: {}.".format(", ".join(OUTPUT_FORMATS)))
+
+	if cli['output-format'] and (not cli['dry-run'] or cli['watch']):
+		sys.exit("--output-format can only be used with --dry-run and without watch.")
+
+	if cli['output-format'] and cli['stats'] and not cli['stats-file']:
+		sys.exit("--stats needs --stats-file with --output-format.")
+
+	stats = Stats('gmsync', enabled=bool(cli['stats']))
+
+	try:
+		filters = FilterSet.parse(
+			cli['include-filter'], cli['exclude-filter'], all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
+		)
+	except FilterError as e:
+		sys.exit(str(e))
+
 	if not cli['input']:
 		cli['input'] = [os.getcwd()]
 
 	if not cli['output']:
 		cli['output'] = os.getcwd()
 
-	include_filters = [tuple(filt.split(':', 1)) for filt in cli['include-filter']]
-	exclude_filters = [tuple(filt.split(':', 1)) for filt in cli['exclude-filter']]
+	cli['jobs'] = int(cli['jobs'])
+	cli['scan-jobs'] = int(cli['scan-jobs'])
+	cli['retries'] = int(cli['retries'])
+	cli['max-rate'] = parse_size(cli['max-rate']) if cli['max-rate'] else None
+	cli['transcode-jobs'] = int(cli['transcode-jobs'])
+	cli['transcode-cache'] = parse_size(cli['transcode-cache'])
 
-	mmw = MusicManagerWrapper(enable_logging=cli['log'])
-	mmw.login(oauth_filename=cli['cred'], uploader_id=cli['uploader-id'])
+	if cli['offline'] and not cli['dry-run']:
+		sys.exit("--offline can only be used with --dry-run.")
 
-	if not mmw.is_authenticated:
-		sys.exit()
+	snapshot = LibrarySnapshot(get_default_snapshot_path('musicmanager-{}'.format(cli['cred'])), ttl=int(cli['snapshot-ttl']))
+	scheduler = Scheduler(get_default_limits_path('musicmanager-{}'.format(cli['cred'])))
 
-	if cli['down']:
-		matched_google_songs, _ = mmw.get_google_songs(
-			include_filters=include_filters, exclude_filters=exclude_filters,
-			all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
+	if cli['transcode-jobs'] and not (cli['down'] or cli['watch'] or cli['dry-run']):
+		transcoder = Transcoder(
+			TranscodeCache(get_default_transcode_dir(), cli['transcode-cache']), jobs=cli['transcode-jobs']
 		)
+	else:
+		transcoder = None
+
+	if cli['offline']:
+		if snapshot.fetched is None:
+			sys.exit("No cached Google Music library snapshot to use offline.")
 
-		logger.info("")
+		mmw = None
+	else:
+		mmw = SessionWrapper('musicmanager', enable_logging=cli['log'], use_daemon=not cli['no-daemon'])
 
-		cli['input'] = [template_to_base_path(cli['output'], matched_google_songs)]
+		with stats.phase('login'):
+			mmw.login(oauth_filename=cli['cred'], uploader_id=cli['uploader-id'])
 
-		matched_local_songs, __, __ = mmw.get_local_songs(cli['input'], exclude_patterns=cli['exclude'])
+		if not mmw.is_authenticated:
+			sys.exit()
 
-		logger.info("\nFinding missing songs...")
-		songs_to_download = compare_song_collections(matched_google_songs, matched_local_songs)
+	index = ScanIndex(cli['index'] or get_default_index_path(), rebuild=cli['rebuild-index'])
 
-		songs_to_download.sort(key=lambda song: (song.get('artist'), song.get('album'), song.get('track_number')))
+	if cli['down']:
+		journal = TransferJournal(get_default_journal_path('gmsync-down-{}'.format(cli['cred'])))
+		resumed = load_resumed(journal, 'download') if cli['resume'] else None
+
+		if resumed is not None:
+			params, entries = resumed
+			diff = CollectionDiff()
+			diff.missing_local = entries
+			cli['output'] = params.get('template', cli['output'])
+			template = PathTemplate(cli['output'])
+		else:
+			template = PathTemplate(cli['output'])
 
-		if cli['dry-run']:
-			logger.info("\nFound {0} song(s) to download".format(len(songs_to_download)))
+			with stats.phase('listing') as phase:
+				matched_google_songs, filtered_google_songs = get_google_songs(
+					mmw, snapshot, filters=filters, offline=cli['offline'], refresh=cli['refresh'], scheduler=scheduler,
+					fields=set(COMPACT_FIELDS) | song_keys(parse_fields(cli['fields']) + parse_fields(cli['sort'])) | template.keys
+				)
 
-			if songs_to_download:
-				logger.info("\nSongs to download:\n")
+				phase.add(items=len(matched_google_songs) + len(filtered_google_songs))
 
-				for song in songs_to_download:
-					title = song.get('title', "<title>")
-					artist = song.get('artist', "<artist>")
-					album = song.get('album', "<album>")
-					song_id = song['id']
+			logger.info("")
 
-					logger.log(QUIET, "{0} -- {1} -- {2} ({3})".format(title, artist, album, song_id))
-			else:
-				logger.info("\nNo songs to download")
+			# Local songs are looked for under the directory downloads are saved in.
+			cli['input'] = [template.base_path(matched_google_songs)]
+
+			scan_stats = ScanStats()
+
+			with stats.phase('scan') as phase:
+				matched_local_songs, __, excluded_local_songs = get_local_songs(
+					cli['input'], exclude_patterns=cli['exclude'], index=index, scan_jobs=cli['scan-jobs'],
+					scan_stats=scan_stats
+				)
+
+				phase.add(items=len(matched_local_songs) + len(excluded_local_songs), **scan_stats.as_dict())
+
+			logger.info("\nFinding missing songs...")
+
+			with stats.phase('diff') as phase:
+				diff = diff_collections(matched_local_songs, matched_google_songs, get_metadata=index.metadata)
+
+				phase.add(items=len(matched_local_songs) + len(matched_google_songs))
+
+		missing_local = sorted(
+			diff.missing_local, key=lambda entry: (entry.item.get('artist'), entry.item.get('album'), entry.item.get('track_number'))
+		)
+		songs_to_download = [entry.item for entry in missing_local]
+
+		if cli['output-format']:
+			with RecordWriter(
+					cli['output-format'], parse_fields(cli['fields']) or GOOGLE_FIELDS + ['reason'],
+					sort=parse_fields(cli['sort'])) as writer:
+				writer.write_many(((entry.item, entry.reason) for entry in missing_local), 'download')
+				writer.write_many(((entry.item, entry.reason) for entry in diff.ambiguous), 'ambiguous')
+		elif cli['dry-run']:
+			log_download_plan(missing_local, explain=cli['explain'])
+
+			if cli['explain']:
+				log_ambiguous(diff)
 		else:
 			if songs_to_download:
 				logger.info("\nDownloading {0} song(s) from Google Music\n".format(len(songs_to_download)))
-				mmw.download(songs_to_download, template=cli['output'])
+
+				if resumed is None:
+					# The default output is the current directory, which means something else when resuming elsewhere.
+					journal.start(
+						'download', songs_to_download, params={'template': SUGGESTED if template.suggested else cli['output']}
+					)
+
+				with stats.phase('download') as phase:
+					download_songs(
+						mmw.api, songs_to_download, template=template,
+						jobs=cli['jobs'], retries=cli['retries'], max_rate=cli['max-rate'], journal=journal, stats=phase,
+						scheduler=scheduler
+					)
+
+				journal.finish()
 			else:
 				logger.info("\nNo songs to download")
-	else:
-		matched_google_songs, _ = mmw.get_google_songs()
+	elif cli['both']:
+		journal = TransferJournal(get_default_journal_path('gmsync-both-{}'.format(cli['cred'])))
+		resumed = load_resumed(journal, 'sync') if cli['resume'] else None
+		fingerprints = FingerprintCache(get_default_fingerprint_path()) if cli['skip-duplicates'] else None
+		songs_to_skip = []
+
+		if resumed is not None:
+			params, entries = resumed
+			diff = CollectionDiff()
+			diff.missing_local = [entry for entry in entries if isinstance(entry.item, dict)]
+			diff.missing_remote = [entry for entry in entries if not isinstance(entry.item, dict)]
+			cli['output'] = params.get('template', cli['output'])
+			template = PathTemplate(cli['output'])
+			songs_to_filter, songs_to_exclude = [], []
+		else:
+			template = PathTemplate(cli['output'])
 
-		logger.info("")
+			# Both libraries are listed and compared once for both directions.
+			with stats.phase('listing') as phase:
+				matched_google_songs, filtered_google_songs = get_google_songs(
+					mmw, snapshot, filters=filters, offline=cli['offline'], refresh=cli['refresh'], scheduler=scheduler,
+					fields=set(COMPACT_FIELDS) | song_keys(parse_fields(cli['fields']) + parse_fields(cli['sort'])) | template.keys
+				)
 
-		matched_local_songs, songs_to_filter, songs_to_exclude = mmw.get_local_songs(
-			cli['input'], include_filters=include_filters, exclude_filters=exclude_filters,
-			all_includes=cli['all-includes'], all_excludes=cli['all-excludes'],
-			exclude_patterns=cli['exclude'], max_depth=cli['max-depth']
-		)
+				phase.add(items=len(matched_google_songs) + len(filtered_google_songs))
+
+			# Songs left out by filters are still in the library, so their audio is kept.
+			if fingerprints is not None:
+				fingerprints.prune_remote(
+					cli['cred'], {song['id'] for song in matched_google_songs + filtered_google_songs}
+				)
+
+			logger.info("")
 
-		logger.info("\nFinding missing songs...")
+			# Local songs are uploaded from and downloaded to the same directory.
+			cli['input'] = [template.base_path(matched_google_songs)]
 
-		songs_to_upload = compare_song_collections(matched_local_songs, matched_google_songs)
+			scan_stats = ScanStats()
+
+			with stats.phase('scan') as phase:
+				matched_local_songs, songs_to_filter, songs_to_exclude = get_local_songs(
+					cli['input'], filters=filters, exclude_patterns=cli['exclude'], max_depth=cli['max-depth'],
+					index=index, scan_jobs=cli['scan-jobs'], scan_stats=scan_stats
+				)
+
+				phase.add(
+					items=len(matched_local_songs) + len(songs_to_filter) + len(songs_to_exclude), **scan_stats.as_dict()
+				)
+
+			logger.info("\nFinding missing songs...")
+
+			with stats.phase('diff') as phase:
+				diff = diff_collections(matched_local_songs, matched_google_songs, get_metadata=index.metadata)
+
+				phase.add(items=len(matched_local_songs) + len(matched_google_songs))
 
 		# Sort lists for sensible output.
-		songs_to_upload.sort()
+		missing_local = sorted(
+			diff.missing_local, key=lambda entry: (entry.item.get('artist'), entry.item.get('album'), entry.item.get('track_number'))
+		)
+		missing_remote = sorted(diff.missing_remote, key=lambda entry: entry.item)
+		songs_to_download = [entry.item for entry in missing_local]
+		songs_to_upload = [entry.item for entry in missing_remote]
 		songs_to_exclude.sort()
 
-		if cli['dry-run']:
-			logger.info("\nFound {0} song(s) to upload".format(len(songs_to_upload)))
+		if fingerprints is not None and resumed is None:
+			with stats.phase('fingerprint') as phase:
+				songs_to_upload, songs_to_skip = fingerprints.split_duplicates(
+					songs_to_upload, cli['cred'], jobs=cli['scan-jobs']
+				)
+
+				phase.add(items=len(songs_to_upload) + len(songs_to_skip))
+
+			unique = set(songs_to_upload)
+			missing_remote = [entry for entry in missing_remote if entry.item in unique]
+
+		if cli['output-format']:
+			with RecordWriter(
+					cli['output-format'], parse_fields(cli['fields']) or SYNC_FIELDS,
+					sort=parse_fields(cli['sort'])) as writer:
+				writer.write_many(((entry.item, entry.reason) for entry in missing_local), 'download')
+				writer.write_many(((entry.item, entry.reason) for entry in missing_remote), 'upload')
+				writer.write_many(((entry.item, entry.reason) for entry in diff.ambiguous), 'ambiguous')
+				writer.write_many(songs_to_filter, 'filter')
+				writer.write_many(songs_to_exclude, 'exclude')
+				writer.write_many(songs_to_skip, 'skip')
+		elif cli['dry-run']:
+			log_download_plan(missing_local, explain=cli['explain'])
+			log_upload_plan(missing_remote, explain=cli['explain'])
+
+			if cli['explain']:
+				log_ambiguous(diff)
+
+			log_local_skips(songs_to_filter, songs_to_exclude, songs_to_skip, skip_duplicates=fingerprints is not None)
+		else:
+			if songs_to_skip:
+				logger.info("\nSkipping {} duplicate song(s)".format(len(songs_to_skip)))
+
+				for song, reason in songs_to_skip:
+					logger.debug("{0} | {1}".format(song, reason))
+
+			if songs_to_download or songs_to_upload:
+				logger.info(
+					"\nDownloading {0} song(s) from and uploading {1} song(s) to Google Music\n".format(
+						len(songs_to_download), len(songs_to_upload)
+					)
+				)
+
+				if resumed is None:
+					journal.start(
+						'sync', songs_to_download + songs_to_upload,
+						params={'template': SUGGESTED if template.suggested else cli['output']}
+					)
+
+				with stats.phase('transfer') as phase:
+					_, results = sync_songs(
+						mmw.api, songs_to_download,
+						transcoder.stage(songs_to_upload) if transcoder is not None else songs_to_upload,
+						template=template, enable_matching=cli['match'], delete_on_success=cli['delete-on-success'],
+						jobs=cli['jobs'], retries=cli['retries'], max_rate=cli['max-rate'], journal=journal, stats=phase,
+						scheduler=scheduler, transcoded=transcoder.outputs if transcoder is not None else None
+					)
+
+				journal.finish()
+
+				if results:
+					log_upload_summary(results)
+
+					if fingerprints is not None:
+						fingerprints.remember_uploads(cli['cred'], results)
+
+					# New uploads aren't in the snapshot yet.
+					snapshot.expire()
+			else:
+				logger.info("\nNo songs to download or upload")
+
+		if fingerprints is not None:
+			fingerprints.close()
+	elif cli['watch']:
+		watcher = Watcher(
+			mmw.api if mmw is not None else None, cli['input'], filters=filters,
+			exclude_patterns=cli['exclude'], max_depth=cli['max-depth'], delay=float(cli['debounce']), index=index,
+			enable_matching=cli['match'], delete_on_success=cli['delete-on-success'], retries=cli['retries'],
+			dry_run=cli['dry-run'], scheduler=scheduler
+		)
 
-			if songs_to_upload:
-				logger.info("\nSongs to upload:\n")
+		with stats.phase('watch') as phase:
+			watcher.run()
 
-				for song in songs_to_upload:
-					logger.log(QUIET, song)
-			else:
-				logger.info("\nNo songs to upload")
+			phase.add(items=len(watcher.results))
 
-			if songs_to_filter:
-				logger.info("\nSongs to filter:\n")
+		if watcher.results:
+			log_upload_summary(watcher.results)
 
-				for song in songs_to_filter:
-					logger.log(QUIET, song)
-			else:
-				logger.info("\nNo songs to filter")
+			# New uploads aren't in the snapshot yet.
+			snapshot.expire()
+	else:
+		journal = TransferJournal(get_default_journal_path('gmsync-up-{}'.format(cli['cred'])))
+		resumed = load_resumed(journal, 'upload') if cli['resume'] else None
+		fingerprints = FingerprintCache(get_default_fingerprint_path()) if cli['skip-duplicates'] else None
+		songs_to_skip = []
+
+		if resumed is not None:
+			_, entries = resumed
+			diff = CollectionDiff()
+			diff.missing_remote = entries
+			matched_local_songs, songs_to_filter, songs_to_exclude = [], [], []
+		else:
+			with stats.phase('listing') as phase:
+				matched_google_songs, _ = get_google_songs(
+					mmw, snapshot, offline=cli['offline'], refresh=cli['refresh'], fields=COMPACT_FIELDS, scheduler=scheduler
+				)
 
-			if songs_to_exclude:
-				logger.info("\nSongs to exclude:\n")
+				phase.add(items=len(matched_google_songs))
 
-				for song in songs_to_exclude:
-					logger.log(QUIET, song)
-			else:
-				logger.info("\nNo songs to exclude")
+			if fingerprints is not None:
+				fingerprints.prune_remote(cli['cred'], {song['id'] for song in matched_google_songs})
+
+			logger.info("")
+
+			scan_stats = ScanStats()
+
+			with stats.phase('scan') as phase:
+				matched_local_songs, songs_to_filter, songs_to_exclude = get_local_songs(
+					cli['input'], filters=filters, exclude_patterns=cli['exclude'], max_depth=cli['max-depth'],
+					index=index, scan_jobs=cli['scan-jobs'], scan_stats=scan_stats
+				)
+
+				phase.add(
+					items=len(matched_local_songs) + len(songs_to_filter) + len(songs_to_exclude), **scan_stats.as_dict()
+				)
+
+			logger.info("\nFinding missing songs...")
+
+			with stats.phase('diff') as phase:
+				diff = diff_collections(matched_local_songs, matched_google_songs, get_metadata=index.metadata)
+
+				phase.add(items=len(matched_local_songs) + len(matched_google_songs))
+
+		# Sort lists for sensible output.
+		missing_remote = sorted(diff.missing_remote, key=lambda entry: entry.item)
+		songs_to_upload = [entry.item for entry in missing_remote]
+		songs_to_exclude.sort()
+
+		if fingerprints is not None and resumed is None:
+			with stats.phase('fingerprint') as phase:
+				songs_to_upload, songs_to_skip = fingerprints.split_duplicates(
+					songs_to_upload, cli['cred'], jobs=cli['scan-jobs']
+				)
+
+				phase.add(items=len(songs_to_upload) + len(songs_to_skip))
+
+			unique = set(songs_to_upload)
+			missing_remote = [entry for entry in missing_remote if entry.item in unique]
+
+		if cli['output-format']:
+			with RecordWriter(
+					cli['output-format'], parse_fields(cli['fields']) or LOCAL_FIELDS, sort=parse_fields(cli['sort'])) as writer:
+				writer.write_many(((entry.item, entry.reason) for entry in missing_remote), 'upload')
+				writer.write_many(((entry.item, entry.reason) for entry in diff.ambiguous), 'ambiguous')
+				writer.write_many(songs_to_filter, 'filter')
+				writer.write_many(songs_to_exclude, 'exclude')
+				writer.write_many(songs_to_skip, 'skip')
+		elif cli['dry-run']:
+			log_upload_plan(missing_remote, explain=cli['explain'])
+
+			if cli['explain']:
+				log_ambiguous(diff)
+
+			log_local_skips(songs_to_filter, songs_to_exclude, songs_to_skip, skip_duplicates=fingerprints is not None)
 		else:
+			if songs_to_skip:
+				logger.info("\nSkipping {} duplicate song(s)".format(len(songs_to_skip)))
+
+				for song, reason in songs_to_skip:
+					logger.debug("{0} | {1}".format(song, reason))
+
 			if songs_to_upload:
 				logger.info("\nUploading {0} song(s) to Google Music\n".format(len(songs_to_upload)))
 
-				mmw.upload(songs_to_upload, enable_matching=cli['match'], delete_on_success=cli['delete-on-success'])
+				if resumed is None:
+					journal.start('upload', songs_to_upload)
+
+				with stats.phase('upload') as phase:
+					results = upload_songs(
+						mmw.api, transcoder.stage(songs_to_upload) if transcoder is not None else songs_to_upload,
+						enable_matching=cli['match'], delete_on_success=cli['delete-on-success'],
+						jobs=cli['jobs'], retries=cli['retries'], journal=journal, stats=phase, scheduler=scheduler,
+						transcoded=transcoder.outputs if transcoder is not None else None
+					)
+
+				journal.finish()
+				log_upload_summary(results)
+
+				if fingerprints is not None:
+					fingerprints.remember_uploads(cli['cred'], results)
+
+				# New uploads aren't in the snapshot yet.
+				snapshot.expire()
 			else:
 				logger.info("\nNo songs to upload")
 
@@ -211,7 +676,22 @@ def main():
 						except:
 							logger.warning("Failed to remove {} after successful upload".format(song))
 
-	mmw.logout()
+		if fingerprints is not None:
+			fingerprints.close()
+
+	if transcoder is not None:
+		transcoder.close()
+
+	index.close()
+	snapshot.close()
+	scheduler.save()
+
+	if mmw is not None:
+		mmw.logout()
+
+	if cli['stats']:
+		stats.emit(cli['stats'], cli['stats-file'])
+
 	logger.info("\nAll done!")
 
 
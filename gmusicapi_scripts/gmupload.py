@@ -39,6 +39,38 @@ Options:
                                         This option can be set multiple times.
   -a, --all-includes                    Songs must match all include filter criteria to be included.
   -A, --all-excludes                    Songs must match all exclude filter criteria to be excluded.
+  --index PATH                          Cache local song metadata in the SQLite database at PATH.
+                                        Defaults to scan-index.sqlite in the gmusicapi-scripts cache directory.
+  --rebuild-index                       Discard the local song metadata cache and read every file again.
+  --scan-jobs JOBS                      Number of processes used to read local song tags. [Default: 1]
+                                        Also the number of files hashed at once with --skip-duplicates.
+  --skip-duplicates                     Skip files whose audio, ignoring tags, matches another file being uploaded
+                                        or a song uploaded before. Audio hashes are cached in fingerprints.sqlite
+                                        in the gmusicapi-scripts cache directory.
+  --transcode-jobs JOBS                 Number of ffmpeg processes converting FLAC, M4A and Ogg files [Default: 0]
+                                        to MP3 ahead of the uploads. 0 leaves transcoding to each upload.
+                                        Google Music identifies an upload by the MD5 of the uploaded file without
+                                        tags, so songs are then identified by their transcoded MP3, which changes
+                                        with the ffmpeg version. Songs uploaded before without this option or with
+                                        another ffmpeg aren't found as already uploaded and are uploaded again.
+  --transcode-cache SIZE                Maximum size of transcoded files kept for later runs [Default: 2G]
+                                        in the gmusicapi-scripts cache directory. Accepts K, M and G suffixes.
+  -j JOBS, --jobs JOBS                  Number of songs to upload at once. [Default: 1]
+  --stream                              Start uploading songs as soon as they are found instead of after the scan.
+                                        Songs are uploaded in scan order rather than sorted.
+                                        Tags are read in a single process; --scan-jobs has no effect.
+  --retries RETRIES                     Number of times to retry a failed upload. [Default: 3]
+  --resume                              Continue an interrupted upload from its journal without scanning again.
+  --output-format FORMAT                With -d, --dry-run, write song lists to standard output as ndjson, csv or tsv
+                                        records instead of status messages.
+  --fields FIELDS                       Comma-separated fields of --output-format records.
+                                        Default: action,filepath,reason
+  --sort FIELDS                         Sort --output-format records by comma-separated fields.
+                                        Prefix a field with - for descending order. Default: Unsorted.
+  --no-daemon                           Log in directly even if the gmd session daemon is running.
+  --stats FORMAT                        Output per-phase timings and metrics as json or prometheus.
+  --stats-file PATH                     Write --stats output to PATH instead of standard output.
+                                        The file is replaced atomically (e.g. for a Prometheus textfile collector).
 
 Patterns can be any valid Python regex patterns.
 """
@@ -49,10 +81,19 @@ import sys
 
 from docopt import docopt
 
-from gmusicapi_wrapper import MusicManagerWrapper
-
-QUIET = 25
-logging.addLevelName(25, "QUIET")
+from gmusicapi_scripts.daemon import SessionWrapper
+from gmusicapi_scripts.filters import FilterError, FilterSet
+from gmusicapi_scripts.fingerprint import FingerprintCache, get_default_fingerprint_path
+from gmusicapi_scripts.index import ScanIndex, get_default_index_path
+from gmusicapi_scripts.journal import TransferJournal, get_default_journal_path
+from gmusicapi_scripts.output import LOCAL_FIELDS, OUTPUT_FORMATS, RecordWriter, parse_fields
+from gmusicapi_scripts.scan import ScanStats, get_local_songs, iter_local_songs
+from gmusicapi_scripts.scheduler import Scheduler, get_default_limits_path
+from gmusicapi_scripts.snapshot import LibrarySnapshot, get_default_snapshot_path
+from gmusicapi_scripts.stats import STATS_FORMATS, Stats
+from gmusicapi_scripts.transcode import TranscodeCache, Transcoder, get_default_transcode_dir
+from gmusicapi_scripts.transfer import log_upload_summary, upload_songs
+from gmusicapi_scripts.utils import QUIET, buffered, parse_size
 
 logger = logging.getLogger('gmusicapi_wrapper')
 sh = logging.StreamHandler()
@@ -72,28 +113,148 @@ def main():
 	else:
 		logger.setLevel(logging.INFO)
 
+	if cli['stats'] and cli['stats'] not in STATS_FORMATS:
+		sys.exit("--stats must be one of: {}.".format(", ".join(STATS_FORMATS)))
+
+	if cli['output-format'] and cli['output-format'] not in OUTPUT_FORMATS:
+		sys.exit("--output-format must be one of: {}.".format(", ".join(OUTPUT_FORMATS)))
+
+	if cli['output-format'] and not cli['dry-run']:
+		sys.exit("--output-format can only be used with --dry-run.")
+
+	if cli['output-format'] and cli['stats'] and not cli['stats-file']:
+		sys.exit("--stats needs --stats-file with --output-format.")
+
+	stats = Stats('gmupload', enabled=bool(cli['stats']))
+
+	try:
+		filters = FilterSet.parse(
+			cli['include-filter'], cli['exclude-filter'], all_includes=cli['all-includes'], all_excludes=cli['all-excludes']
+		)
+	except FilterError as e:
+		sys.exit(str(e))
+
 	if not cli['input']:
 		cli['input'] = [os.getcwd()]
 
-	mmw = MusicManagerWrapper(enable_logging=cli['log'])
-	mmw.login(oauth_filename=cli['cred'], uploader_id=cli['uploader-id'])
+	cli['jobs'] = int(cli['jobs'])
+	cli['scan-jobs'] = int(cli['scan-jobs'])
+	cli['retries'] = int(cli['retries'])
+	cli['transcode-jobs'] = int(cli['transcode-jobs'])
+	cli['transcode-cache'] = parse_size(cli['transcode-cache'])
+
+	mmw = SessionWrapper('musicmanager', enable_logging=cli['log'], use_daemon=not cli['no-daemon'])
+
+	with stats.phase('login'):
+		mmw.login(oauth_filename=cli['cred'], uploader_id=cli['uploader-id'])
 
 	if not mmw.is_authenticated:
 		sys.exit()
 
-	include_filters = [tuple(filt.split(':', 1)) for filt in cli['include-filter']]
-	exclude_filters = [tuple(filt.split(':', 1)) for filt in cli['exclude-filter']]
+	index = ScanIndex(cli['index'] or get_default_index_path(), rebuild=cli['rebuild-index'])
+	scheduler = Scheduler(get_default_limits_path('musicmanager-{}'.format(cli['cred'])))
+
+	if cli['transcode-jobs'] and not cli['dry-run']:
+		transcoder = Transcoder(
+			TranscodeCache(get_default_transcode_dir(), cli['transcode-cache']), jobs=cli['transcode-jobs']
+		)
+	else:
+		transcoder = None
+
+	fingerprints = FingerprintCache(get_default_fingerprint_path()) if cli['skip-duplicates'] else None
+	songs_to_skip = []
+	journal = TransferJournal(get_default_journal_path('gmupload-{}'.format(cli['cred'])))
+	resumed = journal.load(kind='upload') if cli['resume'] else None
+
+	if cli['resume'] and resumed is None:
+		logger.info("No interrupted upload to resume")
+
+	if resumed is not None:
+		_, _, songs_to_upload = resumed
+		songs_to_filter, songs_to_exclude = [], []
+
+		logger.info("Resuming upload of {0} song(s) from {1}".format(len(songs_to_upload), journal.path))
+
+		if not songs_to_upload:
+			journal.finish()
+	elif cli['stream'] and not cli['dry-run']:
+		scan_stats = ScanStats()
+		local_songs = iter_local_songs(
+			cli['input'], filters=filters, exclude_patterns=cli['exclude'], max_depth=cli['max-depth'], index=index,
+			scan_stats=scan_stats
+		)
+
+		songs_to_upload = (filepath for status, filepath in local_songs if status == 'matched')
+
+		if fingerprints is not None:
+			songs_to_upload = fingerprints.iter_unique(songs_to_upload, cli['cred'], duplicates=songs_to_skip)
+
+		if transcoder is not None:
+			songs_to_upload = transcoder.stage(songs_to_upload)
+
+		# The bounded buffer keeps the scanner only a few songs ahead of the uploads.
+		songs_to_upload = buffered(songs_to_upload, cli['jobs'] * 4)
+
+		journal.start('upload', [])
+
+		# Scanning and uploading overlap, so they are timed as a single phase.
+		with stats.phase('stream') as phase:
+			results = upload_songs(
+				mmw.api, journal.iter_plan(songs_to_upload), enable_matching=cli['match'],
+				delete_on_success=cli['delete-on-success'], jobs=cli['jobs'], retries=cli['retries'],
+				journal=journal, stats=phase, scheduler=scheduler,
+				transcoded=transcoder.outputs if transcoder is not None else None
+			)
+
+			phase.add(**scan_stats.as_dict())
+
+		journal.finish()
 
-	songs_to_upload, songs_to_filter, songs_to_exclude = mmw.get_local_songs(
-		cli['input'], include_filters=include_filters, exclude_filters=exclude_filters,
-		all_includes=cli['all-includes'], all_excludes=cli['all-excludes'],
-		exclude_patterns=cli['exclude'], max_depth=cli['max-depth']
-	)
+		if fingerprints is not None:
+			fingerprints.remember_uploads(cli['cred'], results)
 
-	songs_to_upload.sort()
-	songs_to_exclude.sort()
+		if results:
+			log_upload_summary(results)
 
-	if cli['dry-run']:
+			with LibrarySnapshot(get_default_snapshot_path('musicmanager-{}'.format(cli['cred']))) as snapshot:
+				snapshot.expire()
+		else:
+			logger.info("\nNo songs to upload")
+	else:
+		scan_stats = ScanStats()
+
+		with stats.phase('scan') as phase:
+			songs_to_upload, songs_to_filter, songs_to_exclude = get_local_songs(
+				cli['input'], filters=filters, exclude_patterns=cli['exclude'], max_depth=cli['max-depth'],
+				index=index, scan_jobs=cli['scan-jobs'], scan_stats=scan_stats
+			)
+
+			phase.add(
+				items=len(songs_to_upload) + len(songs_to_filter) + len(songs_to_exclude), **scan_stats.as_dict()
+			)
+
+		if not cli['output-format']:
+			songs_to_upload.sort()
+			songs_to_exclude.sort()
+
+		if fingerprints is not None:
+			with stats.phase('fingerprint') as phase:
+				songs_to_upload, songs_to_skip = fingerprints.split_duplicates(
+					songs_to_upload, cli['cred'], jobs=cli['scan-jobs']
+				)
+
+				phase.add(items=len(songs_to_upload) + len(songs_to_skip))
+
+	index.close()
+
+	if cli['output-format']:
+		with RecordWriter(
+				cli['output-format'], parse_fields(cli['fields']) or LOCAL_FIELDS, sort=parse_fields(cli['sort'])) as writer:
+			writer.write_many(songs_to_upload, 'upload')
+			writer.write_many(songs_to_filter, 'filter')
+			writer.write_many(songs_to_exclude, 'exclude')
+			writer.write_many(songs_to_skip, 'skip')
+	elif cli['dry-run']:
 		logger.info("\nFound {0} song(s) to upload".format(len(songs_to_upload)))
 
 		if songs_to_upload:
@@ -119,15 +280,59 @@ def main():
 				logger.log(QUIET, song)
 		else:
 			logger.info("\nNo songs to exclude")
-	else:
+
+		if songs_to_skip:
+			logger.info("\nDuplicate songs to skip:\n")
+
+			for song, reason in songs_to_skip:
+				logger.log(QUIET, "{0} | {1}".format(song, reason))
+		elif fingerprints is not None:
+			logger.info("\nNo duplicate songs to skip")
+	elif resumed is not None or not cli['stream']:
+		if songs_to_skip:
+			logger.info("\nSkipping {} duplicate song(s)".format(len(songs_to_skip)))
+
+			for song, reason in songs_to_skip:
+				logger.debug("{0} | {1}".format(song, reason))
+
 		if songs_to_upload:
 			logger.info("\nUploading {0} song(s) to Google Music\n".format(len(songs_to_upload)))
 
-			mmw.upload(songs_to_upload, enable_matching=cli['match'], delete_on_success=cli['delete-on-success'])
+			if resumed is None:
+				journal.start('upload', songs_to_upload)
+
+			with stats.phase('upload') as phase:
+				results = upload_songs(
+					mmw.api, transcoder.stage(songs_to_upload) if transcoder is not None else songs_to_upload,
+					enable_matching=cli['match'], delete_on_success=cli['delete-on-success'],
+					jobs=cli['jobs'], retries=cli['retries'], journal=journal, stats=phase, scheduler=scheduler,
+					transcoded=transcoder.outputs if transcoder is not None else None
+				)
+
+			journal.finish()
+			log_upload_summary(results)
+
+			if fingerprints is not None:
+				fingerprints.remember_uploads(cli['cred'], results)
+
+			# New uploads aren't in the cached library snapshot used by the other scripts yet.
+			with LibrarySnapshot(get_default_snapshot_path('musicmanager-{}'.format(cli['cred']))) as snapshot:
+				snapshot.expire()
 		else:
 			logger.info("\nNo songs to upload")
 
+	if fingerprints is not None:
+		fingerprints.close()
+
+	if transcoder is not None:
+		transcoder.close()
+
+	scheduler.save()
 	mmw.logout()
+
+	if cli['stats']:
+		stats.emit(cli['stats'], cli['stats-file'])
+
 	logger.info("\nAll done!")
 
 
@@ -0,0 +1,168 @@
+# coding=utf-8
+
+"""Persistent index of local song metadata.
+
+	>>> from gmusicapi_scripts.index import ScanIndex
+"""
+
+import json
+import logging
+import os
+import sqlite3
+
+from .utils import get_cache_dir
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+
+def get_default_index_path():
+	"""Get the default filepath of the local song metadata index."""
+
+	return os.path.join(get_cache_dir(), 'scan-index.sqlite')
+
+
+def read_metadata(filepath):
+	"""Read the tags of a local music file.
+
+	Parameters:
+		filepath (str): Path of a music file.
+
+	Returns:
+		A dict of mutagen easy tag lists or ``None`` if the file can't be loaded as a music file.
+	"""
+
+	import mutagen
+
+	try:
+		metadata = mutagen.File(filepath, easy=True)
+	except (mutagen.MutagenError, OSError):
+		metadata = None
+
+	if metadata is None:
+		logger.warning("Can't load {} as music file.".format(filepath))
+
+		return None
+
+	return dict((key, list(value)) for key, value in metadata.items())
+
+
+def encode_metadata(metadata):
+	"""Encode metadata as it's stored in the index.
+
+	Scan workers return this instead of the metadata dict, so only a single string is pickled back to the parent.
+	"""
+
+	return json.dumps(metadata, separators=(',', ':'))
+
+
+class ScanIndex:
+	"""SQLite-backed cache of local song metadata keyed by path, size and mtime.
+
+	Files whose size and mtime are unchanged since they were indexed are answered from the index.
+	New or modified files are re-parsed and their entries replaced.
+
+	Parameters:
+		path (str): Filepath of the SQLite database. Created if it doesn't exist.
+
+		rebuild (bool): Discard all existing entries. Default: ``False``
+	"""
+
+	def __init__(self, path, rebuild=False):
+		dirname = os.path.dirname(os.path.abspath(path))
+		os.makedirs(dirname, exist_ok=True)
+
+		self.path = path
+		self.hits = 0
+		self.misses = 0
+
+		# The index may be handed to a scanner thread; it is never used from two threads at once.
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("PRAGMA synchronous=NORMAL")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS songs ("
+			"path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, metadata TEXT)"
+		)
+
+		if rebuild:
+			logger.info("Rebuilding local song index {}".format(path))
+			self._conn.execute("DELETE FROM songs")
+
+		self._conn.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		"""Commit pending entries and close the database."""
+
+		if self._conn is not None:
+			self._conn.commit()
+			self._conn.close()
+			self._conn = None
+
+	def get(self, filepath, size, mtime):
+		"""Get indexed metadata for a file.
+
+		Parameters:
+			filepath (str): Path of a music file.
+
+			size (int): Current size of the file in bytes.
+
+			mtime (int): Current modification time of the file in nanoseconds.
+
+		Returns:
+			A metadata dict or ``None`` if the file was indexed as an invalid music file.
+			Raises ``KeyError`` if the file isn't indexed or has changed since it was indexed.
+		"""
+
+		row = self._conn.execute(
+			"SELECT metadata FROM songs WHERE path = ? AND size = ? AND mtime = ?", (filepath, size, mtime)
+		).fetchone()
+
+		if row is None:
+			raise KeyError(filepath)
+
+		return json.loads(row[0])
+
+	def set(self, filepath, size, mtime, metadata):
+		"""Store metadata for a file, replacing any previous entry."""
+
+		self.set_encoded(filepath, size, mtime, encode_metadata(metadata))
+
+	def set_encoded(self, filepath, size, mtime, encoded):
+		"""Store metadata already encoded with :func:`encode_metadata` for a file, replacing any previous entry."""
+
+		self._conn.execute(
+			"INSERT OR REPLACE INTO songs (path, size, mtime, metadata) VALUES (?, ?, ?, ?)",
+			(filepath, size, mtime, encoded)
+		)
+
+	def metadata(self, filepath):
+		"""Get metadata for a file from the index, parsing and indexing it if new or modified.
+
+		Parameters:
+			filepath (str): Path of a music file.
+
+		Returns:
+			A dict of mutagen easy tag lists or ``None`` if the file can't be loaded as a music file.
+		"""
+
+		try:
+			stat = os.stat(filepath)
+		except OSError:
+			return None
+
+		try:
+			metadata = self.get(filepath, stat.st_size, stat.st_mtime_ns)
+		except KeyError:
+			self.misses += 1
+			metadata = read_metadata(filepath)
+			self.set(filepath, stat.st_size, stat.st_mtime_ns, metadata)
+		else:
+			self.hits += 1
+
+		return metadata
@@ -0,0 +1,252 @@
+# coding=utf-8
+
+"""Append-only journal of planned and completed transfers.
+
+	>>> from gmusicapi_scripts.journal import TransferJournal
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+	import fcntl
+except ImportError:  # Windows.
+	fcntl = None
+
+from .utils import get_cache_dir
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# Results that won't change by trying the transfer again.
+FINAL_RESULTS = ('uploaded', 'matched', 'not_uploaded', 'downloaded')
+
+
+def get_default_journal_path(name):
+	"""Get the default filepath of a transfer journal.
+
+	Parameters:
+		name (str): A name identifying the script, direction and account (e.g. ``'gmsync-up-oauth'``).
+	"""
+
+	return os.path.join(get_cache_dir(), 'journal-{}.jsonl'.format(name))
+
+
+def transfer_key(item):
+	"""Get the journal key of a transfer item: the song id of a Google Music song dict or a local filepath."""
+
+	return item['id'] if isinstance(item, dict) else item
+
+
+class TransferJournal:
+	"""Append-only record of a transfer job so an interrupted run can continue without re-planning it.
+
+	The journal is a JSON lines file of records::
+
+		{"type": "job", "kind": "upload", "params": {...}, "ts": ...}
+		{"type": "plan", "key": <song id or filepath>, "item": <song dict or filepath>, "ts": ...}
+		{"type": "done", "key": <song id or filepath>, "status": "uploaded", "bytes": 1234, "ts": ...}
+
+	Each record is written with a single ``O_APPEND`` write and synced to disk,
+	so a crash loses at most the record being written. A torn final line is ignored when reading.
+
+	Appending, starting, loading and compacting a job all hold an exclusive lock on a ``.lock`` file beside the journal,
+	so concurrent writers don't interleave records or append to a journal that is being replaced.
+
+	Parameters:
+		path (str): Filepath of the journal.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.lock_path = path + '.lock'
+
+		self._lock = threading.RLock()
+		self._lock_fd = None
+		self._lock_depth = 0
+
+	@contextmanager
+	def _locked(self):
+		# Reentrant within a process: a second flock on a new descriptor would wait for our own lock.
+		with self._lock:
+			if self._lock_depth == 0 and fcntl is not None:
+				os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+				fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+				try:
+					fcntl.flock(fd, fcntl.LOCK_EX)
+				except OSError:
+					os.close(fd)
+					raise
+
+				self._lock_fd = fd
+
+			self._lock_depth += 1
+
+			try:
+				yield
+			finally:
+				self._lock_depth -= 1
+
+				if self._lock_depth == 0 and self._lock_fd is not None:
+					# Closing the descriptor releases the lock.
+					os.close(self._lock_fd)
+					self._lock_fd = None
+
+	def _append(self, records):
+		data = "".join(json.dumps(record, sort_keys=True) + "\n" for record in records).encode('utf-8')
+
+		with self._locked():
+			fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+			try:
+				# Terminate a record torn by a crash so it doesn't swallow this one.
+				if os.fstat(fd).st_size:
+					with open(self.path, 'rb') as journal:
+						journal.seek(-1, os.SEEK_END)
+
+						if journal.read(1) != b"\n":
+							data = b"\n" + data
+
+				os.write(fd, data)
+				os.fsync(fd)
+			finally:
+				os.close(fd)
+
+	def _read(self):
+		records = []
+
+		try:
+			with open(self.path, encoding='utf-8') as journal:
+				for line in journal:
+					try:
+						records.append(json.loads(line))
+					except ValueError:
+						# Torn write from a crash.
+						continue
+		except FileNotFoundError:
+			pass
+
+		return records
+
+	def start(self, kind, items, params=None):
+		"""Start a new job, replacing any previous journal.
+
+		Parameters:
+			kind (str): ``'upload'``, ``'download'`` or ``'sync'`` (both).
+
+			items (list): Planned local filepaths or Google Music song dicts.
+
+			params (dict): JSON-serializable job parameters needed to resume (e.g. the download template).
+		"""
+
+		with self._locked():
+			if os.path.exists(self.path):
+				os.remove(self.path)
+
+			now = time.time()
+
+			self._append([{'type': 'job', 'kind': kind, 'params': params or {}, 'ts': now}])
+			self.plan(items)
+
+	def plan(self, items):
+		"""Add planned items to the current job."""
+
+		now = time.time()
+
+		self._append({'type': 'plan', 'key': transfer_key(item), 'item': item, 'ts': now} for item in items)
+
+	def iter_plan(self, items):
+		"""Lazily add planned items to the current job as they are consumed."""
+
+		for item in items:
+			self.plan([item])
+
+			yield item
+
+	def record(self, key, status, size=0):
+		"""Record the result of a transfer.
+
+		Parameters:
+			key (str): The song id or filepath of the transfer.
+
+			status (str): The transfer result (e.g. ``'uploaded'``, ``'downloaded'``, ``'error'``).
+
+			size (int): Bytes transferred.
+		"""
+
+		self._append([{'type': 'done', 'key': key, 'status': status, 'bytes': size, 'ts': time.time()}])
+
+	def load(self, kind=None):
+		"""Read the journal.
+
+		Parameters:
+			kind (str): Only load a job of this kind. Default: Any kind.
+
+		Returns:
+			``(kind, params, pending)`` where pending is the list of planned items without a final result,
+			or ``None`` if there is no journal or its job is of another kind.
+		"""
+
+		with self._locked():
+			records = self._read()
+
+		job = next((record for record in records if record.get('type') == 'job'), None)
+
+		if job is None:
+			return None
+
+		if kind is not None and job.get('kind') != kind:
+			logger.warning("Not resuming {0}: it holds a {1} job, not {2}".format(self.path, job.get('kind'), kind))
+
+			return None
+
+		planned = {}
+		finished = set()
+
+		for record in records:
+			if record.get('type') == 'plan':
+				planned.setdefault(record['key'], record['item'])
+			elif record.get('type') == 'done' and record.get('status') in FINAL_RESULTS:
+				finished.add(record['key'])
+
+		pending = [item for key, item in planned.items() if key not in finished]
+
+		return job['kind'], job['params'], pending
+
+	def finish(self):
+		"""Compact the journal after a run.
+
+		The journal is removed if every planned transfer has a final result,
+		otherwise it is atomically rewritten to contain only the job and the remaining transfers.
+		"""
+
+		with self._locked():
+			state = self.load()
+
+			if state is None:
+				return
+
+			kind, params, pending = state
+
+			if not pending:
+				os.remove(self.path)
+
+				return
+
+			temp_path = self.path + '.tmp'
+			now = time.time()
+			records = [{'type': 'job', 'kind': kind, 'params': params, 'ts': now}]
+			records.extend({'type': 'plan', 'key': transfer_key(item), 'item': item, 'ts': now} for item in pending)
+
+			with open(temp_path, 'w', encoding='utf-8') as journal:
+				for record in records:
+					journal.write(json.dumps(record, sort_keys=True) + "\n")
+
+				journal.flush()
+				os.fsync(journal.fileno())
+
+			os.replace(temp_path, self.path)
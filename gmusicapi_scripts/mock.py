@@ -0,0 +1,486 @@
+# coding=utf-8
+
+"""Local stand-in for Google Music serving a synthetic library.
+
+	>>> from gmusicapi_scripts.mock import MockBackend
+"""
+
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+
+from . import daemon
+from .index import read_metadata
+
+# Songs per page of a library listing. Listing latency is charged per page like gmusicapi's paged requests.
+PAGE_SIZE = 1000
+
+SYNTHETIC_ID = '{:08x}-0000-4000-8000-{:012x}'
+UPLOADED_ID = '{:08x}-0000-4000-8001-{:012x}'
+
+# Silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz, joint stereo).
+MPEG_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+
+
+# Files of each album directory of a synthetic tree: 8 songs, cover art and a text file.
+TREE_ALBUM_FILES = ['{:02d} - Track.mp3'.format(track) for track in range(1, 9)] + ['cover.jpg', 'album.nfo']
+
+
+class MockCallFailure(Exception):
+	"""An error injected by :class:`MockBackend`."""
+
+
+class MockThrottled(MockCallFailure):
+	"""A call rejected by :class:`MockBackend` for exceeding its quota, like an HTTP 429 response."""
+
+	status_code = 429
+
+	def __init__(self, message, retry_after=None):
+		super().__init__(message)
+
+		self.retry_after = retry_after
+
+
+def synthetic_metadata(number):
+	"""Get the tags of song number of a synthetic library.
+
+	Every artist has 10 albums of 10 tracks.
+	"""
+
+	return {
+		'artist': 'Artist {:05d}'.format(number // 100),
+		'album': 'Album {:06d}'.format(number // 10),
+		'title': 'Title {:07d}'.format(number),
+		'tracknumber': str(number % 10 + 1)
+	}
+
+
+def _syncsafe(number):
+	return bytes([(number >> 21) & 0x7f, (number >> 14) & 0x7f, (number >> 7) & 0x7f, number & 0x7f])
+
+
+def synthetic_mp3(metadata, size=0):
+	"""Build MP3 file contents with ID3 tags.
+
+	Parameters:
+		metadata (dict): ``artist``, ``album``, ``title`` and ``tracknumber`` tags.
+
+		size (int): Minimum size of the file in bytes. Padded with silent frames.
+	"""
+
+	frames = b''
+
+	for frame_id, field in (('TPE1', 'artist'), ('TALB', 'album'), ('TIT2', 'title'), ('TRCK', 'tracknumber')):
+		data = b'\x03' + metadata[field].encode('utf-8')
+		frames += frame_id.encode('ascii') + _syncsafe(len(data)) + b'\x00\x00' + data
+
+	tag = b'ID3\x04\x00\x00' + _syncsafe(len(frames)) + frames
+	count = max(2, math.ceil((size - len(tag)) / len(MPEG_FRAME)))
+
+	return tag + MPEG_FRAME * count
+
+
+def write_synthetic_songs(directory, numbers, size=0):
+	"""Write synthetic library songs as MP3 files.
+
+	Parameters:
+		directory (str): Directory to write ``<artist>/<album>/<track> - <title>.mp3`` files to.
+
+		numbers (iterable): Synthetic library song numbers.
+
+		size (int): Minimum size of each file in bytes.
+
+	Returns:
+		A list of the written filepaths.
+	"""
+
+	filepaths = []
+
+	for number in numbers:
+		metadata = synthetic_metadata(number)
+		dirname = os.path.join(directory, metadata['artist'], metadata['album'])
+		filepath = os.path.join(dirname, '{0:0>2} - {1}.mp3'.format(metadata['tracknumber'], metadata['title']))
+
+		os.makedirs(dirname, exist_ok=True)
+
+		with open(filepath, 'wb') as f:
+			f.write(synthetic_mp3(metadata, size))
+
+		filepaths.append(filepath)
+
+	return filepaths
+
+
+def write_synthetic_tree(directory, count):
+	"""Write a directory tree of empty files shaped like a music collection for benchmarking directory walks.
+
+	Artists have 10 albums of :data:`TREE_ALBUM_FILES`. Every fifth artist is under ``Podcasts``
+	and every tenth artist has a ``.stversions`` directory holding copies of 5 of its albums.
+
+	Parameters:
+		directory (str): Directory to write the tree to.
+
+		count (int): Approximate number of files to write.
+
+	Returns:
+		The number of files written.
+	"""
+
+	written = 0
+	artist = 0
+
+	while written < count:
+		root = os.path.join(directory, 'Podcasts') if artist % 5 == 4 else directory
+		artist_dir = os.path.join(root, 'Artist {:05d}'.format(artist))
+		albums = [os.path.join(artist_dir, 'Album {:02d}'.format(album)) for album in range(10)]
+
+		if artist % 10 == 8:
+			albums += [os.path.join(artist_dir, '.stversions', 'Album {:02d}'.format(album)) for album in range(5)]
+
+		for album_dir in albums:
+			os.makedirs(album_dir)
+
+			for name in TREE_ALBUM_FILES:
+				os.close(os.open(os.path.join(album_dir, name), os.O_CREAT | os.O_WRONLY))
+
+			written += len(TREE_ALBUM_FILES)
+
+		artist += 1
+
+	return written
+
+
+class MockBackend:
+	"""In-memory Google Music library shared by mock clients.
+
+	The library starts with ``size`` synthetic songs that are generated on demand rather than stored,
+	so libraries of hundreds of thousands of songs are cheap to create.
+	Uploaded and deleted songs are tracked on top of them.
+
+	Parameters:
+		size (int): Number of synthetic songs in the library. Default: ``1000``
+
+		latency (float): Seconds added to every call (every page of a listing). Default: ``0``
+
+		error_rate (float): Probability of a call raising :class:`MockCallFailure`. Default: ``0``
+
+		song_size (int): Size in bytes of downloaded songs. Default: ``65536``
+
+		seed (int): Seed of the error injection and of generated song ids. Default: ``0``
+
+		quota (float): Calls of each kind allowed per second (with bursts of up to a second's worth)
+			before calls raise :class:`MockThrottled`. Default: No limit.
+
+		concurrency_quota (int): Calls allowed in flight at once before calls raise :class:`MockThrottled`.
+			Default: No limit.
+	"""
+
+	def __init__(self, size=1000, latency=0, error_rate=0, song_size=65536, seed=0, quota=None, concurrency_quota=None):
+		self.size = size
+		self.latency = latency
+		self.error_rate = error_rate
+		self.song_size = song_size
+		self.seed = seed
+		self.quota = quota
+		self.concurrency_quota = concurrency_quota
+
+		self.created = time.time()
+		self.calls = Counter()
+		self.throttled = Counter()
+
+		self._in_flight = 0
+		self._quota_tokens = {}
+
+		self._random = random.Random(seed)
+		self._uploaded = {}
+		self._uploads = 0
+		self._deleted = {}
+		self._lock = threading.Lock()
+
+	def _over_quota(self, name):
+		if self.concurrency_quota is not None and self._in_flight >= self.concurrency_quota:
+			return True
+
+		if self.quota is None:
+			return False
+
+		now = time.monotonic()
+		tokens, updated = self._quota_tokens.get(name, (max(1.0, self.quota), now))
+		tokens = min(max(1.0, self.quota), tokens + (now - updated) * self.quota)
+
+		if tokens < 1:
+			self._quota_tokens[name] = (tokens, now)
+
+			return True
+
+		self._quota_tokens[name] = (tokens - 1, now)
+
+		return False
+
+	def call(self, name, pages=1):
+		"""Count a call, apply latency and maybe inject an error or throttle it."""
+
+		with self._lock:
+			self.calls[name] += 1
+
+			if self._over_quota(name):
+				self.throttled[name] += 1
+
+				raise MockThrottled("Too many requests to {}".format(name), retry_after=1 / self.quota if self.quota else None)
+
+			fail = self.error_rate and self._random.random() < self.error_rate
+			self._in_flight += 1
+
+		try:
+			if self.latency:
+				time.sleep(self.latency * pages)
+		finally:
+			with self._lock:
+				self._in_flight -= 1
+
+		if fail:
+			raise MockCallFailure("Injected failure in {}".format(name))
+
+	def _number(self, song_id):
+		try:
+			prefix, _, _, kind, number = song_id.split('-')
+			prefix, number = int(prefix, 16), int(number, 16)
+		except ValueError:
+			raise KeyError(song_id)
+
+		if kind != '8000' or prefix != self.seed or number >= self.size:
+			raise KeyError(song_id)
+
+		return number
+
+	def metadata(self, song_id):
+		"""Get the tags and modification time of a song in the library.
+
+		Raises:
+			KeyError: The song isn't in the library.
+		"""
+
+		if song_id in self._deleted:
+			raise KeyError(song_id)
+
+		if song_id in self._uploaded:
+			return self._uploaded[song_id]
+
+		return synthetic_metadata(self._number(song_id)), self.created
+
+	def iter_songs(self, since=None, include_deleted=False):
+		"""Yield ``(song_id, metadata, modified, deleted)`` for the library.
+
+		Parameters:
+			since (float): Only yield songs modified after this Unix timestamp.
+
+			include_deleted (bool): Also yield deleted songs.
+		"""
+
+		if since is None or self.created > since:
+			for number in range(self.size):
+				song_id = SYNTHETIC_ID.format(self.seed, number)
+
+				if song_id not in self._deleted:
+					yield song_id, synthetic_metadata(number), self.created, False
+
+		for song_id, (metadata, modified) in list(self._uploaded.items()):
+			if since is None or modified > since:
+				yield song_id, metadata, modified, False
+
+		if include_deleted:
+			for song_id, (metadata, modified) in list(self._deleted.items()):
+				if since is None or modified > since:
+					yield song_id, metadata, modified, True
+
+	def add(self, metadata):
+		"""Add an uploaded song to the library and return its id."""
+
+		with self._lock:
+			song_id = UPLOADED_ID.format(self.seed, self._uploads)
+			self._uploads += 1
+			self._uploaded[song_id] = (metadata, time.time())
+
+		return song_id
+
+	def remove(self, song_id):
+		"""Delete a song from the library. Returns ``False`` if it isn't in the library."""
+
+		try:
+			metadata, _ = self.metadata(song_id)
+		except KeyError:
+			return False
+
+		with self._lock:
+			self._uploaded.pop(song_id, None)
+			self._deleted[song_id] = (metadata, time.time())
+
+		return True
+
+	@contextmanager
+	def installed(self):
+		"""Make scripts logging in directly get mock wrappers backed by this library instead of gmusicapi-wrapper's.
+
+			>>> from gmusicapi_scripts import gmupload
+			>>> with MockBackend(size=5000).installed():
+			...     gmupload.main()
+		"""
+
+		factories = {
+			'mobileclient': partial(MockMobileClientWrapper, self),
+			'musicmanager': partial(MockMusicManagerWrapper, self)
+		}
+		original = daemon.load_wrapper
+		daemon.load_wrapper = factories.__getitem__
+
+		try:
+			yield self
+		finally:
+			daemon.load_wrapper = original
+
+
+def _listing(backend, name, songs, incremental):
+	"""Return a listing as a list or, like gmusicapi's incremental listings, lazily as pages of song dicts.
+
+	Each page of an incremental listing is counted as a call.
+	"""
+
+	if not incremental:
+		songs = list(songs)
+		backend.call(name, pages=max(1, math.ceil(len(songs) / PAGE_SIZE)))
+
+		return songs
+
+	def pages():
+		page = []
+		yielded = False
+
+		for song in songs:
+			page.append(song)
+
+			if len(page) == PAGE_SIZE:
+				backend.call(name)
+				yield page
+
+				page = []
+				yielded = True
+
+		if page or not yielded:
+			backend.call(name)
+			yield page
+
+	return pages()
+
+
+class MockMusicmanager:
+	"""Stand-in for gmusicapi's ``Musicmanager`` client."""
+
+	def __init__(self, backend):
+		self.backend = backend
+
+	def get_uploaded_songs(self, incremental=False):
+		songs = (
+			{
+				'id': song_id, 'title': metadata['title'], 'artist': metadata['artist'], 'album': metadata['album'],
+				'album_artist': metadata['artist'], 'track_number': int(metadata['tracknumber']),
+				'disc_number': 1, 'total_disc_count': 1, 'track_size': self.backend.song_size
+			}
+			for song_id, metadata, _, _ in self.backend.iter_songs()
+		)
+
+		return _listing(self.backend, 'get_uploaded_songs', songs, incremental)
+
+	def get_purchased_songs(self, incremental=False):
+		return _listing(self.backend, 'get_purchased_songs', [], incremental)
+
+	def download_song(self, song_id):
+		self.backend.call('download_song')
+		metadata, _ = self.backend.metadata(song_id)
+
+		return '{0} - {1}.mp3'.format(metadata['artist'], metadata['title']), synthetic_mp3(metadata, self.backend.song_size)
+
+	def upload(self, filepaths, enable_matching=False, transcode_quality='320k'):
+		if isinstance(filepaths, str):
+			filepaths = [filepaths]
+
+		self.backend.call('upload')
+
+		uploaded, not_uploaded = {}, {}
+
+		for filepath in filepaths:
+			metadata = read_metadata(filepath)
+
+			if metadata is None:
+				not_uploaded[filepath] = "Could not read tags"
+				continue
+
+			tags = {field: (metadata.get(field) or [''])[0] for field in ('artist', 'album', 'title', 'tracknumber')}
+			uploaded[filepath] = self.backend.add(tags)
+
+		return uploaded, {}, not_uploaded
+
+
+class MockMobileclient:
+	"""Stand-in for gmusicapi's ``Mobileclient`` client."""
+
+	def __init__(self, backend):
+		self.backend = backend
+
+	def get_all_songs(self, incremental=False, include_deleted=None, updated_after=None):
+		since = updated_after.timestamp() if updated_after is not None else None
+
+		def songs():
+			for song_id, metadata, modified, deleted in self.backend.iter_songs(since=since, include_deleted=include_deleted):
+				timestamp = str(int(modified * 1000000))
+
+				yield {
+					'id': song_id, 'kind': 'sj#track', 'title': metadata['title'], 'artist': metadata['artist'],
+					'album': metadata['album'], 'albumArtist': metadata['artist'], 'trackNumber': int(metadata['tracknumber'] or 0),
+					'discNumber': 1, 'estimatedSize': str(self.backend.song_size),
+					'creationTimestamp': timestamp, 'lastModifiedTimestamp': timestamp, 'deleted': deleted
+				}
+
+		return _listing(self.backend, 'get_all_songs', songs(), incremental)
+
+	def delete_songs(self, library_song_ids):
+		if isinstance(library_song_ids, str):
+			library_song_ids = [library_song_ids]
+
+		self.backend.call('delete_songs')
+
+		return [song_id for song_id in library_song_ids if self.backend.remove(song_id)]
+
+
+class _MockWrapper:
+	client = None
+
+	def __init__(self, backend, enable_logging=False):
+		self.api = self.client(backend)
+		self.is_authenticated = False
+
+	def login(self, *args, **kwargs):
+		self.is_authenticated = True
+
+		return True
+
+	def logout(self, *args, **kwargs):
+		self.is_authenticated = False
+
+		return True
+
+
+class MockMusicManagerWrapper(_MockWrapper):
+	"""Stand-in for ``gmusicapi_wrapper.MusicManagerWrapper`` that logs in to a :class:`MockBackend`."""
+
+	client = MockMusicmanager
+
+
+class MockMobileClientWrapper(_MockWrapper):
+	"""Stand-in for ``gmusicapi_wrapper.MobileClientWrapper`` that logs in to a :class:`MockBackend`."""
+
+	client = MockMobileclient
@@ -0,0 +1,251 @@
+# coding=utf-8
+
+"""Machine-readable output of song lists.
+
+	>>> from gmusicapi_scripts.output import RecordWriter
+"""
+
+import csv
+import heapq
+import json
+import pickle
+import sys
+import tempfile
+
+from .search import FIELDS
+
+OUTPUT_FORMATS = ('ndjson', 'csv', 'tsv')
+
+GOOGLE_FIELDS = ['action', 'id', 'title', 'artist', 'album', 'track']
+LOCAL_FIELDS = ['action', 'filepath', 'reason']
+SYNC_FIELDS = ['action', 'id', 'filepath', 'title', 'artist', 'album', 'track', 'reason']
+
+# Rows written per write call.
+BATCH_SIZE = 1000
+
+# Rows sorted in memory before they are spilled to a temporary file.
+SORT_BUFFER = 100000
+
+
+def parse_fields(text):
+	"""Split a comma-separated list of field names."""
+
+	return [field.strip() for field in text.split(',') if field.strip()] if text else []
+
+
+def song_keys(fields):
+	"""Get the set of song dict keys output or sort fields are read from."""
+
+	keys = set()
+
+	for field in fields:
+		field = field.lstrip('-')
+		keys.update(FIELDS.get(field, (field,)))
+
+	return keys
+
+
+def get_field(item, field, action=None, reason=None):
+	"""Get a field of a song for output.
+
+	Parameters:
+		item (dict or str): A Google Music song dict or a local filepath.
+
+		field (str): ``action``, ``reason``, ``filepath``, a search field name (e.g. ``track``) or a song dict key.
+	"""
+
+	if field == 'action':
+		return action
+
+	if field == 'reason':
+		return reason
+
+	if not isinstance(item, dict):
+		return item if field == 'filepath' else None
+
+	for key in FIELDS.get(field, (field,)):
+		if item.get(key) not in (None, ''):
+			return item[key]
+
+	return None
+
+
+def _sort_value(value):
+	if value is None or value == '':
+		return (2, '')
+
+	if isinstance(value, (int, float)) and not isinstance(value, bool):
+		return (0, value, '')
+
+	return (1, str(value).lower())
+
+
+def _spill(rows):
+	f = tempfile.TemporaryFile()
+
+	for row in sorted(rows):
+		pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+
+	f.seek(0)
+
+	return f
+
+
+def _load(f):
+	while True:
+		try:
+			yield pickle.load(f)
+		except EOFError:
+			return
+
+
+class RecordWriter:
+	"""Write songs as NDJSON, CSV or TSV records as they are produced.
+
+	Records are written in batches. If sort fields are given, records are held until :meth:`close`
+	and sorted in runs of at most ``buffer_size`` records, merged from temporary files so memory stays bounded.
+
+	Parameters:
+		output_format (str): ``'ndjson'``, ``'csv'`` or ``'tsv'``.
+
+		fields (list): Fields of each record. See :func:`get_field`.
+
+		sort (list): Fields to sort records by, prefixed with ``-`` for descending order. Default: Produced order.
+
+		stream: Text stream to write to. Default: Standard output.
+
+		buffer_size (int): Records sorted in memory at once. Default: ``SORT_BUFFER``
+	"""
+
+	def __init__(self, output_format, fields, sort=None, stream=None, buffer_size=SORT_BUFFER):
+		if output_format not in OUTPUT_FORMATS:
+			raise ValueError("Output format must be one of: {}.".format(", ".join(OUTPUT_FORMATS)))
+
+		self.output_format = output_format
+		self.fields = list(fields)
+		self.sort = [field.lstrip('-') for field in sort or []]
+		self.descending = [field.startswith('-') for field in sort or []]
+		self.stream = stream or sys.stdout
+		self.buffer_size = max(1, buffer_size)
+		self.count = 0
+
+		self._rows = []
+		self._runs = []
+
+		if output_format == 'ndjson':
+			self._writer = None
+		else:
+			delimiter = '\t' if output_format == 'tsv' else ','
+			self._writer = csv.writer(self.stream, delimiter=delimiter, lineterminator='\n')
+			self._writer.writerow(self.fields)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def _sort_key(self, item, action, reason):
+		key = []
+
+		for field, descending in zip(self.sort, self.descending):
+			value = _sort_value(get_field(item, field, action, reason))
+
+			# Negate the order of descending fields so a single ascending merge works.
+			key.append(_Descending(value) if descending else value)
+
+		return tuple(key)
+
+	def write(self, item, action=None, reason=None):
+		"""Add a song record.
+
+		Parameters:
+			item (dict or str): A Google Music song dict or a local filepath.
+
+			action (str): What the script does or would do with the song (e.g. ``'upload'``, ``'filter'``).
+
+			reason (str): Why, if known.
+		"""
+
+		row = [get_field(item, field, action, reason) for field in self.fields]
+
+		if self.sort:
+			# The record number keeps the sort stable and rows out of comparisons.
+			self._rows.append((self._sort_key(item, action, reason), self.count, row))
+
+			if len(self._rows) >= self.buffer_size:
+				self._runs.append(_spill(self._rows))
+				self._rows = []
+		else:
+			self._rows.append(row)
+
+			if len(self._rows) >= BATCH_SIZE:
+				self._flush(self._rows)
+				self._rows = []
+
+		self.count += 1
+
+	def write_many(self, items, action=None):
+		"""Add records of songs with the same action. ``(item, reason)`` tuples may be given for reasons."""
+
+		for item in items:
+			if isinstance(item, tuple):
+				self.write(item[0], action, item[1])
+			else:
+				self.write(item, action)
+
+	def _flush(self, rows):
+		if self._writer is not None:
+			self._writer.writerows(['' if value is None else value for value in row] for row in rows)
+		else:
+			self.stream.write(
+				"".join(json.dumps(dict(zip(self.fields, row))) + "\n" for row in rows)
+			)
+
+	def close(self):
+		"""Write held records and flush the stream."""
+
+		if self.sort:
+			runs = [_load(run) for run in self._runs]
+			runs.append(iter(sorted(self._rows)))
+			batch = []
+
+			for _, _, row in heapq.merge(*runs):
+				batch.append(row)
+
+				if len(batch) >= BATCH_SIZE:
+					self._flush(batch)
+					batch = []
+
+			self._flush(batch)
+
+			for run in self._runs:
+				run.close()
+
+			self._runs = []
+		else:
+			self._flush(self._rows)
+
+		self._rows = []
+		self.stream.flush()
+
+
+class _Descending:
+	"""Sort key wrapper reversing the order of a value."""
+
+	__slots__ = ('value',)
+
+	def __init__(self, value):
+		self.value = value
+
+	def __lt__(self, other):
+		return other.value < self.value
+
+	def __eq__(self, other):
+		return self.value == other.value
+
+	def __getstate__(self):
+		return self.value
+
+	def __setstate__(self, value):
+		self.value = value
@@ -0,0 +1,391 @@
+# coding=utf-8
+
+"""Local library scanning.
+
+	>>> from gmusicapi_scripts.scan import get_local_songs, iter_local_songs
+"""
+
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from .index import encode_metadata, read_metadata
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+
+# Regex constructs whose match depends on what follows it or on the end of the string,
+# and backreferences, whose group numbers change when patterns are compiled apart from the others.
+# Patterns using them may match a directory's path without matching the paths of files below it.
+UNPRUNABLE_RE = re.compile(r'\$|\\[ZzbB1-9]|\(\?[=!>]|\(\?P=|[*+?}]\+')
+
+
+class ExcludeMatcher:
+	"""Exclude patterns compiled into one regex matched against filepaths.
+
+	A pattern that matches a directory's path (with a trailing separator) also matches every filepath below it,
+	unless it looks past the end of what it matches (``$``, ``\\b``, lookaheads, ...) or uses backreferences.
+	Patterns without those are also compiled into a regex of their own, so walks can skip excluded directories.
+
+	Parameters:
+		patterns (list): Python regex patterns. Filepaths are excluded if they match any of them.
+	"""
+
+	def __init__(self, patterns=None):
+		self.patterns = list(patterns or [])
+		self._regex = re.compile("|".join(self.patterns)) if self.patterns else None
+
+		prunable = [pattern for pattern in self.patterns if not UNPRUNABLE_RE.search(pattern)]
+
+		# Compiled with the flags of the full regex so inline flags of other patterns (e.g. (?i)) apply alike.
+		self._directory_regex = re.compile("|".join(prunable), self._regex.flags) if prunable else None
+
+	def __bool__(self):
+		return self._regex is not None
+
+	def match(self, filepath):
+		"""Return ``True`` if a filepath is excluded."""
+
+		return self._regex is not None and self._regex.search(filepath) is not None
+
+	def match_directory(self, dirpath):
+		"""Return ``True`` if every filepath below a directory is excluded."""
+
+		return self._directory_regex is not None and self._directory_regex.search(os.path.join(dirpath, '')) is not None
+
+
+class ScanStats:
+	"""Counts of a local scan's directory walk.
+
+	Attributes:
+		directories (int): Directories listed.
+
+		pruned (int): Directories not walked because they are excluded.
+
+		depth_pruned (int): Directories not walked because they are deeper than the maximum depth.
+
+		files (int): Files found.
+
+		skipped (int): Files skipped because they don't have a supported extension.
+
+		excluded (int): Files with a supported extension excluded by pattern.
+	"""
+
+	def __init__(self):
+		self.directories = 0
+		self.pruned = 0
+		self.depth_pruned = 0
+		self.files = 0
+		self.skipped = 0
+		self.excluded = 0
+
+	def as_dict(self):
+		return {
+			'directories': self.directories, 'pruned': self.pruned, 'depth_pruned': self.depth_pruned,
+			'files': self.files, 'skipped': self.skipped, 'excluded': self.excluded
+		}
+
+
+def exclude_filepaths(filepaths, exclude_patterns=None):
+	"""Exclude file paths based on regex patterns.
+
+	Parameters:
+		filepaths (list): Filepaths to check.
+
+		exclude_patterns (list): Python regex patterns to check filepaths against.
+
+	Returns:
+		A list of filepaths to include and a list of filepaths to exclude.
+	"""
+
+	exclude = ExcludeMatcher(exclude_patterns)
+
+	if not exclude:
+		return list(filepaths), []
+
+	included_songs = []
+	excluded_songs = []
+
+	for filepath in filepaths:
+		if exclude.match(filepath):
+			excluded_songs.append(filepath)
+		else:
+			included_songs.append(filepath)
+
+	return included_songs, excluded_songs
+
+
+def _list_directory(directory):
+	"""Get the ``(path, is_directory)`` of each entry of a directory, or nothing if it can't be listed.
+
+	Symlinked directories aren't reported as directories so they aren't walked, like ``os.walk``.
+	"""
+
+	try:
+		if hasattr(os, 'scandir'):
+			# File types come with the listing on most platforms, saving a stat call per entry.
+			return [(entry.path, entry.is_dir() and not entry.is_symlink()) for entry in os.scandir(directory)]
+
+		return [
+			(path, os.path.isdir(path) and not os.path.islink(path))
+			for path in (os.path.join(directory, name) for name in os.listdir(directory))
+		]
+	except OSError:
+		return []
+
+
+def _walk(directory, depth, supported_extensions, exclude, max_depth, stats):
+	stats.directories += 1
+	subdirectories = []
+
+	for path, is_directory in _list_directory(directory):
+		if is_directory:
+			if depth >= max_depth:
+				stats.depth_pruned += 1
+			elif exclude.match_directory(path):
+				logger.debug("Excluded directory {}".format(path))
+				stats.pruned += 1
+			else:
+				subdirectories.append(path)
+
+			continue
+
+		stats.files += 1
+
+		if not path.lower().endswith(supported_extensions):
+			stats.skipped += 1
+		elif exclude.match(path):
+			stats.excluded += 1
+
+			yield path, True
+		else:
+			yield path, False
+
+	# Files of a directory come before those of its subdirectories, as with os.walk.
+	for subdirectory in subdirectories:
+		yield from _walk(subdirectory, depth + 1, supported_extensions, exclude, max_depth, stats)
+
+
+def walk_filepaths(filepaths, supported_extensions, exclude=None, max_depth=float('inf'), stats=None):
+	"""Lazily yield filepaths with supported extensions from given filepaths, skipping excluded directory trees.
+
+	Directories are only listed if they are within max_depth and not excluded as a whole,
+	and each filepath is checked against all exclude patterns with a single regex search.
+
+	Parameters:
+		filepaths (list): Filepaths to search for music files.
+
+		supported_extensions (tuple): Lowercase file extensions to yield.
+
+		exclude (ExcludeMatcher): Exclude patterns. Default: No exclusions.
+
+		max_depth (int): The depth in the directory tree to walk.
+			A depth of '0' limits the walk to the top directory.
+			Default: No limit.
+
+		stats (ScanStats): Counts to add the walk's to. Default: Don't count.
+
+	Yields:
+		``(filepath, excluded)`` tuples. Files in excluded directories aren't yielded.
+	"""
+
+	exclude = exclude if exclude is not None else ExcludeMatcher()
+	stats = stats if stats is not None else ScanStats()
+
+	for path in filepaths:
+		if os.name == 'nt':
+			from gmusicapi_wrapper.constants import CYGPATH_RE
+			from gmusicapi_wrapper.utils import convert_cygwin_path
+
+			if CYGPATH_RE.match(path):
+				path = convert_cygwin_path(path)
+
+		if os.path.isdir(path):
+			if exclude.match_directory(path):
+				logger.debug("Excluded directory {}".format(path))
+				stats.pruned += 1
+				continue
+
+			yield from _walk(path, 0, supported_extensions, exclude, max_depth, stats)
+		elif os.path.isfile(path):
+			stats.files += 1
+
+			if not path.lower().endswith(supported_extensions):
+				stats.skipped += 1
+			elif exclude.match(path):
+				stats.excluded += 1
+
+				yield path, True
+			else:
+				yield path, False
+
+
+def log_scan_stats(stats):
+	"""Log the directory walk counts of a scan."""
+
+	logger.debug(
+		"Walked {directories} directories: skipped {pruned} excluded and {depth_pruned} too deep, "
+		"found {files} files, {skipped} without a supported extension".format(**stats.as_dict())
+	)
+
+
+def _match_metadata(metadata, filters=None):
+	"""Check song metadata against a :class:`FilterSet`. Unreadable songs (``None``) never match."""
+
+	if metadata is None:
+		return False
+
+	return not filters or filters.match(metadata)
+
+
+def _scan_file(filepath, filters, keep_metadata):
+	"""Read and filter a single file. Runs in scan worker processes.
+
+	Returns:
+		``(matched, encoded)`` where encoded is the metadata as stored by the index,
+		only returned if keep_metadata is ``True``. All tags are kept, as filters can match any of them.
+	"""
+
+	metadata = read_metadata(filepath)
+	matched = _match_metadata(metadata, filters)
+
+	return matched, encode_metadata(metadata) if keep_metadata else None
+
+
+def get_local_songs(
+		filepaths, filters=None, exclude_patterns=None, max_depth=float('inf'), index=None, scan_jobs=1, scan_stats=None):
+	"""Load songs from local filepaths.
+
+	Drop-in replacement for ``MusicManagerWrapper.get_local_songs`` that can answer metadata from a :class:`ScanIndex`.
+
+	Parameters:
+		filepaths (list): Filepaths to search for music files.
+
+		filters (FilterSet): Metadata filters. Fields are any valid mutagen metadata fields. Default: No filters.
+
+		exclude_patterns (list): Python regex patterns. Filepaths are excluded if they match any of the exclude patterns.
+
+		max_depth (int): The depth in the directory tree to walk.
+			A depth of '0' limits the walk to the top directory.
+			Default: No limit.
+
+		index (ScanIndex): Metadata index used to skip re-reading unchanged files. Default: Read every file.
+
+		scan_jobs (int): Number of processes used to read and filter files not answered by the index.
+			Results are the same and in the same order regardless of the number of processes. Default: ``1``
+
+		scan_stats (ScanStats): Counts to add the directory walk's to. Default: Don't count.
+
+	Returns:
+		A list of local song filepaths matching criteria,
+		a list of local song filepaths filtered out using filter criteria,
+		and a list of local song filepaths excluded using exclusion criteria.
+		Songs in excluded directories aren't walked, so they aren't in the list of excluded songs.
+	"""
+
+	# gmusicapi_wrapper imports gmusicapi, which is slow. Only scans pay for it.
+	from gmusicapi_wrapper import SUPPORTED_SONG_FORMATS
+
+	logger.info("Loading local songs...")
+
+	scan_stats = scan_stats if scan_stats is not None else ScanStats()
+	included_songs = []
+	excluded_songs = []
+
+	for filepath, excluded in walk_filepaths(
+			filepaths, SUPPORTED_SONG_FORMATS, exclude=ExcludeMatcher(exclude_patterns), max_depth=max_depth,
+			stats=scan_stats):
+		(excluded_songs if excluded else included_songs).append(filepath)
+
+	log_scan_stats(scan_stats)
+
+	matches = [False] * len(included_songs)
+	pending = []
+	hits = 0
+
+	for position, filepath in enumerate(included_songs):
+		if index is None:
+			pending.append((position, filepath, None))
+			continue
+
+		try:
+			stat = os.stat(filepath)
+		except OSError:
+			continue
+
+		try:
+			metadata = index.get(filepath, stat.st_size, stat.st_mtime_ns)
+		except KeyError:
+			pending.append((position, filepath, stat))
+		else:
+			hits += 1
+			matches[position] = _match_metadata(metadata, filters)
+
+	pending_filepaths = [filepath for _, filepath, _ in pending]
+	keep_metadata = index is not None
+
+	if scan_jobs > 1 and len(pending) > 1:
+		chunksize = min(256, max(1, len(pending) // (scan_jobs * 4)))
+
+		with ProcessPoolExecutor(max_workers=scan_jobs) as executor:
+			scanned = list(executor.map(_scan_file, pending_filepaths, repeat(filters), repeat(keep_metadata), chunksize=chunksize))
+	else:
+		scanned = [_scan_file(filepath, filters, keep_metadata) for filepath in pending_filepaths]
+
+	for (position, filepath, stat), (matched, encoded) in zip(pending, scanned):
+		matches[position] = matched
+
+		if index is not None:
+			index.set_encoded(filepath, stat.st_size, stat.st_mtime_ns, encoded)
+
+	matched_songs = [filepath for filepath, matched in zip(included_songs, matches) if matched]
+	filtered_songs = [filepath for filepath, matched in zip(included_songs, matches) if not matched]
+
+	if index is not None:
+		logger.debug("Read {0} local songs from index, parsed {1}".format(hits, len(pending)))
+
+	logger.info("Excluded {0} local songs".format(len(excluded_songs)))
+	logger.info("Filtered {0} local songs".format(len(filtered_songs)))
+	logger.info("Loaded {0} local songs".format(len(matched_songs)))
+
+	return matched_songs, filtered_songs, excluded_songs
+
+
+def iter_local_songs(
+		filepaths, filters=None, exclude_patterns=None, max_depth=float('inf'), index=None, scan_stats=None):
+	"""Lazily load songs from local filepaths as they are discovered.
+
+	Streaming version of :func:`get_local_songs` with the same criteria. Files are read one at a time.
+
+	Yields:
+		``(status, filepath)`` tuples where status is ``'matched'``, ``'filtered'`` or ``'excluded'``.
+	"""
+
+	from gmusicapi_wrapper import SUPPORTED_SONG_FORMATS
+
+	logger.info("Loading local songs...")
+
+	scan_stats = scan_stats if scan_stats is not None else ScanStats()
+	get_metadata = index.metadata if index is not None else read_metadata
+	counts = dict.fromkeys(['matched', 'filtered', 'excluded'], 0)
+
+	for filepath, excluded in walk_filepaths(
+			filepaths, SUPPORTED_SONG_FORMATS, exclude=ExcludeMatcher(exclude_patterns), max_depth=max_depth,
+			stats=scan_stats):
+		if excluded:
+			status = 'excluded'
+		elif _match_metadata(get_metadata(filepath), filters):
+			status = 'matched'
+		else:
+			status = 'filtered'
+
+		counts[status] += 1
+
+		yield status, filepath
+
+	log_scan_stats(scan_stats)
+	logger.info("Excluded {0} local songs".format(counts['excluded']))
+	logger.info("Filtered {0} local songs".format(counts['filtered']))
+	logger.info("Loaded {0} local songs".format(counts['matched']))
@@ -0,0 +1,419 @@
+# coding=utf-8
+
+"""Adaptive rate limiting and backoff of Google Music calls.
+
+	>>> from gmusicapi_scripts.scheduler import Scheduler
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from .utils import get_cache_dir, retry
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# HTTP statuses meaning Google Music is throttling or overloaded.
+THROTTLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Error messages meaning the same when no status is attached (e.g. gmusicapi's CallFailure).
+THROTTLE_RE = re.compile(
+	r'\b(?:429|50[0234])\b|too many requests|rate limit|quota|throttl|service unavailable|backend error', re.I
+)
+
+# Multiplier applied to the concurrency limit and call rate of an endpoint when it is throttled.
+DECREASE = 0.5
+
+# Added to the concurrency limit over a window of successful calls
+# and to the call rate per second of successful calls at that rate.
+# A single success raises the call rate by at most RATE_STEP of itself, so slow endpoints recover gradually.
+INCREASE = 1.0
+RATE_INCREASE = 2.0
+RATE_STEP = 0.1
+
+# Lowest call rate per second an endpoint is slowed to.
+MIN_RATE = 0.1
+
+# Seconds of recent calls used to measure the call rate when an endpoint is first throttled,
+# and the shortest span a burst of calls is measured over.
+RATE_WINDOW = 10
+MIN_SPAN = 0.1
+
+# Seconds learned limits are kept between runs.
+LIMITS_TTL = 86400
+
+
+def get_default_limits_path(name):
+	"""Get the default filepath of learned rate limits.
+
+	Parameters:
+		name (str): A name identifying the client type and account (e.g. ``'musicmanager-oauth'``).
+	"""
+
+	return os.path.join(get_cache_dir(), 'rate-limits-{}.json'.format(name))
+
+
+def _status(e):
+	for source in (e, getattr(e, 'response', None)):
+		status = getattr(source, 'status_code', None) or getattr(source, 'status', None)
+
+		if isinstance(status, int):
+			return status
+
+	return None
+
+
+def is_throttled(e):
+	"""Return ``True`` if an exception means the call was throttled or hit a server error."""
+
+	status = _status(e)
+
+	if status is not None:
+		return status in THROTTLE_STATUSES
+
+	return bool(THROTTLE_RE.search(str(e)))
+
+
+def retry_after(e):
+	"""Get the seconds a throttled call asks to wait before retrying or ``None``."""
+
+	value = getattr(e, 'retry_after', None)
+
+	if value is None:
+		headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+		value = headers.get('Retry-After')
+
+	try:
+		return max(0.0, float(value)) if value is not None else None
+	except (TypeError, ValueError):
+		return None
+
+
+def _retry_delay(e, attempt, backoff, throttled):
+	# Throttled calls are already slowed by the limits, so the delay Google Music asks for is enough.
+	delay = retry_after(e) if throttled else None
+
+	return delay if delay is not None else backoff * 2 ** attempt
+
+
+def _throttle_delay(e, attempt, backoff):
+	return _retry_delay(e, attempt, backoff, is_throttled(e))
+
+
+class EndpointLimiter:
+	"""Token bucket and concurrency limit of one kind of call, adjusted AIMD-style.
+
+	Successful calls raise the concurrency limit by about ``INCREASE`` per window of calls in flight
+	and the call rate by about ``RATE_INCREASE`` per second.
+	Throttled calls cut both by ``DECREASE`` (at most once per round of calls in flight)
+	and pause new calls until the retry delay has passed.
+
+	Parameters:
+		name (str): Name of the endpoint (e.g. ``'upload'``).
+
+		max_concurrency (int): Most calls in flight at once. Default: ``1``
+
+		concurrency (float): Learned concurrency limit. Default: max_concurrency.
+
+		rate (float): Learned calls per second. Default: No limit until throttled.
+	"""
+
+	def __init__(self, name, max_concurrency=1, concurrency=None, rate=None):
+		self.name = name
+		self.max_concurrency = max(1, max_concurrency)
+		self.concurrency = min(self.max_concurrency, concurrency or self.max_concurrency)
+		self.rate = rate
+		self.throttled = 0
+
+		self.in_flight = 0
+		self._tokens = 1.0
+		self._updated = time.monotonic()
+		self._resume = 0
+		self._decreased = 0
+		self._starts = deque()
+		self._condition = threading.Condition()
+
+	def configure(self, max_concurrency):
+		"""Set the most calls in flight at once (e.g. the number of transfer workers)."""
+
+		with self._condition:
+			self.max_concurrency = max(1, max_concurrency)
+			self.concurrency = min(self.max_concurrency, self.concurrency)
+			self._condition.notify_all()
+
+	def acquire(self):
+		"""Wait for a call slot and a token.
+
+		Returns:
+			The monotonic time the call started, to pass to :meth:`release`.
+		"""
+
+		with self._condition:
+			while True:
+				now = time.monotonic()
+
+				if now < self._resume:
+					self._condition.wait(self._resume - now)
+				elif self.in_flight >= int(self.concurrency):
+					self._condition.wait()
+				else:
+					break
+
+			self.in_flight += 1
+			wait = 0
+
+			if self.rate is not None:
+				self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+				self._tokens -= 1
+				wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+			self._updated = now
+			self._starts.append(now + wait)
+
+			while self._starts and self._starts[0] < now - RATE_WINDOW:
+				self._starts.popleft()
+
+		if wait:
+			time.sleep(wait)
+
+		return now + wait
+
+	def release(self, started, throttled=False, delay=0):
+		"""Finish a call, adjusting the limits.
+
+		Parameters:
+			started (float): The value returned by :meth:`acquire`.
+
+			throttled (bool): The call was throttled. Default: ``False``
+
+			delay (float): Seconds to pause new calls after a throttled call. Default: ``0``
+		"""
+
+		with self._condition:
+			self.in_flight -= 1
+			now = time.monotonic()
+
+			if throttled:
+				self.throttled += 1
+				self._resume = max(self._resume, now + delay)
+
+				# Calls started before the last decrease were in flight at the old limits.
+				if started >= self._decreased:
+					self._decrease(now)
+			else:
+				self.concurrency = min(self.max_concurrency, self.concurrency + INCREASE / self.concurrency)
+
+				if self.rate is not None:
+					self.rate += min(RATE_INCREASE / self.rate, self.rate * RATE_STEP)
+
+			self._condition.notify_all()
+
+	def _decrease(self, now):
+		if self.rate is None:
+			# Start from the measured call rate. Further decreases bring it under the quota within a few rounds.
+			span = now - self._starts[0] if self._starts else 0
+			self.rate = max(1, len(self._starts)) / max(MIN_SPAN, span)
+
+		self.rate = max(MIN_RATE, self.rate * DECREASE)
+		self.concurrency = max(1.0, self.concurrency * DECREASE)
+		self._decreased = now
+
+		logger.debug(
+			"Throttled on {0}: limiting to {1:.0f} call(s) at once and {2:.2f} call(s)/s".format(
+				self.name, self.concurrency, self.rate
+			)
+		)
+
+	def as_dict(self):
+		return {'concurrency': self.concurrency, 'rate': self.rate}
+
+
+class Scheduler:
+	"""Adaptive rate limits of Google Music calls shared by all transfers of a run.
+
+	Each kind of call (``'upload'``, ``'download'``, ``'delete'``, ``'listing'``) has its own :class:`EndpointLimiter`.
+	Learned limits are loaded from and saved to a JSON file so later runs start at them.
+
+	Parameters:
+		path (str): Filepath of the learned limits. Default: Don't persist limits.
+	"""
+
+	def __init__(self, path=None):
+		self.path = path
+
+		self._endpoints = {}
+		self._learned = {}
+		self._lock = threading.Lock()
+
+		if path is not None:
+			self._learned = self._load(path)
+
+	@staticmethod
+	def _load(path):
+		try:
+			with open(path, encoding='utf-8') as f:
+				limits = json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+		now = time.time()
+
+		return {
+			name: limit for name, limit in limits.items()
+			if isinstance(limit, dict) and now - limit.get('updated', 0) < LIMITS_TTL
+		}
+
+	def endpoint(self, name, max_concurrency=None):
+		"""Get the limiter of a kind of call, creating it from learned limits if needed.
+
+		Parameters:
+			max_concurrency (int): Most calls in flight at once. Default: Leave unchanged (``1`` for new endpoints).
+		"""
+
+		with self._lock:
+			limiter = self._endpoints.get(name)
+
+			if limiter is None:
+				learned = self._learned.get(name, {})
+				limiter = self._endpoints[name] = EndpointLimiter(
+					name, max_concurrency=max_concurrency or 1,
+					concurrency=learned.get('concurrency'), rate=learned.get('rate')
+				)
+
+				return limiter
+
+		if max_concurrency is not None:
+			limiter.configure(max_concurrency)
+
+		return limiter
+
+	def call(self, name, function, *args, retries=3, backoff=1, on_retry=None, **kwargs):
+		"""Call a function within the limits of an endpoint, retrying with backoff when it raises.
+
+		Throttled calls are retried after the delay the error asks for (or the backoff if it doesn't ask)
+		and pause other calls to the endpoint for as long.
+
+		Parameters:
+			name (str): Name of the endpoint.
+
+			function (callable): The function to call with the remaining positional and keyword arguments.
+
+			retries (int): Number of times to retry after the first attempt fails. Default: ``3``
+
+			backoff (float): Seconds to wait before the first retry. Doubled for each subsequent retry. Default: ``1``
+
+			on_retry (callable): Called as ``on_retry(attempt, exception, delay)`` before sleeping between attempts.
+
+		Returns:
+			The return value of the function.
+			The last exception is raised if every attempt fails.
+		"""
+
+		limiter = self.endpoint(name)
+		attempt = 0
+
+		while True:
+			started = limiter.acquire()
+
+			try:
+				result = function(*args, **kwargs)
+			except Exception as e:
+				throttled = is_throttled(e)
+				delay = _retry_delay(e, attempt, backoff, throttled)
+
+				limiter.release(started, throttled=throttled, delay=delay)
+
+				if attempt >= retries:
+					raise
+
+				attempt += 1
+
+				if on_retry is not None:
+					on_retry(attempt, e, delay)
+
+				time.sleep(delay)
+			else:
+				limiter.release(started)
+
+				return result
+
+	def retry(self, function, *args, retries=3, backoff=1, on_retry=None, **kwargs):
+		"""Call a function that paces its own calls (e.g. with :meth:`iter_pages`), retrying when it raises.
+
+		Takes the same parameters as :meth:`call`. Throttled attempts wait as long as the error asks for.
+		"""
+
+		return retry(
+			function, *args, retries=retries, backoff=backoff, on_retry=on_retry, retry_delay=_throttle_delay, **kwargs
+		)
+
+	def iter_pages(self, name, pages):
+		"""Pace fetching the pages of a lazy listing by the call rate of an endpoint.
+
+		Errors aren't retried here since a listing can't continue after a failed page;
+		retry the whole listing with :meth:`retry` instead.
+		"""
+
+		limiter = self.endpoint(name)
+		pages = iter(pages)
+
+		while True:
+			started = limiter.acquire()
+
+			try:
+				page = next(pages)
+			except StopIteration:
+				limiter.release(started)
+
+				return
+			except Exception as e:
+				limiter.release(started, throttled=is_throttled(e), delay=retry_after(e) or 0)
+
+				raise
+
+			limiter.release(started)
+
+			yield page
+
+	@property
+	def throttled(self):
+		"""Number of throttled calls in this run."""
+
+		return sum(limiter.throttled for limiter in self._endpoints.values())
+
+	def save(self):
+		"""Atomically write learned limits of endpoints that have been throttled, keeping other learned limits."""
+
+		if self.path is None:
+			return
+
+		now = time.time()
+		limits = dict(self._learned)
+
+		for name, limiter in self._endpoints.items():
+			if limiter.rate is not None:
+				limits[name] = dict(limiter.as_dict(), updated=now)
+
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+		temp_path = self.path + '.tmp'
+
+		with open(temp_path, 'w', encoding='utf-8') as f:
+			json.dump(limits, f, indent=2, sort_keys=True)
+
+		os.replace(temp_path, self.path)
+
+
+def scheduled(scheduler, name, function, *args, **kwargs):
+	"""Call a function through a :class:`Scheduler` endpoint or, without a scheduler, with plain retries.
+
+	Takes the keyword arguments of :meth:`Scheduler.call`.
+	"""
+
+	if scheduler is None:
+		return retry(function, *args, **kwargs)
+
+	return scheduler.call(name, function, *args, **kwargs)
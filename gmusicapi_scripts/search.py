@@ -0,0 +1,243 @@
+# coding=utf-8
+
+"""In-memory search index of a Google Music library.
+
+	>>> from gmusicapi_scripts.search import SongIndex
+"""
+
+import re
+import shlex
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, namedtuple
+
+# Query field names and the song dict keys they are read from (Mobileclient and Musicmanager formats).
+FIELDS = OrderedDict([
+	('title', ('title',)),
+	('artist', ('artist',)),
+	('album', ('album',)),
+	('albumartist', ('albumArtist', 'album_artist')),
+	('composer', ('composer',)),
+	('genre', ('genre',)),
+	('year', ('year',)),
+	('track', ('trackNumber', 'track_number')),
+	('disc', ('discNumber', 'disc_number'))
+])
+
+NUMERIC_FIELDS = ('year', 'track', 'disc')
+
+DEFAULT_SORT = ['artist', 'album', 'disc', 'track']
+
+TOKEN_RE = re.compile(r'\w+')
+REGEX_CHARACTERS = set('.^$*+?{}[]\\|()')
+
+Term = namedtuple('Term', ['field', 'pattern', 'negate'])
+
+
+class QueryError(ValueError):
+	"""A query can't be parsed."""
+
+
+def _is_literal(pattern):
+	return not REGEX_CHARACTERS.intersection(pattern)
+
+
+def parse_query(query):
+	"""Parse a search query into terms.
+
+	Terms are separated by whitespace and must all match. Quote terms containing spaces.
+	A term is a case-insensitive Python regex pattern, optionally prefixed with a field name (``artist:muse``)
+	to only search that field, and with ``-`` to exclude matching songs.
+	A literal word ending in ``*`` matches words starting with it (``title:hyster*``).
+
+	Raises:
+		QueryError: The query has unbalanced quotes.
+	"""
+
+	try:
+		parts = shlex.split(query)
+	except ValueError as e:
+		raise QueryError("Invalid query: {}".format(e))
+
+	terms = []
+
+	for part in parts:
+		negate = part.startswith('-') and len(part) > 1
+
+		if negate:
+			part = part[1:]
+
+		field, sep, pattern = part.partition(':')
+
+		if sep and field.lower() in FIELDS:
+			terms.append(Term(field.lower(), pattern, negate))
+		else:
+			terms.append(Term(None, part, negate))
+
+	return terms
+
+
+def _sort_value(field, value):
+	if field in NUMERIC_FIELDS:
+		digits = re.match(r'\d+', value)
+
+		return (0, int(digits.group(0))) if digits else (1, 0)
+
+	return (0, value) if value else (1, value)
+
+
+class SongIndex:
+	"""Inverted index over the metadata fields of Google Music song dicts.
+
+	The library is indexed once; queries are answered from the index without listing the library again.
+	Substring and regex terms are checked against each distinct field value once rather than against every song,
+	and word prefix terms are answered from a sorted vocabulary of the words in each field.
+
+	Parameters:
+		songs (list): Google Music song dicts.
+	"""
+
+	def __init__(self, songs):
+		self.songs = list(songs)
+
+		self._values = {}
+		self._groups = {}
+		self._postings = {}
+		self._tokens = {}
+		self._cache = OrderedDict()
+
+		for field, keys in FIELDS.items():
+			values = []
+			groups = defaultdict(list)
+
+			for position, song in enumerate(self.songs):
+				value = next((song[key] for key in keys if song.get(key) not in (None, '')), '')
+				value = str(value).lower()
+				values.append(value)
+
+				if value:
+					groups[value].append(position)
+
+			postings = defaultdict(list)
+
+			for value, positions in groups.items():
+				for token in set(TOKEN_RE.findall(value)):
+					postings[token].extend(positions)
+
+			self._values[field] = values
+			self._groups[field] = dict(groups)
+			self._postings[field] = dict(postings)
+			self._tokens[field] = sorted(postings)
+
+	def __len__(self):
+		return len(self.songs)
+
+	def _match_field(self, field, pattern):
+		lowered = pattern.lower()
+		prefix = lowered[:-1]
+
+		if lowered.endswith('*') and TOKEN_RE.fullmatch(prefix):
+			tokens = self._tokens[field]
+			postings = self._postings[field]
+			positions = set()
+
+			for token in tokens[bisect_left(tokens, prefix):]:
+				if not token.startswith(prefix):
+					break
+
+				positions.update(postings[token])
+
+			return positions
+
+		if _is_literal(pattern):
+			def match(value):
+				return lowered in value
+		else:
+			try:
+				match = re.compile(pattern, re.I).search
+			except re.error as e:
+				raise QueryError("Invalid pattern '{0}': {1}".format(pattern, e))
+
+		positions = set()
+
+		for value, group in self._groups[field].items():
+			if match(value):
+				positions.update(group)
+
+		return positions
+
+	def _match_term(self, field, pattern):
+		key = (field, pattern)
+
+		if key in self._cache:
+			self._cache.move_to_end(key)
+
+			return self._cache[key]
+
+		positions = set()
+
+		for name in [field] if field else FIELDS:
+			positions |= self._match_field(name, pattern)
+
+		self._cache[key] = positions
+
+		if len(self._cache) > 128:
+			self._cache.popitem(last=False)
+
+		return positions
+
+	def search(self, query):
+		"""Find songs matching a query. See :func:`parse_query` for the syntax.
+
+		Returns:
+			A list of positions in :attr:`songs` of matching songs in library order.
+
+		Raises:
+			QueryError: The query is invalid.
+		"""
+
+		result = None
+
+		# Narrow with the included terms before removing excluded ones.
+		for term in sorted(parse_query(query), key=lambda term: term.negate):
+			positions = self._match_term(term.field, term.pattern)
+
+			if term.negate:
+				result = (set(range(len(self.songs))) if result is None else result) - positions
+			else:
+				result = positions if result is None else result & positions
+
+			if not result:
+				break
+
+		if result is None:
+			return list(range(len(self.songs)))
+
+		return sorted(result)
+
+	def sort(self, positions, fields=None):
+		"""Sort song positions by fields.
+
+		Parameters:
+			positions (list): Song positions as returned by :meth:`search`.
+
+			fields (list): Field names to sort by, prefixed with ``-`` for descending order. Default: ``DEFAULT_SORT``
+
+		Raises:
+			QueryError: A field is unknown.
+		"""
+
+		fields = fields or DEFAULT_SORT
+		positions = list(positions)
+
+		# Stable sorts from the least to the most significant field.
+		for field in reversed(fields):
+			descending = field.startswith('-')
+			field = field.lstrip('-').lower()
+
+			if field not in FIELDS:
+				raise QueryError("Unknown sort field '{0}'. Fields: {1}".format(field, ", ".join(FIELDS)))
+
+			values = self._values[field]
+			positions.sort(key=lambda position: _sort_value(field, values[position]), reverse=descending)
+
+		return positions
@@ -0,0 +1,357 @@
+# coding=utf-8
+
+"""Cached snapshot of the Google Music library listing.
+
+	>>> from gmusicapi_scripts.snapshot import LibrarySnapshot, get_google_songs
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from .filters import FilterSet
+from .utils import get_cache_dir
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# Overlap incremental refreshes to cover clock skew between this machine and Google.
+REFRESH_OVERLAP = 300
+
+# Snapshot rows decoded at a time.
+CHUNK_SIZE = 1000
+
+# Times a throttled full listing is started again. Each attempt is paced slower than the last.
+LISTING_RETRIES = 6
+
+# Song dict keys the scripts use to identify, match, display and sort songs.
+# Musicmanager listings have track_number, Mobileclient listings trackNumber.
+COMPACT_FIELDS = ('id', 'title', 'artist', 'album', 'track_number', 'trackNumber')
+
+
+def get_default_snapshot_path(name):
+	"""Get the default filepath of a library snapshot.
+
+	Parameters:
+		name (str): A name identifying the client type and account (e.g. ``'musicmanager-oauth'``).
+	"""
+
+	return os.path.join(get_cache_dir(), 'library-{}.sqlite'.format(name))
+
+
+class LibrarySnapshot:
+	"""SQLite-backed store of Google Music song dicts with a time to live.
+
+	Parameters:
+		path (str): Filepath of the SQLite database. Created if it doesn't exist.
+
+		ttl (int): Seconds a snapshot is considered fresh after it was fetched. Default: ``600``
+	"""
+
+	def __init__(self, path, ttl=600):
+		dirname = os.path.dirname(os.path.abspath(path))
+		os.makedirs(dirname, exist_ok=True)
+
+		self.path = path
+		self.ttl = ttl
+
+		self._conn = sqlite3.connect(path)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("CREATE TABLE IF NOT EXISTS songs (id TEXT PRIMARY KEY, song TEXT NOT NULL)")
+		self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+		self._conn.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		"""Commit pending changes and close the database."""
+
+		if self._conn is not None:
+			self._conn.commit()
+			self._conn.close()
+			self._conn = None
+
+	def _get_meta(self, key):
+		row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+		return row[0] if row else None
+
+	def _set_meta(self, key, value):
+		self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+	@property
+	def fetched(self):
+		"""Unix timestamp of the last listing merged into the snapshot or ``None`` if never fetched."""
+
+		return self._get_meta('fetched')
+
+	@property
+	def age(self):
+		"""Seconds since the snapshot was last fetched or ``None`` if never fetched."""
+
+		fetched = self.fetched
+
+		return None if fetched is None else time.time() - fetched
+
+	@property
+	def is_fresh(self):
+		"""``True`` if the snapshot was fetched within its time to live."""
+
+		age = self.age
+
+		return age is not None and age < self.ttl and not self._get_meta('stale')
+
+	def songs(self, fields=None):
+		"""Get all song dicts in the snapshot."""
+
+		return list(self.iter_songs(fields=fields))
+
+	def iter_songs(self, fields=None, chunk_size=CHUNK_SIZE):
+		"""Lazily yield the song dicts in the snapshot, decoding chunk_size rows at a time.
+
+		Parameters:
+			fields (list): Keys to keep in each song dict (e.g. ``COMPACT_FIELDS``). Default: All keys.
+		"""
+
+		cursor = self._conn.execute("SELECT song FROM songs")
+
+		try:
+			while True:
+				rows = cursor.fetchmany(chunk_size)
+
+				if not rows:
+					break
+
+				for row in rows:
+					song = json.loads(row[0])
+
+					yield project_song(song, fields) if fields is not None else song
+		finally:
+			cursor.close()
+
+	def replace(self, songs, fetched=None):
+		"""Replace the snapshot contents with a full listing.
+
+		Parameters:
+			songs (list or iterable): Google Music song dicts. Lazy iterables are written as they are consumed.
+				If a song id is listed more than once, the first song dict is kept.
+
+			fetched (float): Unix timestamp of when the listing was requested. Default: Now.
+		"""
+
+		try:
+			self._conn.execute("DELETE FROM songs")
+			self._conn.executemany(
+				"INSERT OR IGNORE INTO songs (id, song) VALUES (?, ?)", ((song['id'], json.dumps(song)) for song in songs)
+			)
+		except Exception:
+			# Keep the previous listing if fetching the new one fails part way.
+			self._conn.rollback()
+
+			raise
+
+		self._set_meta('fetched', time.time() if fetched is None else fetched)
+		self._set_meta('stale', 0)
+		self._conn.commit()
+
+	def update(self, songs, fetched=None):
+		"""Merge an incremental listing into the snapshot.
+
+		Parameters:
+			songs (list): Changed Google Music song dicts. Dicts with a true ``deleted`` key are removed.
+
+			fetched (float): Unix timestamp of when the listing was requested. Default: Now.
+
+		Returns:
+			The number of songs added or updated and the number of songs removed.
+		"""
+
+		changed = [song for song in songs if not song.get('deleted')]
+		deleted = [song['id'] for song in songs if song.get('deleted')]
+
+		self._conn.executemany(
+			"INSERT OR REPLACE INTO songs (id, song) VALUES (?, ?)", ((song['id'], json.dumps(song)) for song in changed)
+		)
+		self._conn.executemany("DELETE FROM songs WHERE id = ?", ((song_id,) for song_id in deleted))
+		self._set_meta('fetched', time.time() if fetched is None else fetched)
+		self._set_meta('stale', 0)
+		self._conn.commit()
+
+		return len(changed), len(deleted)
+
+	def remove(self, song_ids):
+		"""Remove songs from the snapshot (e.g. after deleting them from Google Music)."""
+
+		self._conn.executemany("DELETE FROM songs WHERE id = ?", ((song_id,) for song_id in song_ids))
+		self._conn.commit()
+
+	def expire(self):
+		"""Mark the snapshot as stale so the next listing refreshes it."""
+
+		self._set_meta('stale', 1)
+		self._conn.commit()
+
+
+def project_song(song, fields):
+	"""Copy the given keys of a song dict that it has."""
+
+	return {field: song[field] for field in fields if field in song}
+
+
+def _iter_all_songs(api, scheduler=None):
+	"""Lazily fetch the full library listing from a gmusicapi client a page at a time.
+
+	Uploaded songs come before purchased songs so :meth:`LibrarySnapshot.replace` keeps them for songs in both.
+	Pages are fetched at the call rate of the scheduler's ``'listing'`` endpoint, if given.
+	"""
+
+	if hasattr(api, 'get_all_songs'):
+		listings = [api.get_all_songs]
+	else:
+		listings = [api.get_uploaded_songs, api.get_purchased_songs]
+
+	for listing in listings:
+		pages = listing(incremental=True)
+
+		if scheduler is not None:
+			pages = scheduler.iter_pages('listing', pages)
+
+		for page in pages:
+			for song in page:
+				yield song
+
+
+def refresh_snapshot(wrapper, snapshot, full=False, scheduler=None):
+	"""Bring a library snapshot up to date.
+
+	Clients that support listing changes since a point in time (Mobileclient) are refreshed incrementally.
+	Others (Musicmanager) are refreshed with a full listing.
+
+	Parameters:
+		wrapper: An authenticated ``MobileClientWrapper`` or ``MusicManagerWrapper``.
+
+		snapshot (LibrarySnapshot): The snapshot to refresh.
+
+		full (bool): Fetch the full listing even if an incremental refresh is possible. Default: ``False``
+
+		scheduler (Scheduler): Adaptive rate limits to list within. Throttled listings are retried from the start.
+			Default: Don't retry.
+	"""
+
+	api = wrapper.api
+	requested = time.time()
+	fetched = snapshot.fetched
+
+	if not full and fetched is not None and hasattr(api, 'get_all_songs'):
+		since = datetime.datetime.fromtimestamp(fetched - REFRESH_OVERLAP, datetime.timezone.utc)
+
+		if scheduler is not None:
+			songs = scheduler.call('listing', api.get_all_songs, updated_after=since, include_deleted=True)
+		else:
+			songs = api.get_all_songs(updated_after=since, include_deleted=True)
+
+		changed, deleted = snapshot.update(songs, fetched=requested)
+
+		logger.debug("Refreshed Google Music snapshot: {0} changed, {1} removed".format(changed, deleted))
+	else:
+		def replace():
+			# A new listing is started for every attempt.
+			snapshot.replace(_iter_all_songs(api, scheduler), fetched=requested)
+
+		if scheduler is not None:
+			scheduler.retry(replace, retries=LISTING_RETRIES)
+		else:
+			replace()
+
+
+def iter_google_songs(wrapper, snapshot, filters=None, offline=False, refresh=False, fields=None, scheduler=None):
+	"""Lazily yield songs from the user's Google Music library using a cached snapshot.
+
+	The snapshot is refreshed if it is older than its time to live,
+	then read in chunks so only the songs being filtered are decoded at a time.
+
+	Parameters:
+		wrapper: An authenticated ``MobileClientWrapper`` or ``MusicManagerWrapper``. May be ``None`` when offline.
+
+		snapshot (LibrarySnapshot): The library snapshot to read from and refresh.
+
+		filters (FilterSet): Metadata filters. Default: No filters.
+
+		offline (bool): Answer from the snapshot without contacting Google Music, regardless of its age. Default: ``False``
+
+		refresh (bool): Fetch the full listing regardless of the snapshot's age. Default: ``False``
+
+		fields (list): Keys to keep in each song dict (e.g. ``COMPACT_FIELDS``).
+			Fields used by filters are matched before songs are projected. Default: All keys.
+
+		scheduler (Scheduler): Adaptive rate limits to refresh the snapshot within. Default: Don't retry listings.
+
+	Yields:
+		``('matched', song)`` for songs matching criteria and ``('filtered', song)`` for songs filtered out.
+	"""
+
+	if offline:
+		if snapshot.fetched is None:
+			raise LookupError("No cached Google Music library snapshot at {}".format(snapshot.path))
+
+		logger.info("Using Google Music library snapshot from {0:.0f} minute(s) ago".format(snapshot.age / 60))
+	elif refresh or not snapshot.is_fresh:
+		refresh_snapshot(wrapper, snapshot, full=refresh, scheduler=scheduler)
+
+	filters = filters or FilterSet()
+	read_fields = sorted(set(fields) | filters.fields) if fields is not None and filters else fields
+
+	for song in snapshot.iter_songs(fields=read_fields):
+		status = 'matched' if not filters or filters.match(song) else 'filtered'
+
+		yield status, project_song(song, fields) if read_fields is not fields else song
+
+
+def get_google_songs(wrapper, snapshot, filters=None, offline=False, refresh=False, fields=None, scheduler=None):
+	"""Create song list from user's Google Music library using a cached snapshot.
+
+	Drop-in replacement for the wrappers' ``get_google_songs``.
+	The snapshot is refreshed if it is older than its time to live.
+
+	Parameters:
+		wrapper: An authenticated ``MobileClientWrapper`` or ``MusicManagerWrapper``. May be ``None`` when offline.
+
+		snapshot (LibrarySnapshot): The library snapshot to read from and refresh.
+
+		filters (FilterSet): Metadata filters. Default: No filters.
+
+		offline (bool): Answer from the snapshot without contacting Google Music, regardless of its age. Default: ``False``
+
+		refresh (bool): Fetch the full listing regardless of the snapshot's age. Default: ``False``
+
+		fields (list): Keys to keep in each song dict (e.g. ``COMPACT_FIELDS``). Default: All keys.
+
+		scheduler (Scheduler): Adaptive rate limits to refresh the snapshot within. Default: Don't retry listings.
+
+	Returns:
+		A list of Google Music song dicts matching criteria and
+		a list of Google Music song dicts filtered out using filter criteria.
+	"""
+
+	logger.info("Loading Google Music songs...")
+
+	matched_songs = []
+	filtered_songs = []
+
+	for status, song in iter_google_songs(
+			wrapper, snapshot, filters=filters, offline=offline, refresh=refresh, fields=fields, scheduler=scheduler):
+		if status == 'matched':
+			matched_songs.append(song)
+		else:
+			filtered_songs.append(song)
+
+	logger.info("Filtered {0} Google Music songs".format(len(filtered_songs)))
+	logger.info("Loaded {0} Google Music songs".format(len(matched_songs)))
+
+	return matched_songs, filtered_songs
@@ -0,0 +1,207 @@
+# coding=utf-8
+
+"""Per-phase timing and metrics of script runs.
+
+	>>> from gmusicapi_scripts.stats import Stats
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+	import resource
+except ImportError:  # Windows.
+	resource = None
+
+STATS_FORMATS = ('json', 'prometheus')
+
+PROMETHEUS_METRICS = [
+	('seconds', 'phase_seconds', "Wall time of a script phase in seconds."),
+	('items', 'phase_items', "Songs or files processed in a script phase."),
+	('bytes', 'phase_bytes', "Bytes transferred in a script phase."),
+	('retries', 'phase_retries', "Retried calls in a script phase."),
+	('peak_rss', 'phase_peak_rss_bytes', "Peak resident set size of the script process at the end of a phase.")
+]
+
+PROMETHEUS_COUNTS = ('phase_count', "Phase-specific counts (e.g. directories pruned by a scan) by name.")
+
+
+def peak_rss():
+	"""Get the peak resident set size of the current process in bytes or ``None`` if not available."""
+
+	if resource is None:
+		return None
+
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	# Reported in bytes on macOS and kilobytes elsewhere.
+	return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Phase:
+	"""Metrics of a script phase. :meth:`add` is safe to call from worker threads."""
+
+	def __init__(self, name):
+		self.name = name
+		self.seconds = 0
+		self.items = 0
+		self.bytes = 0
+		self.retries = 0
+		self.peak_rss = None
+		self.counts = {}
+
+		self._lock = threading.Lock()
+
+	def add(self, items=0, size=0, retries=0, **counts):
+		"""Count processed items, transferred bytes, retries and other named counts of the phase."""
+
+		with self._lock:
+			self.items += items
+			self.bytes += size
+			self.retries += retries
+
+			for name, count in counts.items():
+				self.counts[name] = self.counts.get(name, 0) + count
+
+	def as_dict(self):
+		return {
+			'phase': self.name, 'seconds': self.seconds, 'items': self.items,
+			'bytes': self.bytes, 'retries': self.retries, 'peak_rss': self.peak_rss, 'counts': dict(self.counts)
+		}
+
+
+class _NullPhase:
+	"""Phase of disabled stats. Counts nothing."""
+
+	name = None
+
+	def add(self, items=0, size=0, retries=0, **counts):
+		pass
+
+
+NULL_PHASE = _NullPhase()
+
+
+class Stats:
+	"""Collect per-phase metrics of a script run.
+
+		>>> stats = Stats('gmsync')
+		>>> with stats.phase('listing') as phase:
+		...     phase.add(items=len(songs))
+
+	Parameters:
+		script (str): Name of the script.
+
+		enabled (bool): If ``False``, phases are not timed or recorded. Default: ``True``
+	"""
+
+	def __init__(self, script, enabled=True):
+		self.script = script
+		self.enabled = enabled
+		self.phases = []
+		self.started = time.time()
+
+		self._start = time.perf_counter()
+
+	@contextmanager
+	def phase(self, name):
+		"""Time a phase of the run.
+
+		Yields:
+			The :class:`Phase` to count items, bytes and retries in.
+		"""
+
+		if not self.enabled:
+			yield NULL_PHASE
+
+			return
+
+		phase = Phase(name)
+		self.phases.append(phase)
+		start = time.perf_counter()
+
+		try:
+			yield phase
+		finally:
+			phase.seconds += time.perf_counter() - start
+			phase.peak_rss = peak_rss()
+
+	def as_dict(self):
+		return {
+			'script': self.script,
+			'started': self.started,
+			'seconds': time.perf_counter() - self._start,
+			'peak_rss': peak_rss(),
+			'phases': [phase.as_dict() for phase in self.phases]
+		}
+
+	def to_json(self):
+		return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+	def to_prometheus(self):
+		"""Format the metrics in the Prometheus text exposition format (e.g. for the node exporter textfile collector)."""
+
+		stats = self.as_dict()
+		lines = []
+
+		for attribute, metric, description in PROMETHEUS_METRICS:
+			lines.append("# HELP gmusicapi_scripts_{0} {1}".format(metric, description))
+			lines.append("# TYPE gmusicapi_scripts_{} gauge".format(metric))
+
+			for phase in stats['phases']:
+				if phase[attribute] is not None:
+					lines.append(
+						'gmusicapi_scripts_{metric}{{script="{script}",phase="{phase}"}} {value}'.format(
+							metric=metric, script=self.script, phase=phase['phase'], value=phase[attribute]
+						)
+					)
+
+		metric, description = PROMETHEUS_COUNTS
+		lines.append("# HELP gmusicapi_scripts_{0} {1}".format(metric, description))
+		lines.append("# TYPE gmusicapi_scripts_{} gauge".format(metric))
+
+		for phase in stats['phases']:
+			for name, count in sorted(phase['counts'].items()):
+				lines.append(
+					'gmusicapi_scripts_{metric}{{script="{script}",phase="{phase}",count="{name}"}} {value}'.format(
+						metric=metric, script=self.script, phase=phase['phase'], name=name, value=count
+					)
+				)
+
+		lines.append("# HELP gmusicapi_scripts_run_seconds Wall time of the script run in seconds.")
+		lines.append("# TYPE gmusicapi_scripts_run_seconds gauge")
+		lines.append('gmusicapi_scripts_run_seconds{{script="{0}"}} {1}'.format(self.script, stats['seconds']))
+		lines.append("# HELP gmusicapi_scripts_last_run_timestamp_seconds Unix time the script run started.")
+		lines.append("# TYPE gmusicapi_scripts_last_run_timestamp_seconds gauge")
+		lines.append('gmusicapi_scripts_last_run_timestamp_seconds{{script="{0}"}} {1}'.format(self.script, stats['started']))
+
+		return "\n".join(lines) + "\n"
+
+	def emit(self, stats_format, path=None):
+		"""Output the metrics.
+
+		Parameters:
+			stats_format (str): ``'json'`` or ``'prometheus'``.
+
+			path (str): File to write to. Replaced atomically so collectors never read a partial file.
+				Default: Standard output.
+		"""
+
+		output = self.to_prometheus() if stats_format == 'prometheus' else self.to_json() + "\n"
+
+		if path is None:
+			sys.stdout.write(output)
+			sys.stdout.flush()
+
+			return
+
+		temp_path = path + '.tmp'
+
+		with open(temp_path, 'w') as f:
+			f.write(output)
+
+		os.replace(temp_path, path)
@@ -0,0 +1,258 @@
+# coding=utf-8
+
+"""Compiled output filepath templates for downloads.
+
+	>>> from gmusicapi_scripts.template import PathTemplate
+"""
+
+import os
+import re
+from collections import OrderedDict
+
+# Template patterns and the metadata keys they are filled from, in order of preference.
+# Mutagen keys come first, as in gmusicapi-wrapper's TEMPLATE_PATTERNS (0.5.2), followed by Google Music song keys.
+TEMPLATE_FIELDS = OrderedDict([
+	('%artist%', ('artist',)),
+	('%title%', ('title',)),
+	('%track%', ('tracknumber', 'track_number', 'trackNumber')),
+	('%track2%', ('tracknumber', 'track_number', 'trackNumber')),
+	('%album%', ('album',)),
+	('%date%', ('date', 'year')),
+	('%genre%', ('genre',)),
+	('%albumartist%', ('albumartist', 'album_artist', 'albumArtist')),
+	('%disc%', ('discnumber', 'disc_number', 'discNumber'))
+])
+
+SUGGESTED = '%suggested%'
+
+# Characters that can't be used in filenames on some systems and their replacements.
+CHARACTER_REPLACEMENTS = {
+	'\\': '-', '/': ',', ':': '-', '*': 'x', '<': '[',
+	'>': ']', '|': '!', '?': '', '"': "''"
+}
+
+CHARACTER_TABLE = str.maketrans(CHARACTER_REPLACEMENTS)
+
+TRACK_KEYS = ('tracknumber', 'track_number', 'trackNumber')
+
+PATTERN_RE = re.compile(
+	'|'.join(re.escape(pattern) for pattern in sorted(list(TEMPLATE_FIELDS) + [SUGGESTED], key=len, reverse=True))
+)
+
+
+def _replace_characters(text):
+	return text.translate(CHARACTER_TABLE)
+
+
+def _split_parts(path):
+	parts = []
+
+	while True:
+		head, tail = os.path.split(path)
+
+		if head == path:
+			break
+
+		parts.append(tail)
+		path = head
+
+	parts.reverse()
+
+	return parts
+
+
+def suggested_filename(metadata):
+	"""Get the filename Google Music suggests for a song (e.g. ``'01 Title'``)."""
+
+	title = metadata.get('title')
+
+	if title:
+		for key in TRACK_KEYS:
+			if metadata.get(key):
+				return '{0:0>2} {1}'.format(metadata[key], title)
+
+	return '00 {}'.format(metadata.get('title', ''))
+
+
+class PathTemplate:
+	"""An output filepath template parsed once into literal text and patterns.
+
+	Filepaths are rendered the way gmusicapi-wrapper's ``template_to_filepath`` renders them:
+	patterns are replaced with metadata values, patterns without a value are kept,
+	and characters that can't be used in filenames are replaced in each path component.
+
+	Parameters:
+		template (str): A filepath which can include template patterns (e.g. ``%artist%/%album%/%track% - %title%``).
+			The current directory or ``%suggested%`` save songs in the current directory by suggested filename.
+			Default: Current directory.
+	"""
+
+	def __init__(self, template=None):
+		if not template:
+			template = os.getcwd()
+
+		if os.name == 'nt':
+			# Imported here rather than at module level so scripts start without loading gmusicapi.
+			from gmusicapi_wrapper.constants import CYGPATH_RE
+			from gmusicapi_wrapper.utils import convert_cygwin_path
+
+			if CYGPATH_RE.match(template):
+				template = convert_cygwin_path(template)
+
+		self.template = template
+		self.suggested = template == os.getcwd() or template == SUGGESTED
+		self.fields = set()
+
+		drive, path = os.path.splitdrive(template)
+		parts = _split_parts(path) if not self.suggested else [SUGGESTED]
+
+		if self.suggested:
+			root = ''
+		elif drive:
+			root = os.path.join(drive, os.sep)
+		elif os.path.isabs(template):
+			root = os.sep
+		else:
+			root = ''
+
+		# Path components are parsed into (text, keys) segments, so rendering is a lookup per pattern and a join.
+		self._root = root
+		self._components = []
+		self._prefix = root
+		self._cache = {}
+
+		literal = True
+
+		for i, part in enumerate(parts):
+			segments = []
+			position = 0
+
+			for match in PATTERN_RE.finditer(part):
+				if match.start() > position:
+					segments.append((_replace_characters(part[position:match.start()]), None))
+
+				pattern = match.group()
+				segments.append((pattern, TEMPLATE_FIELDS.get(pattern, SUGGESTED)))
+				self.fields.add(pattern)
+				position = match.end()
+				literal = False
+
+			if position < len(part):
+				segments.append((_replace_characters(part[position:]), None))
+
+			self._components.append(segments)
+
+			# The last component is the filename, even without patterns.
+			if literal and i < len(parts) - 1:
+				self._prefix = os.path.join(self._prefix, _replace_characters(part))
+
+	def __repr__(self):
+		return 'PathTemplate({!r})'.format(self.template)
+
+	@property
+	def keys(self):
+		"""The set of song dict keys the template's patterns are filled from."""
+
+		keys = set()
+
+		for pattern in self.fields:
+			keys.update(TEMPLATE_FIELDS[pattern] if pattern != SUGGESTED else ('title',) + TRACK_KEYS)
+
+		return keys
+
+	def render(self, metadata, strict=False):
+		"""Render the filepath of a song without an extension.
+
+		Parameters:
+			metadata (dict): A Google Music song dict or single-value mutagen tags.
+
+			strict (bool): Return ``None`` instead of keeping patterns the metadata has no value for.
+
+		Returns:
+			A filepath.
+		"""
+
+		parts = []
+
+		for segments in self._components:
+			pieces = []
+
+			for text, keys in segments:
+				if keys is SUGGESTED:
+					text = _replace_characters(suggested_filename(metadata))
+				elif keys is not None:
+					for key in keys:
+						value = metadata.get(key)
+
+						if value is not None:
+							value = str(value)
+
+							# Track numbers are zero-padded to 2 digits.
+							if key in TRACK_KEYS:
+								value = value.split('/')[0].zfill(2)
+
+							text = _replace_characters(value)
+							break
+					else:
+						# Patterns without a value are kept.
+						if strict:
+							return None
+
+				pieces.append(text)
+
+			parts.append("".join(pieces))
+
+		# Components left empty by empty values are dropped by the join, as in template_to_filepath.
+		return os.path.join(self._root, *parts)
+
+	def song_filepath(self, song):
+		"""Render the filepath of a Google Music song before downloading it.
+
+		Filepaths are cached by song id for reuse by later stages (e.g. planning and downloading).
+
+		Returns:
+			A filepath without an extension or ``None`` if the song dict lacks a field the template uses
+			(e.g. %genre% from a Musicmanager listing). Those filepaths are rendered from the downloaded file's tags.
+		"""
+
+		try:
+			return self._cache[song['id']]
+		except KeyError:
+			filepath = self._cache[song['id']] = self.render(song, strict=True)
+
+			return filepath
+
+	def literal_prefix(self):
+		"""Get the leading directories of the template without patterns as an absolute path."""
+
+		if self.suggested:
+			return os.getcwd()
+
+		return os.path.abspath(self._prefix or os.curdir)
+
+	def base_path(self, songs=()):
+		"""Get the directory all songs are saved under.
+
+		The literal prefix of the template is used without rendering any paths.
+		If that is the filesystem root (e.g. ``/%artist%/%album%/%title%``), the filepaths of songs are rendered
+		and cached for download, and their common directory is used instead.
+
+		Parameters:
+			songs (list): Google Music song dicts to download.
+
+		Returns:
+			An absolute directory path.
+		"""
+
+		base_path = self.literal_prefix()
+
+		if os.path.dirname(base_path) != base_path or not songs:
+			return base_path
+
+		song_paths = []
+
+		for song in songs:
+			filepath = self.song_filepath(song)
+			song_paths.append(os.path.abspath(filepath if filepath is not None else self.render(song)))
+
+		return os.path.dirname(os.path.commonprefix(song_paths))
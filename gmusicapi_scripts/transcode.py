@@ -0,0 +1,423 @@
+# coding=utf-8
+
+"""Transcoding of non-MP3 songs ahead of uploads into a size-bounded cache.
+
+	>>> from gmusicapi_scripts.transcode import TranscodeCache, Transcoder
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .utils import get_cache_dir
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# Supported formats Google Music only accepts as MP3. gmusicapi transcodes them during the upload otherwise.
+TRANSCODE_FORMATS = ('.flac', '.m4a', '.ogg')
+
+# Part of the cache key. Bump when the encoder arguments change so old outputs aren't reused.
+FORMAT_VERSION = 1
+
+# Bytes hashed per read.
+CHUNK_SIZE = 1024 * 1024
+
+# Seconds before an unfinished output left by an interrupted run is removed.
+STALE_PART_AGE = 3600
+
+
+def get_default_transcode_dir():
+	"""Get the default directory of the transcode cache."""
+
+	return os.path.join(get_cache_dir(), 'transcodes')
+
+
+def find_encoder():
+	"""Get the path of ffmpeg or avconv or ``None`` if neither is installed."""
+
+	return shutil.which('ffmpeg') or shutil.which('avconv')
+
+
+def needs_transcoding(filepath):
+	"""Return ``True`` if Google Music needs a song file transcoded to MP3."""
+
+	return os.path.splitext(filepath)[1].lower() in TRANSCODE_FORMATS
+
+
+def encoder_settings(encoder, quality):
+	"""Get the cache key part identifying the encoder and its settings."""
+
+	return '{0}|{1}|{2}'.format(os.path.splitext(os.path.basename(encoder))[0], quality, FORMAT_VERSION)
+
+
+def file_digest(filepath):
+	"""Hash the full contents of a file, including tags.
+
+	Returns:
+		A hex SHA-1 digest.
+	"""
+
+	digest = hashlib.sha1()
+
+	with open(filepath, 'rb') as f:
+		for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+			digest.update(chunk)
+
+	return digest.hexdigest()
+
+
+def transcode_command(encoder, source, dest, quality='320k'):
+	"""Build the encoder command line converting source to a tagged MP3 file at dest.
+
+	Unlike gmusicapi, which streams untagged MP3 frames (``-f s16le``) while uploading, the source's tags are kept.
+
+	Parameters:
+		quality (str or int): An int is used as libmp3lame VBR quality (``-q:a``), a str as CBR bitrate (``-b:a``).
+	"""
+
+	command = [
+		encoder, '-nostdin', '-loglevel', 'error', '-y', '-i', source, '-map', '0:a:0', '-map_metadata', '0',
+		'-codec:a', 'libmp3lame'
+	]
+	command.extend(['-q:a', str(quality)] if isinstance(quality, int) else ['-b:a', str(quality)])
+	command.extend(['-id3v2_version', '3', '-f', 'mp3', dest])
+
+	return command
+
+
+def _prepare(encoder, source, directory, settings, quality, digest=None):
+	"""Transcode a song into the cache directory unless it is already there. Run in worker threads.
+
+	Returns:
+		The source digest, the cache key, the size of the output and whether it was transcoded.
+	"""
+
+	if digest is None:
+		digest = file_digest(source)
+
+	key = hashlib.sha1('{0}|{1}'.format(digest, settings).encode('utf-8')).hexdigest()
+	dest = os.path.join(directory, key + '.mp3')
+
+	try:
+		return digest, key, os.path.getsize(dest), False
+	except OSError:
+		pass
+
+	# Unique per process and thread so concurrent transcodes of the same audio don't write to the same file.
+	temp_path = '{0}.{1}-{2}.part'.format(dest, os.getpid(), threading.get_ident())
+	process = subprocess.Popen(
+		transcode_command(encoder, source, temp_path, quality),
+		stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+	)
+	_, error = process.communicate()
+
+	if process.returncode:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+
+		raise OSError("{0} exited with status {1}: {2}".format(
+			os.path.basename(encoder), process.returncode, error.decode('utf-8', 'replace').strip()
+		))
+
+	os.replace(temp_path, dest)
+
+	return digest, key, os.path.getsize(dest), True
+
+
+class TranscodeCache:
+	"""Directory of transcoded MP3 files keyed by source content hash and encoder settings,
+	evicted least recently used first when it grows over a maximum size.
+
+	An SQLite index in the directory records the size and last use of every output
+	and the content hashes of source files by path, size and mtime.
+
+	Parameters:
+		directory (str): Directory of the cache. Created if it doesn't exist.
+
+		max_size (int): Maximum total size of cached files in bytes.
+	"""
+
+	def __init__(self, directory, max_size):
+		os.makedirs(directory, exist_ok=True)
+
+		self.directory = directory
+		self.max_size = max_size
+
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS outputs (key TEXT PRIMARY KEY, size INTEGER NOT NULL, used REAL NOT NULL)"
+		)
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS sources ("
+			"path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, digest TEXT NOT NULL)"
+		)
+		self._conn.commit()
+
+		now = time.time()
+
+		for part in glob.glob(os.path.join(glob.escape(directory), '*.part')):
+			try:
+				if now - os.path.getmtime(part) > STALE_PART_AGE:
+					os.remove(part)
+			except OSError:
+				pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		"""Commit pending entries and close the index."""
+
+		if self._conn is not None:
+			self._conn.commit()
+			self._conn.close()
+			self._conn = None
+
+	def path(self, key):
+		"""Get the filepath of a cached output."""
+
+		return os.path.join(self.directory, key + '.mp3')
+
+	def source_digest(self, filepath, stat):
+		"""Get the cached content hash of a source file or ``None`` if it isn't cached or has changed."""
+
+		with self._lock:
+			row = self._conn.execute(
+				"SELECT digest FROM sources WHERE path = ? AND size = ? AND mtime = ?",
+				(filepath, stat.st_size, stat.st_mtime_ns)
+			).fetchone()
+
+		return row[0] if row is not None else None
+
+	def add(self, filepath, stat, digest, key, size):
+		"""Record the content hash of a source file and mark its output as just used."""
+
+		with self._lock:
+			self._conn.execute(
+				"INSERT OR REPLACE INTO sources (path, size, mtime, digest) VALUES (?, ?, ?, ?)",
+				(filepath, stat.st_size, stat.st_mtime_ns, digest)
+			)
+			self._conn.execute(
+				"INSERT OR REPLACE INTO outputs (key, size, used) VALUES (?, ?, ?)", (key, size, time.time())
+			)
+			self._conn.commit()
+
+	@property
+	def size(self):
+		"""Total size of cached outputs in bytes."""
+
+		with self._lock:
+			return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM outputs").fetchone()[0]
+
+	def evict(self, keep=()):
+		"""Remove least recently used outputs until the cache fits its maximum size.
+
+		Parameters:
+			keep (set): Keys of outputs not to remove (e.g. ones waiting to be uploaded).
+
+		Returns:
+			The number of outputs removed.
+		"""
+
+		with self._lock:
+			total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM outputs").fetchone()[0]
+
+			if total <= self.max_size:
+				return 0
+
+			removed = []
+
+			for key, size in self._conn.execute("SELECT key, size FROM outputs ORDER BY used").fetchall():
+				if total <= self.max_size:
+					break
+
+				if key in keep:
+					continue
+
+				try:
+					os.remove(self.path(key))
+				except FileNotFoundError:
+					pass
+				except OSError as e:
+					logger.warning("Can't remove transcoded file {0}: {1}".format(self.path(key), e))
+					continue
+
+				removed.append((key,))
+				total -= size
+
+			self._conn.executemany("DELETE FROM outputs WHERE key = ?", removed)
+			self._conn.commit()
+
+		return len(removed)
+
+
+class Transcoder:
+	"""Transcode non-MP3 songs with concurrent encoder processes ahead of the uploads that consume them.
+
+	Outputs are looked up in and added to a :class:`TranscodeCache`,
+	so unchanged songs aren't transcoded again by later runs.
+	Songs that can't be transcoded are left to gmusicapi to transcode while uploading.
+
+	Google Music identifies uploads by the MD5 of the uploaded file without tags, so a song uploaded from its output
+	isn't identified as the same song uploaded from the original file or an output of another encoder version.
+
+	Parameters:
+		cache (TranscodeCache): The cache to keep outputs in.
+
+		quality (str or int): libmp3lame VBR quality if an int, otherwise a CBR bitrate. Default: ``320k``
+
+		jobs (int): Number of encoder processes run at once. Default: ``1``
+
+		encoder (str): Path of ffmpeg or avconv. Default: Found on the ``PATH``.
+	"""
+
+	def __init__(self, cache, quality='320k', jobs=1, encoder=None):
+		self.cache = cache
+		self.quality = quality
+		self.jobs = max(1, jobs)
+		self.encoder = encoder or find_encoder()
+		self.outputs = {}
+		self.hits = 0
+		self.transcoded = 0
+		self.failed = 0
+
+		self._keys = set()
+
+	def _submit(self, executor, filepath):
+		try:
+			stat = os.stat(filepath)
+		except OSError:
+			stat = None
+
+		digest = self.cache.source_digest(filepath, stat) if stat is not None else None
+		settings = encoder_settings(self.encoder, self.quality)
+
+		return executor.submit(_prepare, self.encoder, filepath, self.cache.directory, settings, self.quality, digest), stat
+
+	def _handle(self, future, filepath, stat):
+		try:
+			digest, key, size, transcoded = future.result()
+		except Exception as e:
+			self.failed += 1
+
+			logger.warning("Can't transcode {0} before uploading: {1}".format(filepath, e))
+
+			return
+
+		if stat is not None:
+			self.cache.add(filepath, stat, digest, key, size)
+
+		self._keys.add(key)
+		self.outputs[filepath] = self.cache.path(key)
+
+		if transcoded:
+			self.transcoded += 1
+
+			logger.debug("Transcoded {0} to {1}".format(filepath, self.outputs[filepath]))
+		else:
+			self.hits += 1
+
+		# Outputs of this run are kept until it ends since they may still be waiting to be uploaded.
+		self.cache.evict(keep=self._keys)
+
+	def iter_transcoded(self, filepaths):
+		"""Lazily yield filepaths once they are ready to upload.
+
+		MP3 files are yielded as they are consumed, other songs once their transcoded output is in :attr:`outputs`
+		or transcoding failed, in the order they finish. A bounded number of songs are transcoded ahead.
+
+		Parameters:
+			filepaths (list or iterable): Filepaths to upload.
+		"""
+
+		if self.encoder is None:
+			logger.warning("Can't find ffmpeg or avconv to transcode songs with before uploading")
+
+			for filepath in filepaths:
+				yield filepath
+
+			return
+
+		window = self.jobs * 2
+		pending = {}
+
+		# Encoding happens in the encoder processes and hashing releases the GIL, so threads are enough to drive them.
+		# Unlike a process pool, they are safe to start from the thread of a buffered iterable.
+		with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+			for filepath in filepaths:
+				if not needs_transcoding(filepath):
+					yield filepath
+					continue
+
+				while len(pending) >= window:
+					done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+					for future in done:
+						filepath_done, stat = pending.pop(future)
+						self._handle(future, filepath_done, stat)
+
+						yield filepath_done
+
+				future, stat = self._submit(executor, filepath)
+				pending[future] = (filepath, stat)
+
+			while pending:
+				done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+				for future in done:
+					filepath_done, stat = pending.pop(future)
+					self._handle(future, filepath_done, stat)
+
+					yield filepath_done
+
+	def stage(self, filepaths):
+		"""Wrap filepaths to upload in a transcoding stage.
+
+		Returns:
+			An iterable running :meth:`iter_transcoded` when iterated, with the length of filepaths if it has one,
+			so uploads can still report progress against the total.
+		"""
+
+		if hasattr(filepaths, '__len__'):
+			return TranscodeStage(self, filepaths)
+
+		return self.iter_transcoded(filepaths)
+
+	def close(self):
+		"""Log a summary, evict outputs over the cache size and close the cache."""
+
+		if self.hits or self.transcoded or self.failed:
+			logger.info(
+				"\nTranscoded {0} song(s) before uploading, {1} from cache, {2} failed".format(
+					self.transcoded + self.hits, self.hits, self.failed
+				)
+			)
+
+		self.cache.evict()
+		self.cache.close()
+
+
+class TranscodeStage:
+	"""A list of filepaths to upload that is transcoded as it is iterated. See :meth:`Transcoder.stage`."""
+
+	def __init__(self, transcoder, filepaths):
+		self.transcoder = transcoder
+		self.filepaths = filepaths
+
+	def __iter__(self):
+		return self.transcoder.iter_transcoded(self.filepaths)
+
+	def __len__(self):
+		return len(self.filepaths)
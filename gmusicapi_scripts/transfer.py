@@ -0,0 +1,599 @@
+# coding=utf-8
+
+"""Concurrent transfers between the local computer and Google Music.
+
+	>>> from gmusicapi_scripts.transfer import download_songs, upload_songs
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .scheduler import scheduled
+from .template import PathTemplate
+from .writer import DownloadWriter, iter_chunks
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# Seconds between aggregate progress messages.
+PROGRESS_INTERVAL = 5
+
+# Responses from Google Music meaning an upload is already in the library.
+EXIST_STRINGS = ["ALREADY_EXISTS", "this song is already uploaded"]
+
+
+class RateLimiter:
+	"""Token bucket limiting the combined byte rate of concurrent workers.
+
+	Bytes are taken after they are received, since gmusicapi fetches each song whole,
+	so the limit holds on average over several songs by delaying the workers' next downloads.
+	It doesn't cap the bandwidth of downloads already in flight.
+
+	Parameters:
+		rate (int): Maximum average bytes per second.
+
+		burst (int): Maximum bytes that can be consumed at once without waiting. Default: One second of ``rate``.
+	"""
+
+	def __init__(self, rate, burst=None):
+		self.rate = rate
+		self.burst = burst or rate
+
+		self._tokens = self.burst
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def consume(self, amount):
+		"""Take amount bytes from the bucket, sleeping until the average rate allows it."""
+
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+			self._updated = now
+			self._tokens -= amount
+			wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+		if wait:
+			time.sleep(wait)
+
+
+class Progress:
+	"""Aggregate progress of a transfer.
+
+	Parameters:
+		total (int): Number of songs to transfer or ``None`` if not known in advance.
+	"""
+
+	def __init__(self, total):
+		self.total = total
+		self.done = 0
+		self.bytes = 0
+		self.started = time.monotonic()
+
+		self._reported = self.started
+
+	def update(self, size=0):
+		"""Record a finished song of size bytes."""
+
+		self.done += 1
+		self.bytes += size
+
+	def due(self):
+		"""Return ``True`` at most once every ``PROGRESS_INTERVAL`` seconds."""
+
+		now = time.monotonic()
+
+		if now - self._reported >= PROGRESS_INTERVAL:
+			self._reported = now
+
+			return True
+
+		return False
+
+	def __str__(self):
+		elapsed = max(time.monotonic() - self.started, 1e-6)
+		song_rate = self.done / elapsed
+		byte_rate = self.bytes / elapsed
+
+		if song_rate and self.total is not None:
+			eta = time.strftime('%H:%M:%S', time.gmtime((self.total - self.done) / song_rate))
+		else:
+			eta = "--:--:--"
+
+		return "{done}/{total} song(s) | {song_rate:.2f} songs/s | {mb_rate:.2f} MB/s | ETA {eta}".format(
+			done=self.done, total=self.total if self.total is not None else '?',
+			song_rate=song_rate, mb_rate=byte_rate / 1000000, eta=eta
+		)
+
+
+def _download_song(api, song, template, writer, retries=3, backoff=1, limiter=None, scheduler=None, stats=None):
+	"""Download a song into its target directory and move it to its templated filepath once it's verified."""
+
+	song_id = song['id']
+
+	title = song.get('title', "<empty>")
+	artist = song.get('artist', "<empty>")
+	album = song.get('album', "<empty>")
+
+	logger.debug(
+		"Downloading {title} -- {artist} -- {album} ({song_id})".format(title=title, artist=artist, album=album, song_id=song_id)
+	)
+
+	def on_retry(attempt, e, delay):
+		logger.debug("Retrying download of {0} in {1}s after error: {2}".format(song_id, delay, e))
+
+		if stats is not None:
+			stats.add(retries=1)
+
+	_, audio = scheduled(
+		scheduler, 'download', api.download_song, song_id, retries=retries, backoff=backoff, on_retry=on_retry
+	)
+
+	filepath = template.song_filepath(song)
+
+	# Songs whose filepath needs the downloaded file's tags are written under the template's literal directories,
+	# usually on the same filesystem as their filepath.
+	directory = os.path.dirname(filepath) if filepath is not None else template.literal_prefix()
+
+	# gmusicapi returns the whole file, so its length is the size to preallocate and verify.
+	with writer.open(directory, size=len(audio)) as part:
+		for chunk in iter_chunks(audio):
+			if limiter is not None:
+				limiter.consume(len(chunk))
+
+			part.write(chunk)
+
+		part.finish()
+
+		if filepath is None:
+			import mutagen
+
+			tags = mutagen.File(part.path, easy=True) or {}
+			filepath = template.render(dict((key, value[0]) for key, value in tags.items() if value))
+
+		filepath += '.mp3'
+		part.commit(filepath)
+
+	return filepath, part.size
+
+
+def _with_slot(slots, function, *args, **kwargs):
+	"""Call a function while holding one of a shared pool of transfer slots, if given."""
+
+	if slots is None:
+		return function(*args, **kwargs)
+
+	with slots:
+		return function(*args, **kwargs)
+
+
+def download_songs(
+		api, songs, template=None, jobs=1, retries=3, backoff=1, max_rate=None,
+		journal=None, stats=None, slots=None, scheduler=None):
+	"""Download Google Music songs with a pool of concurrent workers.
+
+	Parameters:
+		api: An authenticated gmusicapi ``Musicmanager`` (e.g. ``MusicManagerWrapper.api``)
+			or any object with a compatible ``download_song(song_id)`` method.
+
+		songs (list or iterable): Google Music song dicts.
+			Lazy iterables are consumed only a few items ahead of the downloads in flight.
+
+		template (str or PathTemplate): A filepath which can include template patterns
+			or a :class:`PathTemplate` holding filepaths rendered while planning. Default: Current directory.
+
+		jobs (int): Number of songs to download at once. Default: ``1``
+
+		retries (int): Number of times a failed download is retried. Default: ``3``
+
+		backoff (float): Seconds to wait before the first retry of a song. Doubled for each retry. Default: ``1``
+
+		max_rate (int): Maximum average combined download rate in bytes per second. See :class:`RateLimiter`.
+			Default: No limit.
+
+		journal (TransferJournal): Journal to record each result in. Default: Don't record results.
+
+		stats (Phase): Stats phase to count downloaded songs, bytes and retries in. Default: Don't count.
+
+		slots (threading.Semaphore): Transfer slots shared with other transfers (e.g. uploads in :func:`sync_songs`).
+			Each download holds a slot while it runs. Default: Only limited by jobs.
+
+		scheduler (Scheduler): Adaptive rate limits to make ``download_song`` calls within. Default: Plain retries.
+
+	Returns:
+		A list of result dictionaries in song order.
+		::
+
+			[
+				{'result': 'downloaded', 'id': song_id, 'filepath': filepath},  # downloaded
+				{'result': 'error', 'id': song_id, 'message': error}  # error
+			]
+	"""
+
+	if not isinstance(template, PathTemplate):
+		template = PathTemplate(template)
+
+	if scheduler is not None:
+		scheduler.endpoint('download', max_concurrency=jobs)
+
+	limiter = RateLimiter(max_rate) if max_rate else None
+	writer = DownloadWriter()
+	progress = Progress(len(songs) if hasattr(songs, '__len__') else None)
+	pad = len(str(progress.total)) if progress.total is not None else 0
+	total = progress.total if progress.total is not None else '?'
+	window = max(1, jobs) * 2
+	pending = {}
+	results = []
+	errors = {}
+
+	def handle(future):
+		position, song = pending.pop(future)
+		song_id = song['id']
+
+		try:
+			filepath, size = future.result()
+		except Exception as e:
+			progress.update()
+
+			title = song.get('title', "<empty>")
+			artist = song.get('artist', "<empty>")
+			album = song.get('album', "<empty>")
+
+			logger.info(
+				"({num:>{pad}}/{total}) Error on download -- {title} -- {artist} -- {album} ({song_id})".format(
+					num=progress.done, pad=pad, total=total, title=title, artist=artist, album=album, song_id=song_id
+				)
+			)
+
+			result = {'result': 'error', 'id': song_id, 'message': e}
+			errors[song_id] = e
+			size = 0
+		else:
+			progress.update(size)
+
+			logger.info(
+				"({num:>{pad}}/{total}) Successfully downloaded -- {file} ({song_id})".format(
+					num=progress.done, pad=pad, total=total, file=filepath, song_id=song_id
+				)
+			)
+
+			result = {'result': 'downloaded', 'id': song_id, 'filepath': filepath}
+
+		results.append((position, result))
+
+		if journal is not None:
+			journal.record(song_id, result['result'], size)
+
+		if stats is not None:
+			stats.add(items=1, size=size)
+
+		if progress.due():
+			logger.info(str(progress))
+
+	with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+		for position, song in enumerate(songs):
+			# Only keep a bounded number of downloads in flight so lazy iterables aren't consumed far ahead.
+			while len(pending) >= window:
+				done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+				for future in done:
+					handle(future)
+
+			future = executor.submit(
+				_with_slot, slots, _download_song, api, song, template, writer,
+				retries=retries, backoff=backoff, limiter=limiter, scheduler=scheduler, stats=stats
+			)
+			pending[future] = (position, song)
+
+		while pending:
+			done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+			for future in done:
+				handle(future)
+
+	logger.info("\n{}".format(progress))
+
+	if writer.removed:
+		logger.info("\nRemoved {} partial download(s) left by interrupted runs".format(writer.removed))
+
+	if errors:
+		logger.info("\n\nThe following errors occurred:\n")
+
+		for song_id, e in errors.items():
+			logger.info("{song_id} | {error}".format(song_id=song_id, error=e))
+
+		logger.info("\nThese songs may need to be synced again.\n")
+
+	return [result for _, result in sorted(results, key=lambda item: item[0])]
+
+
+def _upload_song(
+		api, filepath, enable_matching=False, transcode_quality='320k', retries=0, backoff=1,
+		upload_path=None, scheduler=None, stats=None):
+	"""Upload a song, retrying on call failures.
+
+	If upload_path is given (e.g. a transcoded copy), that file is uploaded and results are keyed by filepath.
+	"""
+
+	if upload_path is None or not os.path.exists(upload_path):
+		upload_path = filepath
+
+	logger.debug("Uploading -- {}".format(filepath))
+
+	def on_retry(attempt, e, delay):
+		logger.debug("Retrying upload of {0} in {1}s after error: {2}".format(filepath, delay, e))
+
+		if stats is not None:
+			stats.add(retries=1)
+
+	results = scheduled(
+		scheduler, 'upload', api.upload, upload_path, enable_matching=enable_matching, transcode_quality=transcode_quality,
+		retries=retries, backoff=backoff, on_retry=on_retry
+	)
+
+	if upload_path == filepath:
+		return results
+
+	return tuple({filepath if path == upload_path else path: value for path, value in result.items()} for result in results)
+
+
+def upload_songs(
+		api, filepaths, enable_matching=False, transcode_quality='320k', delete_on_success=False,
+		jobs=1, retries=0, backoff=1, journal=None, stats=None, slots=None, scheduler=None, transcoded=None):
+	"""Upload local songs to Google Music with a pool of concurrent workers.
+
+	All workers share the given authenticated client session.
+
+	Parameters:
+		api: An authenticated gmusicapi ``Musicmanager`` (e.g. ``MusicManagerWrapper.api``)
+			or any object with a compatible ``upload(filepath, enable_matching, transcode_quality)`` method.
+
+		filepaths (list or iterable): Filepaths to upload.
+			Lazy iterables are consumed only a few items ahead of the uploads in flight.
+
+		enable_matching (bool): If ``True`` attempt to use scan and match. Default: ``False``
+
+		transcode_quality (str or int): Passed to ffmpeg/avconv when transcoding. Default: ``320k``
+
+		delete_on_success (bool): Delete each local file as soon as it is successfully uploaded. Default: ``False``
+
+		jobs (int): Number of songs to upload at once. Default: ``1``
+
+		retries (int): Number of times an upload that raises is retried. Default: ``0``
+
+		backoff (float): Seconds to wait before the first retry of a song. Doubled for each retry. Default: ``1``
+
+		journal (TransferJournal): Journal to record each result in. Default: Don't record results.
+
+		stats (Phase): Stats phase to count uploaded songs, bytes and retries in. Default: Don't count.
+
+		slots (threading.Semaphore): Transfer slots shared with other transfers (e.g. downloads in :func:`sync_songs`).
+			Each upload holds a slot while it runs. Default: Only limited by jobs.
+
+		scheduler (Scheduler): Adaptive rate limits to make ``upload`` calls within. Default: Plain retries.
+
+		transcoded (dict): Files to upload instead of filepaths, by filepath (e.g. :attr:`Transcoder.outputs`).
+			Looked up as each filepath is consumed, so it may be filled by the iterable of filepaths.
+			Default: Upload filepaths as they are.
+
+	Returns:
+		A list of result dictionaries in filepath order.
+		::
+
+			[
+				{'result': 'uploaded', 'filepath': <filepath>, 'id': <song_id>},  # uploaded
+				{'result': 'matched', 'filepath': <filepath>, 'id': <song_id>},  # matched
+				{'result': 'error', 'filepath': <filepath>, 'message': <error_message>},  # error
+				{'result': 'not_uploaded', 'filepath': <filepath>, 'id': <song_id>, 'message': <reason_message>},  # not_uploaded ALREADY_EXISTS
+				{'result': 'not_uploaded', 'filepath': <filepath>, 'message': <reason_message>}  # not_uploaded
+			]
+	"""
+
+	from gmusicapi_wrapper.constants import GM_ID_RE
+
+	if scheduler is not None:
+		scheduler.endpoint('upload', max_concurrency=jobs)
+
+	progress = Progress(len(filepaths) if hasattr(filepaths, '__len__') else None)
+	pad = len(str(progress.total)) if progress.total is not None else 0
+	total = progress.total if progress.total is not None else '?'
+	window = max(1, jobs) * 2
+	pending = {}
+	results = []
+	errors = {}
+
+	def handle(future):
+		position, filepath = pending.pop(future)
+
+		try:
+			uploaded, matched, not_uploaded = future.result()
+		except Exception as e:
+			uploaded, matched, not_uploaded, error = {}, {}, {}, {filepath: e}
+		else:
+			error = {}
+
+		try:
+			size = os.path.getsize(filepath)
+		except OSError:
+			size = 0
+
+		progress.update(size)
+		num = progress.done
+
+		if uploaded:
+			logger.info(
+				"({num:>{pad}}/{total}) Successfully uploaded -- {file} ({song_id})".format(
+					num=num, pad=pad, total=total, file=filepath, song_id=uploaded[filepath]
+				)
+			)
+
+			result = {'result': 'uploaded', 'filepath': filepath, 'id': uploaded[filepath]}
+		elif matched:
+			logger.info(
+				"({num:>{pad}}/{total}) Successfully scanned and matched -- {file} ({song_id})".format(
+					num=num, pad=pad, total=total, file=filepath, song_id=matched[filepath]
+				)
+			)
+
+			result = {'result': 'matched', 'filepath': filepath, 'id': matched[filepath]}
+		elif error:
+			logger.warning("({num:>{pad}}/{total}) Error on upload -- {file}".format(num=num, pad=pad, total=total, file=filepath))
+
+			result = {'result': 'error', 'filepath': filepath, 'message': error[filepath]}
+			errors.update(error)
+		else:
+			reason = not_uploaded[filepath]
+			song_id = GM_ID_RE.search(reason) if any(exist_string in reason for exist_string in EXIST_STRINGS) else None
+
+			if song_id:
+				logger.info(
+					"({num:>{pad}}/{total}) Failed to upload -- {file} ({song_id}) | ALREADY EXISTS".format(
+						num=num, pad=pad, total=total, file=filepath, song_id=song_id.group(0)
+					)
+				)
+
+				result = {'result': 'not_uploaded', 'filepath': filepath, 'id': song_id.group(0), 'message': reason}
+			else:
+				logger.info(
+					"({num:>{pad}}/{total}) Failed to upload -- {file} | {response}".format(
+						num=num, pad=pad, total=total, file=filepath, response=reason
+					)
+				)
+
+				result = {'result': 'not_uploaded', 'filepath': filepath, 'message': reason}
+
+		results.append((position, result))
+
+		if journal is not None:
+			journal.record(filepath, result['result'], size)
+
+		if stats is not None:
+			stats.add(items=1, size=size)
+
+		success = (uploaded or matched) or (not_uploaded and 'ALREADY_EXISTS' in not_uploaded[filepath])
+
+		if success and delete_on_success:
+			try:
+				os.remove(filepath)
+			except OSError:
+				logger.warning("Failed to remove {} after successful upload".format(filepath))
+
+		if progress.due():
+			logger.info(str(progress))
+
+	with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+		for position, filepath in enumerate(filepaths):
+			# Only keep a bounded number of uploads in flight so lazy iterables aren't consumed far ahead.
+			while len(pending) >= window:
+				done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+				for future in done:
+					handle(future)
+
+			future = executor.submit(
+				_with_slot, slots, _upload_song, api, filepath, enable_matching=enable_matching,
+				transcode_quality=transcode_quality, retries=retries, backoff=backoff,
+				upload_path=transcoded.get(filepath) if transcoded is not None else None, scheduler=scheduler, stats=stats
+			)
+			pending[future] = (position, filepath)
+
+		while pending:
+			done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+			for future in done:
+				handle(future)
+
+	logger.info("\n{}".format(progress))
+
+	if errors:
+		logger.info("\n\nThe following errors occurred:\n")
+
+		for filepath, e in errors.items():
+			logger.info("{file} | {error}".format(file=filepath, error=e))
+
+		logger.info("\nThese filepaths may need to be synced again.\n")
+
+	return [result for _, result in sorted(results, key=lambda item: item[0])]
+
+
+def sync_songs(
+		api, songs_to_download, filepaths_to_upload, template=None, enable_matching=False, transcode_quality='320k',
+		delete_on_success=False, jobs=1, retries=3, backoff=1, max_rate=None, journal=None, stats=None, scheduler=None,
+		transcoded=None):
+	"""Download Google Music songs and upload local songs at the same time.
+
+	Downloads and uploads share one budget of concurrent transfers, so neither direction waits for the other to finish
+	and no more than jobs songs are transferred at once in total.
+
+	Parameters:
+		api: An authenticated gmusicapi ``Musicmanager`` with ``download_song`` and ``upload`` methods.
+
+		songs_to_download (list or iterable): Google Music song dicts. See :func:`download_songs`.
+
+		filepaths_to_upload (list or iterable): Filepaths to upload. See :func:`upload_songs`.
+
+		jobs (int): Number of songs to download or upload at once. Default: ``1``
+
+		retries (int): Number of times a failed download or upload is retried. Default: ``3``
+
+		max_rate (int): Maximum average combined download rate in bytes per second. See :class:`RateLimiter`.
+			Default: No limit.
+
+		journal (TransferJournal): Journal to record each result in. Default: Don't record results.
+
+		stats (Phase): Stats phase to count transferred songs, bytes and retries in. Default: Don't count.
+
+		scheduler (Scheduler): Adaptive rate limits to make calls within. Default: Plain retries.
+
+		Other parameters are passed to :func:`download_songs` and :func:`upload_songs`.
+
+	Returns:
+		A list of download result dictionaries and a list of upload result dictionaries.
+	"""
+
+	slots = threading.BoundedSemaphore(max(1, jobs))
+
+	with ThreadPoolExecutor(max_workers=2) as executor:
+		downloads = executor.submit(
+			download_songs, api, songs_to_download, template=template, jobs=jobs, retries=retries, backoff=backoff,
+			max_rate=max_rate, journal=journal, stats=stats, slots=slots, scheduler=scheduler
+		)
+		uploads = executor.submit(
+			upload_songs, api, filepaths_to_upload, enable_matching=enable_matching, transcode_quality=transcode_quality,
+			delete_on_success=delete_on_success, jobs=jobs, retries=retries, backoff=backoff,
+			journal=journal, stats=stats, slots=slots, scheduler=scheduler, transcoded=transcoded
+		)
+
+		return downloads.result(), uploads.result()
+
+
+def log_upload_summary(results):
+	"""Output a status table of upload results.
+
+	Every file is counted as uploaded, matched, rejected (not uploaded by Google Music) or failed (error).
+	Rejected and failed files are listed with their reason.
+	"""
+
+	statuses = {'uploaded': 'uploaded', 'matched': 'matched', 'not_uploaded': 'rejected', 'error': 'failed'}
+	counts = dict.fromkeys(['uploaded', 'matched', 'rejected', 'failed'], 0)
+
+	for result in results:
+		counts[statuses[result['result']]] += 1
+
+	logger.info(
+		"\nUploaded: {uploaded} | Matched: {matched} | Rejected: {rejected} | Failed: {failed}".format(**counts)
+	)
+
+	unsuccessful = [result for result in results if result['result'] in ('not_uploaded', 'error')]
+
+	if unsuccessful:
+		logger.info("")
+
+		for result in unsuccessful:
+			logger.info(
+				"{status:<8} | {file} | {message}".format(
+					status=statuses[result['result']], file=result['filepath'], message=result['message']
+				)
+			)
@@ -0,0 +1,150 @@
+# coding=utf-8
+
+"""Utility functions shared by the gmusicapi-scripts scripts."""
+
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# Log level of output shown even with --quiet, such as dry run listings.
+QUIET = 25
+logging.addLevelName(QUIET, "QUIET")
+
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?\s*$', re.I)
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def get_cache_dir():
+	"""Get the directory used for gmusicapi-scripts caches.
+
+	Returns:
+		``%LOCALAPPDATA%\\gmusicapi-scripts`` on Windows,
+		otherwise ``$XDG_CACHE_HOME/gmusicapi-scripts`` defaulting to ``~/.cache/gmusicapi-scripts``.
+	"""
+
+	if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+		base = os.environ['LOCALAPPDATA']
+	else:
+		base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+	return os.path.join(base, 'gmusicapi-scripts')
+
+
+def parse_size(size):
+	"""Parse a byte size with an optional K, M or G suffix (e.g. ``'512K'``, ``'2M'``).
+
+	Returns:
+		The size in bytes as an int. Raises ``ValueError`` for invalid sizes.
+	"""
+
+	match = SIZE_RE.match(str(size))
+
+	if not match:
+		raise ValueError("Invalid size: {}".format(size))
+
+	number, unit = match.groups()
+
+	return int(float(number) * SIZE_UNITS[unit.lower()])
+
+
+def chunk(items, size):
+	"""Split a list into consecutive lists of at most size items.
+
+	Parameters:
+		items (list): Items to split.
+
+		size (int): Maximum number of items in each chunk.
+
+	Returns:
+		A list of lists.
+	"""
+
+	if size < 1:
+		raise ValueError("Chunk size must be at least 1.")
+
+	return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def retry(function, *args, retries=3, backoff=1, on_retry=None, retry_delay=None, **kwargs):
+	"""Call a function, retrying with exponential backoff when it raises.
+
+	Parameters:
+		function (callable): The function to call with the remaining positional and keyword arguments.
+
+		retries (int): Number of times to retry after the first attempt fails. Default: ``3``
+
+		backoff (float): Seconds to wait before the first retry. Doubled for each subsequent retry. Default: ``1``
+
+		on_retry (callable): Called as ``on_retry(attempt, exception, delay)`` before sleeping between attempts.
+
+		retry_delay (callable): Called as ``retry_delay(exception, attempt, backoff)`` to get the seconds to wait
+			before a retry, with attempt counting from ``0``. Default: Exponential backoff.
+
+	Returns:
+		The return value of the function.
+		The last exception is raised if every attempt fails.
+	"""
+
+	attempt = 0
+
+	while True:
+		try:
+			return function(*args, **kwargs)
+		except Exception as e:
+			if attempt >= retries:
+				raise
+
+			delay = retry_delay(e, attempt, backoff) if retry_delay is not None else backoff * 2 ** attempt
+			attempt += 1
+
+			if on_retry is not None:
+				on_retry(attempt, e, delay)
+
+			time.sleep(delay)
+
+
+def buffered(iterable, size):
+	"""Iterate over an iterable in a background thread, holding at most size items ahead of the consumer.
+
+	The producer blocks when the buffer is full, so a slow consumer applies backpressure to it.
+	Exceptions raised by the iterable are re-raised in the consumer.
+
+	Parameters:
+		iterable: The iterable to consume.
+
+		size (int): Maximum number of buffered items.
+	"""
+
+	items = queue.Queue(maxsize=max(1, size))
+	done = object()
+	errors = []
+
+	def produce():
+		try:
+			for item in iterable:
+				items.put(item)
+		except Exception as e:
+			errors.append(e)
+		finally:
+			items.put(done)
+
+	thread = threading.Thread(target=produce, daemon=True)
+	thread.start()
+
+	while True:
+		item = items.get()
+
+		if item is done:
+			break
+
+		yield item
+
+	thread.join()
+
+	if errors:
+		raise errors[0]
@@ -0,0 +1,213 @@
+# coding=utf-8
+
+"""Watch local directories and upload new or changed songs.
+
+	>>> from gmusicapi_scripts.watch import Watcher
+"""
+
+import logging
+import os
+import threading
+import time
+
+from .index import read_metadata
+from .scan import ExcludeMatcher, _match_metadata
+from .transfer import upload_songs
+from .utils import QUIET
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+
+class Watcher:
+	"""Upload songs created or modified under local directories.
+
+	Events are debounced: a file is only considered once no events have been seen for it for ``delay`` seconds
+	and its size and mtime are unchanged since the last event, so partially written files are not uploaded.
+	Settled files are checked against the same extension, depth, exclude pattern and metadata filter rules as a scan.
+
+	Events can be fed with :meth:`notify` and handled with :meth:`process` directly;
+	:meth:`run` subscribes to filesystem events (inotify on Linux) using the optional ``watchdog`` package.
+
+	Parameters:
+		api: An authenticated gmusicapi ``Musicmanager`` or any object with a compatible ``upload`` method.
+			May be ``None`` with ``dry_run``.
+
+		paths (list): Directories to watch.
+
+		filters (FilterSet): Metadata filters. Default: No filters.
+
+		exclude_patterns (list): Python regex patterns. Filepaths are excluded if they match any of the exclude patterns.
+
+		max_depth (int): The depth below the watched directories to accept files from. Default: No limit.
+
+		delay (float): Seconds a file must be unchanged before it is uploaded. Default: ``2``
+
+		index (ScanIndex): Metadata index to read tags through. Default: Read every file.
+
+		enable_matching (bool): If ``True`` attempt to use scan and match. Default: ``False``
+
+		delete_on_success (bool): Delete successfully uploaded local files. Default: ``False``
+
+		retries (int): Number of times a failed upload is retried. Default: ``3``
+
+		dry_run (bool): Output songs that would be uploaded instead of uploading them. Default: ``False``
+
+		scheduler (Scheduler): Adaptive rate limits to upload within. Default: Plain retries.
+	"""
+
+	def __init__(
+			self, api, paths, filters=None, exclude_patterns=None, max_depth=float('inf'), delay=2, index=None,
+			enable_matching=False, delete_on_success=False, retries=3, dry_run=False, scheduler=None):
+		self.api = api
+		self.roots = [os.path.abspath(path) for path in paths]
+		self.filters = filters
+		self.exclude = ExcludeMatcher(exclude_patterns)
+		self.max_depth = max_depth
+		self.delay = delay
+		self.index = index
+		self.enable_matching = enable_matching
+		self.delete_on_success = delete_on_success
+		self.retries = retries
+		self.dry_run = dry_run
+		self.scheduler = scheduler
+
+		self.results = []
+
+		self._pending = {}
+		self._lock = threading.Lock()
+
+	def _stat(self, path):
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+
+		return stat.st_size, stat.st_mtime_ns
+
+	def notify(self, path, now=None):
+		"""Record a filesystem event for a file."""
+
+		from gmusicapi_wrapper import SUPPORTED_SONG_FORMATS
+
+		if not path.lower().endswith(SUPPORTED_SONG_FORMATS):
+			return
+
+		now = time.monotonic() if now is None else now
+
+		with self._lock:
+			self._pending[os.path.abspath(path)] = (now, self._stat(path))
+
+	def settled(self, now=None):
+		"""Remove and return pending files that haven't changed for ``delay`` seconds."""
+
+		now = time.monotonic() if now is None else now
+		ready = []
+
+		with self._lock:
+			for path, (seen, stat) in list(self._pending.items()):
+				if now - seen < self.delay:
+					continue
+
+				current = self._stat(path)
+
+				if current is None:
+					del self._pending[path]
+				elif current != stat:
+					# Still being written.
+					self._pending[path] = (now, current)
+				else:
+					del self._pending[path]
+					ready.append(path)
+
+		return sorted(ready)
+
+	def accept(self, path):
+		"""Check a file against the depth, exclude pattern and metadata filter rules."""
+
+		root = next((root for root in self.roots if path.startswith(os.path.join(root, ''))), None)
+
+		if root is None:
+			return False
+
+		relpath = os.path.relpath(os.path.dirname(path), root)
+		depth = 0 if relpath == os.curdir else relpath.count(os.sep) + 1
+
+		if depth > self.max_depth:
+			return False
+
+		if self.exclude.match(path):
+			logger.debug("Excluded {}".format(path))
+
+			return False
+
+		metadata = self.index.metadata(path) if self.index is not None else read_metadata(path)
+
+		if not _match_metadata(metadata, self.filters):
+			logger.debug("Filtered {}".format(path))
+
+			return False
+
+		return True
+
+	def process(self, now=None):
+		"""Upload settled files that pass the rules.
+
+		Returns:
+			A list of upload result dicts as returned by :func:`gmusicapi_scripts.transfer.upload_songs`.
+		"""
+
+		songs_to_upload = [path for path in self.settled(now) if self.accept(path)]
+
+		if not songs_to_upload:
+			return []
+
+		if self.dry_run:
+			for song in songs_to_upload:
+				logger.log(QUIET, song)
+
+			return []
+
+		results = upload_songs(
+			self.api, songs_to_upload, enable_matching=self.enable_matching,
+			delete_on_success=self.delete_on_success, retries=self.retries, scheduler=self.scheduler
+		)
+		self.results.extend(results)
+
+		return results
+
+	def run(self, interval=0.5):
+		"""Watch for filesystem events and upload songs until interrupted."""
+
+		try:
+			from watchdog.events import FileSystemEventHandler
+			from watchdog.observers import Observer
+		except ImportError:
+			raise ImportError("Watching requires the watchdog package (pip install gmusicapi-scripts[watch]).")
+
+		watcher = self
+
+		class Handler(FileSystemEventHandler):
+			def on_any_event(self, event):
+				if not event.is_directory and event.event_type in ('created', 'modified', 'moved', 'closed'):
+					watcher.notify(getattr(event, 'dest_path', None) or event.src_path)
+
+		observer = Observer()
+
+		for root in self.roots:
+			if os.path.isdir(root):
+				observer.schedule(Handler(), root, recursive=self.max_depth > 0)
+			else:
+				logger.warning("Not watching {}: not a directory".format(root))
+
+		observer.start()
+		logger.info("Watching {} for new songs. Press Ctrl+C to stop.\n".format(", ".join(self.roots)))
+
+		try:
+			while True:
+				time.sleep(interval)
+				self.process()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			observer.stop()
+			observer.join()
@@ -0,0 +1,281 @@
+# coding=utf-8
+
+"""Crash-safe writing of downloaded songs.
+
+	>>> from gmusicapi_scripts.writer import DownloadWriter
+"""
+
+import binascii
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger('gmusicapi_wrapper')
+
+# Partial downloads are hidden files named .gmdownload-<pid>-<random>.part in the directory of the song,
+# so scans don't pick them up and a crash never leaves a truncated file at a song's filepath.
+PART_PREFIX = '.gmdownload-'
+PART_SUFFIX = '.part'
+
+# Bytes written and hashed per write call.
+CHUNK_SIZE = 256 * 1024
+
+# Seconds before a partial download is removed when it can't be told whether the process writing it is still running.
+STALE_PART_AGE = 3600
+
+
+class VerifyError(IOError):
+	"""Raised when a written download doesn't match the data received."""
+
+
+def iter_chunks(data, chunk_size=CHUNK_SIZE):
+	"""Split bytes into chunks without copying them. Other iterables are assumed to yield chunks already."""
+
+	if isinstance(data, (bytes, bytearray, memoryview)):
+		view = memoryview(data)
+
+		for start in range(0, len(view), chunk_size):
+			yield view[start:start + chunk_size]
+	else:
+		for chunk in data:
+			yield chunk
+
+
+def _part_pid(name):
+	try:
+		return int(name[len(PART_PREFIX):-len(PART_SUFFIX)].split('-')[0])
+	except ValueError:
+		return None
+
+
+def _is_running(pid):
+	if os.name != 'posix':
+		return None
+
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except OSError:
+		# The process exists but belongs to another user.
+		return True
+
+	return True
+
+
+def sweep_partials(directory, max_age=STALE_PART_AGE):
+	"""Remove partial downloads left in a directory by interrupted runs.
+
+	Partial downloads of processes that are no longer running are removed.
+	Where that can't be checked (e.g. on Windows), ones not written to for max_age seconds are removed.
+
+	Partial downloads aren't repaired or completed. Songs are fetched whole and the size and checksum
+	they are verified against are only known while downloading, so their songs are downloaded again.
+
+	Parameters:
+		directory (str): Directory to sweep. Subdirectories aren't swept.
+
+		max_age (float): Seconds without writes before a partial download is considered abandoned.
+
+	Returns:
+		The number of partial downloads removed.
+	"""
+
+	try:
+		names = os.listdir(directory)
+	except OSError:
+		return 0
+
+	now = time.time()
+	removed = 0
+
+	for name in names:
+		if not (name.startswith(PART_PREFIX) and name.endswith(PART_SUFFIX)):
+			continue
+
+		path = os.path.join(directory, name)
+		pid = _part_pid(name)
+
+		try:
+			running = _is_running(pid) if pid is not None and pid != os.getpid() else None
+
+			if running or (running is None and now - os.path.getmtime(path) < max_age):
+				continue
+
+			os.remove(path)
+		except OSError:
+			continue
+
+		logger.debug("Removed partial download {}".format(path))
+		removed += 1
+
+	return removed
+
+
+def _fsync_directory(directory):
+	# Directories can't be opened for syncing on Windows. Renames there are flushed with the file.
+	if os.name != 'posix':
+		return
+
+	fd = os.open(directory, os.O_RDONLY)
+
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+
+class PartialFile:
+	"""A download written to a temporary file in its target directory and renamed into place once verified.
+
+	Use as a context manager: the temporary file is removed if the download isn't committed.
+
+	Parameters:
+		path (str): Filepath of the temporary file.
+
+		size (int): Expected size in bytes, if known. The file is preallocated to it and verified against it.
+	"""
+
+	def __init__(self, path, size=None):
+		self.path = path
+		self.expected_size = size
+		self.size = 0
+		self.committed = False
+
+		self._digest = hashlib.sha1()
+		self._file = open(path, 'xb')
+
+		if size and hasattr(os, 'posix_fallocate'):
+			try:
+				os.posix_fallocate(self._file.fileno(), 0, size)
+			except OSError:
+				# Not supported by every filesystem. The file just grows as it's written.
+				pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		if not self.committed:
+			self.discard()
+
+	def write(self, chunk):
+		"""Append a chunk of data."""
+
+		self._file.write(chunk)
+		self._digest.update(chunk)
+		self.size += len(chunk)
+
+	def finish(self):
+		"""Flush the data to disk and verify its size and checksum against the data written.
+
+		Raises :class:`VerifyError` if they don't match.
+		"""
+
+		if self._file.closed:
+			return
+
+		self._file.truncate(self.size)
+		self._file.flush()
+		os.fsync(self._file.fileno())
+		self._file.close()
+
+		if self.expected_size is not None and self.size != self.expected_size:
+			raise VerifyError(
+				"Received {0} of {1} bytes for {2}".format(self.size, self.expected_size, self.path)
+			)
+
+		digest = hashlib.sha1()
+
+		with open(self.path, 'rb') as f:
+			for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+				digest.update(chunk)
+
+		if os.path.getsize(self.path) != self.size or digest.digest() != self._digest.digest():
+			raise VerifyError("Written file doesn't match the downloaded data: {}".format(self.path))
+
+	def commit(self, filepath):
+		"""Finish the download and atomically move it to its filepath, replacing any existing file."""
+
+		self.finish()
+
+		dirname = os.path.dirname(os.path.abspath(filepath))
+		os.makedirs(dirname, exist_ok=True)
+
+		try:
+			os.replace(self.path, filepath)
+		except OSError as e:
+			if e.errno != errno.EXDEV:
+				raise
+
+			# The filepath is on another filesystem than the temporary file, so copy it to one beside it first.
+			temp_path = os.path.join(dirname, os.path.basename(self.path))
+			shutil.copyfile(self.path, temp_path)
+
+			with open(temp_path, 'rb') as f:
+				os.fsync(f.fileno())
+
+			os.replace(temp_path, filepath)
+			os.remove(self.path)
+
+		_fsync_directory(dirname)
+		self.committed = True
+
+	def discard(self):
+		"""Close and remove the temporary file."""
+
+		if not self._file.closed:
+			self._file.close()
+
+		try:
+			os.remove(self.path)
+		except OSError:
+			pass
+
+
+class DownloadWriter:
+	"""Create partial downloads in their target directories, sweeping each directory of leftovers on first use.
+
+	Shared by the workers of a run.
+	"""
+
+	def __init__(self):
+		self.removed = 0
+
+		self._swept = set()
+		self._lock = threading.Lock()
+
+	def open(self, directory, size=None):
+		"""Start a download into a directory.
+
+		Parameters:
+			directory (str): Directory the song will be saved in. Created if it doesn't exist.
+
+			size (int): Expected size in bytes, if known.
+
+		Returns:
+			A :class:`PartialFile`.
+		"""
+
+		directory = os.path.abspath(directory or os.curdir)
+		os.makedirs(directory, exist_ok=True)
+
+		with self._lock:
+			sweep = directory not in self._swept
+			self._swept.add(directory)
+
+		if sweep:
+			removed = sweep_partials(directory)
+
+			with self._lock:
+				self.removed += removed
+
+		# Random so a partial download left by an earlier process with the same pid is never reused.
+		token = binascii.hexlify(os.urandom(6)).decode('ascii')
+		name = '{0}{1}-{2}{3}'.format(PART_PREFIX, os.getpid(), token, PART_SUFFIX)
+
+		return PartialFile(os.path.join(directory, name), size=size)
@@ -39,18 +39,26 @@ setup(
 	],
 
 	install_requires=[
-		'gmusicapi-wrapper >= 0.5.0',
-		'docopt-unicode'
+		'gmusicapi >= 11.0.0, < 12',
+		'gmusicapi-wrapper >= 0.5.2',
+		'docopt-unicode',
+		'mutagen'
 	],
 
+	extras_require={
+		'watch': ['watchdog']
+	},
+
 	packages=find_packages(),
 	entry_points={
 		'console_scripts': [
-			'gmdelete=gmusicapi_scripts.gmdelete:main',
-			'gmdownload=gmusicapi_scripts.gmdownload:main',
-			'gmsearch=gmusicapi_scripts.gmsearch:main',
-			'gmsync=gmusicapi_scripts.gmsync:main',
-			'gmupload=gmusicapi_scripts.gmupload:main'
+			'gm=gmusicapi_scripts.gm:main',
+			'gmd=gmusicapi_scripts.gm:gmd',
+			'gmdelete=gmusicapi_scripts.gm:gmdelete',
+			'gmdownload=gmusicapi_scripts.gm:gmdownload',
+			'gmsearch=gmusicapi_scripts.gm:gmsearch',
+			'gmsync=gmusicapi_scripts.gm:gmsync',
+			'gmupload=gmusicapi_scripts.gm:gmupload'
 		]
 	},
 )
@@ -0,0 +1,77 @@
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from functools import partial
+
+from gmusicapi_scripts.daemon import DaemonClient, SessionDaemon, SessionWrapper, ping
+from gmusicapi_scripts.mock import MockBackend, MockMobileClientWrapper, MockMusicManagerWrapper
+
+
+class SessionDaemonTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+
+		self.path = os.path.join(self.directory, 'gmd.sock')
+		self.backend = MockBackend(size=10)
+
+		wrappers = {
+			'musicmanager': partial(MockMusicManagerWrapper, self.backend),
+			'mobileclient': partial(MockMobileClientWrapper, self.backend)
+		}
+		daemon = SessionDaemon(self.path, wrappers=wrappers)
+
+		thread = threading.Thread(target=daemon.serve)
+		thread.start()
+		self.addCleanup(thread.join)
+		self.addCleanup(self.request, 'stop')
+
+		for _ in range(100):
+			if ping(self.path) is not None:
+				break
+
+			time.sleep(0.01)
+
+	def request(self, *request):
+		client = DaemonClient(self.path)
+
+		try:
+			return client.request(*request)
+		finally:
+			client.close()
+
+	def login(self):
+		# Logging in directly with object as the wrapper class fails, so the daemon must be used.
+		wrapper = SessionWrapper('musicmanager', wrapper_class=object, socket_path=self.path)
+		self.addCleanup(wrapper.logout)
+
+		self.assertTrue(wrapper.login(oauth_filename='oauth'))
+		self.assertIsNotNone(wrapper.daemon)
+
+		return wrapper
+
+	def test_session_is_reused(self):
+		self.login()
+		self.login()
+
+		self.assertEqual(len(self.request('status')), 1)
+
+	def test_listings_see_changes_made_elsewhere(self):
+		wrapper = self.login()
+
+		self.assertEqual(len(wrapper.api.get_uploaded_songs()), 10)
+
+		# An upload that didn't go through the daemon.
+		self.backend.add({'artist': 'Artist', 'album': 'Album', 'title': 'Title', 'tracknumber': '1'})
+
+		self.assertEqual(len(wrapper.api.get_uploaded_songs()), 11)
+		self.assertEqual(self.backend.calls['get_uploaded_songs'], 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,73 @@
+# coding=utf-8
+
+import unittest
+
+from gmusicapi_scripts.deleter import delete_songs
+from gmusicapi_scripts.mock import MockBackend, MockCallFailure, MockMobileclient, MockThrottled
+from gmusicapi_scripts.stats import Phase
+
+
+class DeleteSongsTest(unittest.TestCase):
+	def client(self, error_rate=0, **kwargs):
+		backend = MockBackend(**kwargs)
+		api = MockMobileclient(backend)
+		songs = api.get_all_songs()
+
+		# Only inject errors into the deletions.
+		backend.error_rate = error_rate
+
+		return backend, api, songs
+
+	def test_deletes_in_batches(self):
+		backend, api, songs = self.client(size=250)
+		results = delete_songs(api, songs, batch_size=100)
+
+		self.assertEqual([result['batch'] for result in results], [1, 2, 3])
+		self.assertEqual([len(result['songs']) for result in results], [100, 100, 50])
+		self.assertEqual(sum(len(result['deleted']) for result in results), 250)
+		self.assertEqual(backend.calls['delete_songs'], 3)
+		self.assertEqual(list(backend.iter_songs()), [])
+
+	def test_retries_failed_batches(self):
+		backend, api, songs = self.client(size=200, error_rate=0.5, seed=1)
+		stats = Phase('delete')
+
+		results = delete_songs(api, songs, batch_size=10, jobs=4, retries=20, backoff=0, stats=stats)
+
+		self.assertTrue(all(result['error'] is None for result in results))
+		self.assertEqual(stats.items, 200)
+		self.assertGreater(stats.retries, 0)
+		self.assertEqual(sum(result['attempts'] for result in results), backend.calls['delete_songs'])
+		self.assertEqual(list(backend.iter_songs()), [])
+
+	def test_reports_batches_that_fail_every_attempt(self):
+		backend, api, songs = self.client(size=30, error_rate=1)
+		with self.assertLogs('gmusicapi_wrapper', level='WARNING') as logs:
+			results = delete_songs(api, songs, batch_size=10, retries=2, backoff=0)
+
+		for result in results:
+			self.assertIsInstance(result['error'], MockCallFailure)
+			self.assertEqual(result['attempts'], 3)
+			self.assertEqual(result['deleted'], [])
+
+		self.assertEqual(sum("Failed to delete" in line for line in logs.output), 30)
+		self.assertEqual(sum("failed after 3 attempt(s)" in line for line in logs.output), 3)
+		self.assertEqual(len(list(backend.iter_songs())), 30)
+
+	def test_bounded_concurrency(self):
+		backend, api, songs = self.client(size=40, latency=0.02, concurrency_quota=2)
+
+		results = delete_songs(api, songs, batch_size=5, jobs=2, retries=0)
+
+		self.assertTrue(all(result['error'] is None for result in results))
+		self.assertEqual(backend.throttled['delete_songs'], 0)
+
+		backend, api, songs = self.client(size=40, latency=0.02, concurrency_quota=2)
+
+		results = delete_songs(api, songs, batch_size=5, jobs=4, retries=0)
+
+		self.assertTrue(any(isinstance(result['error'], MockThrottled) for result in results))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,64 @@
+# coding=utf-8
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from gmusicapi_scripts import gmsync
+from gmusicapi_scripts.fingerprint import FingerprintCache, get_default_fingerprint_path
+from gmusicapi_scripts.mock import MockBackend
+
+
+class PruneRemoteTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		self.addCleanup(os.chdir, os.getcwd())
+
+		environ = mock.patch.dict(os.environ, {'XDG_CACHE_HOME': os.path.join(self.directory, 'cache')})
+		environ.start()
+		self.addCleanup(environ.stop)
+
+		self.backend = MockBackend(size=3)
+		self.song_ids = [song_id for song_id, *_ in self.backend.iter_songs()]
+
+		# Pretend every song in the library was uploaded from a file with known audio.
+		with FingerprintCache(get_default_fingerprint_path()) as cache:
+			for song_id in self.song_ids:
+				cache.set(song_id, 0, 0, 'digest-' + song_id)
+
+			cache.remember_uploads(
+				'oauth', [{'result': 'uploaded', 'id': song_id, 'filepath': song_id} for song_id in self.song_ids]
+			)
+
+	def run_script(self, *args):
+		argv = ['gmsync', '--no-daemon', '-q', '--retries', '0', '--skip-duplicates'] + list(args)
+
+		with mock.patch.object(sys, 'argv', argv):
+			with self.backend.installed():
+				gmsync.main()
+
+	def assert_remote_songs_kept(self):
+		with FingerprintCache(get_default_fingerprint_path()) as cache:
+			for song_id in self.song_ids:
+				self.assertEqual(cache.remote_song('oauth', 'digest-' + song_id), song_id)
+
+	def test_both_keeps_songs_left_out_by_filters(self):
+		os.chdir(self.directory)
+		self.run_script('both', '-f', 'title:Title 0000000')
+
+		self.assert_remote_songs_kept()
+
+	def test_up_keeps_songs_in_library(self):
+		os.chdir(self.directory)
+		os.makedirs('music')
+		self.run_script('up', 'music')
+
+		self.assert_remote_songs_kept()
+
+
+if __name__ == '__main__':
+	unittest.main()
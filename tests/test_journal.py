@@ -0,0 +1,68 @@
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from gmusicapi_scripts.journal import TransferJournal
+
+
+class TransferJournalTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+
+		self.path = os.path.join(self.directory, 'journal.jsonl')
+
+	def test_resume_pending(self):
+		journal = TransferJournal(self.path)
+		journal.start('upload', ['a.mp3', 'b.mp3', 'c.mp3'])
+		journal.record('a.mp3', 'uploaded')
+		journal.record('b.mp3', 'error')
+
+		self.assertEqual(journal.load(), ('upload', {}, ['b.mp3', 'c.mp3']))
+
+		journal.finish()
+
+		self.assertEqual(TransferJournal(self.path).load(kind='upload'), ('upload', {}, ['b.mp3', 'c.mp3']))
+
+		journal.record('b.mp3', 'uploaded')
+		journal.record('c.mp3', 'matched')
+		journal.finish()
+
+		self.assertFalse(os.path.exists(self.path))
+		self.assertIsNone(journal.load())
+
+	def test_load_checks_kind(self):
+		TransferJournal(self.path).start('download', [{'id': '1'}], params={'template': '%title%'})
+
+		with self.assertLogs('gmusicapi_wrapper', level='WARNING'):
+			self.assertIsNone(TransferJournal(self.path).load(kind='upload'))
+
+		self.assertEqual(TransferJournal(self.path).load(kind='download'), ('download', {'template': '%title%'}, [{'id': '1'}]))
+
+	def test_records_survive_compaction(self):
+		keys = ['{}.mp3'.format(number) for number in range(200)]
+		journal = TransferJournal(self.path)
+		journal.start('upload', keys)
+
+		def record():
+			for key in keys:
+				TransferJournal(self.path).record(key, 'uploaded')
+
+		thread = threading.Thread(target=record)
+		thread.start()
+
+		while thread.is_alive():
+			journal.finish()
+
+		thread.join()
+		journal.finish()
+
+		self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+	unittest.main()
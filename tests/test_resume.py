@@ -0,0 +1,61 @@
+# coding=utf-8
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from gmusicapi_scripts import gmdownload, gmsync
+from gmusicapi_scripts.mock import MockBackend, MockCallFailure, MockMusicmanager
+
+
+class ResumeDownloadTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		self.addCleanup(os.chdir, os.getcwd())
+
+		environ = mock.patch.dict(os.environ, {'XDG_CACHE_HOME': os.path.join(self.directory, 'cache')})
+		environ.start()
+		self.addCleanup(environ.stop)
+
+		self.backend = MockBackend(size=3)
+
+	def run_script(self, script, *args):
+		with mock.patch.object(sys, 'argv', [script.__name__, '--no-daemon', '-q', '--retries', '0'] + list(args)):
+			with self.backend.installed():
+				script.main()
+
+	def chdir(self, name):
+		path = os.path.join(self.directory, name)
+		os.makedirs(path)
+		os.chdir(path)
+
+		return path
+
+	def assert_resumes_default_output_in_another_directory(self, script, *args):
+		first = self.chdir('first')
+
+		with mock.patch.object(MockMusicmanager, 'download_song', side_effect=MockCallFailure("Injected failure")):
+			self.run_script(script, *args)
+
+		self.assertEqual(os.listdir(first), [])
+
+		second = self.chdir('second')
+		self.run_script(script, *(args + ('--resume',)))
+
+		# Songs are saved by suggested filename in the current directory rather than as the first directory's path.
+		self.assertEqual(len([name for name in os.listdir(second) if name.endswith('.mp3')]), 3)
+		self.assertFalse(os.path.exists(first + '.mp3'))
+
+	def test_gmdownload(self):
+		self.assert_resumes_default_output_in_another_directory(gmdownload)
+
+	def test_gmsync_down(self):
+		self.assert_resumes_default_output_in_another_directory(gmsync, 'down')
+
+
+if __name__ == '__main__':
+	unittest.main()
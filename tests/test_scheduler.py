@@ -0,0 +1,159 @@
+# coding=utf-8
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from gmusicapi_scripts.mock import MockBackend, MockCallFailure, MockThrottled
+from gmusicapi_scripts.scheduler import DECREASE, INCREASE, LIMITS_TTL, EndpointLimiter, Scheduler
+
+
+class EndpointLimiterTest(unittest.TestCase):
+	def test_throttle_decreases_once_per_round(self):
+		limiter = EndpointLimiter('upload', max_concurrency=8)
+		started = [limiter.acquire() for _ in range(4)]
+
+		limiter.release(started[0], throttled=True)
+
+		self.assertEqual(limiter.concurrency, 8 * DECREASE)
+		self.assertIsNotNone(limiter.rate)
+
+		rate = limiter.rate
+
+		# Calls started before the decrease were made at the old limits and don't decrease them again.
+		for call_started in started[1:]:
+			limiter.release(call_started, throttled=True)
+
+		self.assertEqual(limiter.concurrency, 8 * DECREASE)
+		self.assertEqual(limiter.rate, rate)
+		self.assertEqual(limiter.throttled, 4)
+
+		limiter.release(limiter.acquire(), throttled=True)
+
+		self.assertEqual(limiter.concurrency, 8 * DECREASE * DECREASE)
+		self.assertEqual(limiter.rate, rate * DECREASE)
+
+	def test_success_increases(self):
+		limiter = EndpointLimiter('upload', max_concurrency=4, concurrency=2, rate=1000)
+		limiter.release(limiter.acquire())
+
+		self.assertEqual(limiter.concurrency, 2 + INCREASE / 2)
+		self.assertGreater(limiter.rate, 1000)
+
+		for _ in range(20):
+			limiter.release(limiter.acquire())
+
+		self.assertEqual(limiter.concurrency, 4)
+
+	def test_concurrency_limit(self):
+		limiter = EndpointLimiter('download', max_concurrency=2)
+		started = [limiter.acquire(), limiter.acquire()]
+
+		thread = threading.Thread(target=limiter.acquire)
+		thread.start()
+		thread.join(0.1)
+
+		self.assertTrue(thread.is_alive())
+
+		limiter.release(started[0])
+		thread.join(1)
+
+		self.assertFalse(thread.is_alive())
+		self.assertEqual(limiter.in_flight, 2)
+
+	def test_retry_after_pauses_new_calls(self):
+		limiter = EndpointLimiter('listing')
+		limiter.release(limiter.acquire(), throttled=True, delay=0.2)
+
+		start = time.monotonic()
+		limiter.acquire()
+
+		self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+
+class SchedulerTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+
+		self.path = os.path.join(self.directory, 'limits.json')
+
+	def test_call_adapts_to_quota(self):
+		backend = MockBackend(size=0, quota=50)
+		scheduler = Scheduler()
+
+		for _ in range(100):
+			scheduler.call('listing', backend.call, 'get_all_songs', retries=10, backoff=0.01)
+
+		limiter = scheduler.endpoint('listing')
+
+		self.assertEqual(backend.calls['get_all_songs'] - backend.throttled['get_all_songs'], 100)
+		self.assertGreater(scheduler.throttled, 0)
+		self.assertIsNotNone(limiter.rate)
+		self.assertEqual(limiter.in_flight, 0)
+
+	def test_call_raises_after_retries(self):
+		backend = MockBackend(size=0, error_rate=1)
+		retried = []
+
+		with self.assertRaises(MockCallFailure):
+			Scheduler().call(
+				'delete', backend.call, 'delete_songs', retries=2, backoff=0.01,
+				on_retry=lambda attempt, e, delay: retried.append((attempt, delay))
+			)
+
+		self.assertEqual(retried, [(1, 0.01), (2, 0.02)])
+		self.assertEqual(backend.calls['delete_songs'], 3)
+
+	def test_retry_waits_as_asked(self):
+		errors = [MockThrottled("Too many requests", retry_after=0.05), MockCallFailure("Injected failure")]
+		retried = []
+
+		def function():
+			if errors:
+				raise errors.pop(0)
+
+			return 'done'
+
+		result = Scheduler().retry(
+			function, retries=2, backoff=0.01, on_retry=lambda attempt, e, delay: retried.append((attempt, delay))
+		)
+
+		self.assertEqual(result, 'done')
+		self.assertEqual(retried, [(1, 0.05), (2, 0.02)])
+
+	def test_learned_limits_persist(self):
+		scheduler = Scheduler(self.path)
+		upload = scheduler.endpoint('upload', max_concurrency=4)
+		upload.release(upload.acquire(), throttled=True)
+		scheduler.endpoint('download').release(scheduler.endpoint('download').acquire())
+		scheduler.save()
+
+		learned = Scheduler(self.path).endpoint('upload', max_concurrency=4)
+
+		self.assertEqual(learned.concurrency, upload.concurrency)
+		self.assertEqual(learned.rate, upload.rate)
+
+		with open(self.path, encoding='utf-8') as f:
+			self.assertEqual(sorted(json.load(f)), ['upload'])
+
+	def test_load_drops_expired_limits(self):
+		now = time.time()
+
+		with open(self.path, 'w', encoding='utf-8') as f:
+			json.dump({
+				'upload': {'concurrency': 2, 'rate': 1.5, 'updated': now - LIMITS_TTL - 1},
+				'download': {'concurrency': 3, 'rate': 4.0, 'updated': now},
+				'listing': 'invalid'
+			}, f)
+
+		self.assertEqual(Scheduler._load(self.path), {'download': {'concurrency': 3, 'rate': 4.0, 'updated': now}})
+		self.assertEqual(Scheduler._load(os.path.join(self.directory, 'missing.json')), {})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,54 @@
+# coding=utf-8
+
+import os
+import unittest
+
+from gmusicapi_wrapper.utils import template_to_filepath
+
+from gmusicapi_scripts.template import PathTemplate
+
+TEMPLATES = [
+	'%artist%/%album%/%track% - %title%',
+	'%albumartist%/%album%/%disc%-%track2% %title%',
+	os.path.join(os.sep, 'music', '%genre%', '%artist% - %title%'),
+	'%date%/%artist%/%title%'
+]
+
+# Track numbers are given as number/total, the only form template_to_filepath can zero-pad.
+
+METADATA = [
+	{'artist': 'Muse', 'album': 'Absolution', 'tracknumber': '3/14', 'title': 'Hysteria', 'albumartist': 'Muse', 'date': '2003'},
+	{'artist': 'AC/DC', 'album': 'Who Made Who?', 'tracknumber': '1/9', 'title': 'Who: Made "Who"', 'genre': 'Rock'},
+	{'artist': '', 'album': 'Al', 'tracknumber': '3/10', 'title': 'T', 'albumartist': '', 'date': ''},
+	{'album': 'Al', 'title': 'T'}
+]
+
+
+class PathTemplateTest(unittest.TestCase):
+	def test_matches_template_to_filepath(self):
+		for template in TEMPLATES:
+			path_template = PathTemplate(template)
+
+			for metadata in METADATA:
+				with self.subTest(template=template, metadata=metadata):
+					# template_to_filepath zero-pads track numbers in place.
+					expected = template_to_filepath(template, dict(metadata))
+
+					self.assertEqual(path_template.render(metadata), expected)
+
+	def test_empty_value_leaves_no_empty_component(self):
+		song = {'id': '1', 'album_artist': '', 'album': 'Al', 'track_number': 3, 'title': 'T'}
+		template = PathTemplate('%albumartist%/%album%/%track% - %title%')
+
+		self.assertEqual(template.render(song), os.path.join('Al', '03 - T'))
+		self.assertEqual(template.song_filepath(song), os.path.join('Al', '03 - T'))
+
+	def test_strict_render_without_value(self):
+		template = PathTemplate('%genre%/%title%')
+
+		self.assertIsNone(template.render({'title': 'T'}, strict=True))
+		self.assertEqual(template.render({'title': 'T'}), os.path.join('%genre%', 'T'))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,95 @@
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gmusicapi_scripts.mock import MockBackend, MockMusicManagerWrapper, write_synthetic_songs
+from gmusicapi_scripts.watch import Watcher
+
+
+class WatcherTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+
+		self.backend = MockBackend(size=0)
+		self.mmw = MockMusicManagerWrapper(self.backend)
+		self.mmw.login()
+
+	def watcher(self, **kwargs):
+		return Watcher(self.mmw.api, [self.directory], delay=2, retries=0, **kwargs)
+
+	def test_uploads_settled_songs(self):
+		filepaths = write_synthetic_songs(self.directory, range(3))
+		watcher = self.watcher()
+
+		for filepath in filepaths:
+			watcher.notify(filepath, now=0)
+
+		self.assertEqual(watcher.settled(now=1), [])
+
+		results = watcher.process(now=2)
+
+		self.assertEqual(sorted(result['filepath'] for result in results), sorted(filepaths))
+		self.assertTrue(all(result['result'] == 'uploaded' for result in results))
+		self.assertEqual(len(list(self.backend.iter_songs())), 3)
+
+		# Uploaded songs are no longer pending.
+		self.assertEqual(watcher.process(now=10), [])
+
+	def test_waits_for_changed_files(self):
+		filepath, = write_synthetic_songs(self.directory, [0])
+		watcher = self.watcher()
+		watcher.notify(filepath, now=0)
+
+		with open(filepath, 'ab') as f:
+			f.write(b'\0' * 16)
+
+		# Changed since the event, so it's rescheduled rather than uploaded.
+		self.assertEqual(watcher.settled(now=2), [])
+		self.assertEqual(watcher.settled(now=3), [])
+		self.assertEqual(watcher.settled(now=4), [filepath])
+
+	def test_ignores_unsupported_and_deleted_files(self):
+		filepath, = write_synthetic_songs(self.directory, [0])
+		text = os.path.join(self.directory, 'notes.txt')
+		open(text, 'w').close()
+
+		watcher = self.watcher()
+		watcher.notify(text, now=0)
+		watcher.notify(filepath, now=0)
+		os.remove(filepath)
+
+		self.assertEqual(watcher.settled(now=2), [])
+
+	def test_applies_scan_rules(self):
+		filepath, = write_synthetic_songs(self.directory, [0])
+		nested, = write_synthetic_songs(os.path.join(self.directory, 'a', 'b'), [1])
+		excluded, = write_synthetic_songs(os.path.join(self.directory, 'Podcasts'), [2])
+
+		# Synthetic songs are written two directories deep.
+		watcher = self.watcher(max_depth=2, exclude_patterns=['/Podcasts/'])
+
+		for path in (filepath, nested, excluded):
+			watcher.notify(path, now=0)
+
+		results = watcher.process(now=2)
+
+		self.assertEqual([result['filepath'] for result in results], [filepath])
+
+	def test_dry_run(self):
+		filepath, = write_synthetic_songs(self.directory, [0])
+		watcher = self.watcher(dry_run=True)
+		watcher.notify(filepath, now=0)
+
+		with self.assertLogs('gmusicapi_wrapper', level='QUIET') as logs:
+			self.assertEqual(watcher.process(now=2), [])
+
+		self.assertIn(filepath, logs.output[0])
+		self.assertEqual(self.backend.calls['upload'], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()